@@ -0,0 +1,27 @@
+""" Benchmarks of the fundcountdown models.
+
+Every module runs against its own throwaway SQLite database, seeded by
+benchmarks.generator, e.g.::
+
+    python -m benchmarks.run --scale medium --baseline baseline.json
+    python -m benchmarks.indexes --inputs 1000000
+    python -m benchmarks.load --clients 8 --duration 30
+"""
+import os
+import tempfile
+
+
+def setup_django(path=None):
+    """ Configures Django on a scratch SQLite database, returning its path.
+    """
+    os.environ.setdefault(
+        'DJANGO_SETTINGS_MODULE', 'fundcountdown.settings.base'
+    )
+    if path is None:
+        fd, path = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(fd)
+    from django.conf import settings
+    settings.DATABASES['default']['NAME'] = path
+    import django
+    django.setup()
+    return path
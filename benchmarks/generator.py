@@ -0,0 +1,190 @@
+""" Deterministic synthetic data for the benchmarks.
+
+The same scale and seed always produce the same rows. Rows are written
+with executemany in one transaction, bypassing the model signals, and
+the derived data is built afterwards the way the application does:
+Expense.objects.resolve() prices the expenses and the ledgers are
+built from CashInput.objects.ledger_totals().
+"""
+import random
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+# Sizes are per parent: accounts and expenses per fund, quotations per
+# expense and inputs per account. Categories are shared by every fund.
+Scale = namedtuple(
+    'Scale', 'funds accounts expenses quotations inputs categories'
+)
+
+SCALES = {
+    'small': Scale(funds=20, accounts=3, expenses=20, quotations=3,
+                   inputs=100, categories=10),
+    'medium': Scale(funds=200, accounts=4, expenses=40, quotations=4,
+                    inputs=250, categories=25),
+    'large': Scale(funds=1000, accounts=5, expenses=50, quotations=4,
+                   inputs=1000, categories=50),
+}
+
+START = datetime(2016, 1, 1)
+DAYS = 730
+PARTNERS = 3
+# Share of the inputs in the second currency, converted with BRL_TO_USD.
+FOREIGN_INPUTS = 0.1
+BRL_TO_USD = '0.28'
+CHUNK_SIZE = 100000
+
+
+def insert(cursor, model, rows):
+    """ Inserts ``rows`` (dicts keyed by field name) with executemany. """
+    fields = [f for f in model._meta.local_fields if not f.primary_key]
+    sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+        model._meta.db_table,
+        ', '.join(f.column for f in fields),
+        ', '.join(['%s'] * len(fields)),
+    )
+    cursor.executemany(sql, [
+        [row[f.attname] for f in fields] for row in rows
+    ])
+
+
+def insert_links(cursor, through, rows):
+    """ Inserts ``(from_id, to_id)`` rows into a many to many table. """
+    columns = [f.column for f in through._meta.local_fields
+               if not f.primary_key]
+    cursor.executemany('INSERT INTO {} ({}) VALUES (%s, %s)'.format(
+        through._meta.db_table, ', '.join(columns)
+    ), list(rows))
+
+
+def expense_row(rng, number, fund_id, start=START, partner_id=1):
+    value = rng.randint(10, 5000)
+    occurrence = rng.choice((1, 1, 1, 3, 12))
+    due_date = start + timedelta(days=rng.randint(0, DAYS))
+    return {
+        'name': 'Expense {}'.format(number),
+        'description': '',
+        'payment_required': rng.random() < 0.8,
+        '_fixed_value': value,
+        '_fixed_value_currency': 'USD',
+        '_amount_value': value * occurrence,
+        '_amount_value_currency': 'USD',
+        'resolved_value': value,
+        'resolved_value_currency': 'USD',
+        'resolved_amount': value * occurrence,
+        'resolved_amount_currency': 'USD',
+        'winning_quotation_id': None,
+        'occurrence': occurrence,
+        'entry_date': start,
+        'due_date': due_date,
+        'fund_id': fund_id,
+        'partner_id': partner_id,
+    }
+
+
+def input_rows(rng, scale, start, stop):
+    """ Yields the inputs numbered ``start`` to ``stop``. """
+    accounts = scale.funds * scale.accounts
+    for number in range(start, stop):
+        foreign = rng.random() < FOREIGN_INPUTS
+        yield {
+            'description': 'Input {}'.format(number),
+            'value': rng.randint(1, 1000),
+            'value_currency': 'USD' if foreign else 'BRL',
+            'entry_date': START + timedelta(
+                minutes=rng.randint(0, DAYS * 24 * 60)
+            ),
+            'account_id': number % accounts + 1,
+            'fingerprint': '{:040x}'.format(number),
+        }
+
+
+def generate(scale, seed=2016):
+    """ Fills an empty database with ``scale`` rows. """
+    from django.contrib.auth.models import User
+    from django.db import connection, transaction
+    from fundcountdown.cash_flow.models import Account, AccountBalance
+    from fundcountdown.cash_flow.models import CashInput, Expense
+    from fundcountdown.cash_flow.models import InputCategory, MonthlyTotal
+    from fundcountdown.cash_flow.models import Quotation, collapse_deltas
+    from fundcountdown.core.models import ExchangeRate
+    from fundcountdown.fund.models import Fund
+
+    rng = random.Random(seed)
+    with transaction.atomic():
+        for number in range(PARTNERS):
+            User.objects.create(username='partner{}'.format(number))
+        ExchangeRate.objects.create(
+            source='BRL', target='USD', rate=BRL_TO_USD
+        )
+        with connection.cursor() as cursor:
+            insert(cursor, Fund, [
+                {'name': 'Fund {}'.format(i), 'description': '',
+                 'expected_date': (
+                     START + timedelta(days=rng.randint(365, 3 * 365))
+                 ).date(),
+                 'currency': 'USD'}
+                for i in range(scale.funds)
+            ])
+            insert_links(cursor, Fund.partners.through, [
+                (fund_id, partner_id)
+                for fund_id in range(1, scale.funds + 1)
+                for partner_id in range(1, PARTNERS + 1)
+            ])
+            insert(cursor, Account, [
+                {'name': 'Account {}'.format(i), 'description': '',
+                 'fund_id': i % scale.funds + 1}
+                for i in range(scale.funds * scale.accounts)
+            ])
+            insert(cursor, InputCategory, [
+                {'name': 'Category {}'.format(i), 'description': ''}
+                for i in range(scale.categories)
+            ])
+            expenses = scale.funds * scale.expenses
+            insert(cursor, Expense, [
+                expense_row(
+                    rng, i, i % scale.funds + 1,
+                    partner_id=rng.randint(1, PARTNERS)
+                )
+                for i in range(expenses)
+            ])
+            quotations = []
+            for expense_id in range(1, expenses + 1):
+                # Most expenses let the cheapest quotation win.
+                winner = rng.randrange(scale.quotations * 4)
+                for i in range(scale.quotations):
+                    row = expense_row(
+                        rng, i, (expense_id - 1) % scale.funds + 1,
+                        partner_id=rng.randint(1, PARTNERS)
+                    )
+                    row.update(is_winner=i == winner, expense_id=expense_id)
+                    quotations.append(row)
+            insert(cursor, Quotation, quotations)
+
+            inputs = scale.funds * scale.accounts * scale.inputs
+            for chunk in range(0, inputs, CHUNK_SIZE):
+                stop = min(chunk + CHUNK_SIZE, inputs)
+                insert(cursor, CashInput, input_rows(rng, scale, chunk, stop))
+                if scale.categories:
+                    insert_links(cursor, CashInput.category.through, [
+                        (pk, rng.randint(1, scale.categories))
+                        for pk in range(chunk + 1, stop + 1)
+                        if rng.random() < 0.7
+                    ])
+
+        Expense.objects.resolve()
+        deltas = CashInput.objects.ledger_totals()
+        MonthlyTotal.objects.bulk_create([
+            MonthlyTotal(
+                account_id=account_id, currency=currency, month=month,
+                amount=amount
+            )
+            for (account_id, currency, month), amount in deltas.items()
+        ])
+        AccountBalance.objects.bulk_create([
+            AccountBalance(
+                account_id=account_id, currency=currency, amount=amount
+            )
+            for (account_id, currency), amount in collapse_deltas(
+                deltas, 2
+            ).items()
+        ])
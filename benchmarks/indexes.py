@@ -0,0 +1,151 @@
+""" Query plans and timings of the hot filters with and without the
+composite indexes (``index_together``) of the cash_flow models.
+
+    python -m benchmarks.indexes --inputs 1000000
+
+Seeds a scratch SQLite database, drops the composite indexes, runs every
+query, then builds the indexes again and repeats.
+"""
+import argparse
+import os
+import time
+from datetime import datetime, timedelta
+from benchmarks import setup_django
+from benchmarks.generator import Scale, generate
+
+
+def seed(options):
+    """ Spreads the totals of the options over a generator Scale. """
+    funds = options.funds
+    accounts = max(options.accounts // funds, 1)
+    generate(Scale(
+        funds=funds,
+        accounts=accounts,
+        expenses=max(options.expenses // funds, 1),
+        quotations=options.quotations,
+        inputs=max(options.inputs // (funds * accounts), 1),
+        categories=0,
+    ), options.seed)
+
+
+def hot_queries(options):
+    from django.db.models import Sum
+    from django.utils import timezone
+    from fundcountdown.cash_flow.models import CashInput, Expense, Quotation
+
+    since = timezone.make_aware(datetime(2016, 6, 1), timezone.utc)
+    until = since + timedelta(days=30)
+    expense = options.expenses // 2
+    return [
+        ('CashInput(account, entry_date)', CashInput.objects.filter(
+            account=options.accounts // 2, entry_date__range=(since, until)
+        ).values('account').annotate(total=Sum('value'))),
+        ('Quotation(expense, is_winner)', Quotation.objects.filter(
+            expense=expense, is_winner=True
+        ).order_by('pk')[:1]),
+        ('Quotation(expense, _amount_value)', Quotation.objects.filter(
+            expense=expense
+        ).order_by('_amount_value')[:1]),
+        ('Expense(fund, payment_required, due_date)', Expense.objects.filter(
+            fund=options.funds // 2,
+            due_date__lt=since,
+            payment_required=True
+        ).order_by('due_date')),
+    ]
+
+
+def set_indexes(enabled):
+    """ Drops or builds the index_together indexes of the cash_flow models.
+
+    The indexes to drop are found by introspection; the built ones are
+    named after their table and columns.
+    """
+    from django.apps import apps
+    from django.db import connection
+
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        for model in apps.get_app_config('cash_flow').get_models():
+            table = model._meta.db_table
+            constraints = connection.introspection.get_constraints(
+                cursor, table
+            )
+            for names in model._meta.index_together:
+                columns = [model._meta.get_field(name).column
+                           for name in names]
+                if enabled:
+                    name = '_'.join([table] + columns + ['idx'])
+                    cursor.execute('CREATE INDEX {} ON {} ({})'.format(
+                        quote(name[:connection.ops.max_name_length()]),
+                        quote(table),
+                        ', '.join(quote(column) for column in columns)
+                    ))
+                    continue
+                for name, details in constraints.items():
+                    if details['index'] and not details['unique'] and \
+                            details['columns'] == columns:
+                        cursor.execute('DROP INDEX {}'.format(quote(name)))
+
+
+def measure(options):
+    from django.db import connection
+
+    explain = 'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' \
+        else 'EXPLAIN '
+    results = {}
+    for name, queryset in hot_queries(options):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(explain + sql, params)
+            plan = [' '.join(str(c) for c in row) for row in cursor]
+            started = time.time()
+            for _ in range(options.runs):
+                cursor.execute(sql, params)
+                cursor.fetchall()
+            elapsed = (time.time() - started) / options.runs
+        results[name] = (plan, elapsed)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--inputs', type=int, default=1000000)
+    parser.add_argument('--accounts', type=int, default=200)
+    parser.add_argument('--funds', type=int, default=50)
+    parser.add_argument('--expenses', type=int, default=5000)
+    parser.add_argument('--quotations', type=int, default=4)
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=2016)
+    parser.add_argument('--database', help='SQLite file, temporary if unset.')
+    options = parser.parse_args()
+
+    path = setup_django(options.database)
+    from django.core.management import call_command
+
+    call_command('migrate', verbosity=0)
+    set_indexes(False)
+    started = time.time()
+    seed(options)
+    print('Seeded {} inputs in {:.1f}s'.format(
+        options.inputs, time.time() - started
+    ))
+
+    before = measure(options)
+    started = time.time()
+    set_indexes(True)
+    print('Built indexes in {:.1f}s'.format(time.time() - started))
+    after = measure(options)
+
+    for name, (plan, elapsed) in before.items():
+        new_plan, new_elapsed = after[name]
+        print('\n{}\n  before {:9.3f} ms  {}\n  after  {:9.3f} ms  {}'.format(
+            name,
+            elapsed * 1000, ' | '.join(plan),
+            new_elapsed * 1000, ' | '.join(new_plan),
+        ))
+    if options.database is None:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
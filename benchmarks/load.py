@@ -0,0 +1,254 @@
+""" Load test of the request path of fundcountdown.wsgi.application.
+
+    python -m benchmarks.load --scale small --clients 8 --duration 30
+
+Seeds a scratch SQLite database with benchmarks.generator (or reuses a
+seeded ``--database``), serves the WSGI application on a local threaded
+server and has ``--clients`` threads request the API endpoints in turn
+for ``--duration`` seconds. Reports the throughput and the p50/p95/p99
+latency of every URL, optionally as JSON to compare settings or code
+changes on the same machine.
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import threading
+import time
+from collections import OrderedDict
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer
+from wsgiref.simple_server import make_server
+from benchmarks import setup_django
+from benchmarks.generator import SCALES, Scale, generate
+
+HOST = 'localhost'
+PERCENTILES = (50, 95, 99)
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+    # Every client may open a connection at once.
+    request_queue_size = 128
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+URLS = [
+    ('account balance series',
+     '/api/accounts/{account}/balance-series/?period=week'),
+    ('fund balance series', '/api/funds/{fund}/balance-series/?period=month'),
+    ('fund schedule',
+     '/api/funds/{fund}/schedule/?since=2016-06-01&until=2016-12-31'),
+    ('category report', '/api/categories/report/?fund={fund}'),
+    ('dashboard', '/api/dashboard/'),
+    ('partner shares', '/api/partners/'),
+]
+
+
+def urls(scale, seed):
+    """ Returns ``[(name, path)]``, the same ones for the same seed. """
+    rng = random.Random(seed)
+    fund = rng.randint(1, scale.funds)
+    account = rng.randint(1, scale.funds * scale.accounts)
+    return [
+        (name, path.format(fund=fund, account=account))
+        for name, path in URLS
+    ]
+
+
+def session_cookie(username):
+    """ Logs ``username`` in, returning the Cookie header of the session. """
+    from django.conf import settings
+    from django.contrib.auth.models import User
+    from django.test import Client
+
+    client = Client()
+    client.force_login(User.objects.get(username=username))
+    return '{}={}'.format(
+        settings.SESSION_COOKIE_NAME,
+        client.cookies[settings.SESSION_COOKIE_NAME].value
+    )
+
+
+def percentile(ordered, percent):
+    """ Nearest rank percentile of a sorted list. """
+    if not ordered:
+        return None
+    rank = max(int(round(percent / 100.0 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+class Client(threading.Thread):
+    """ Requests the URLs in turn until ``deadline``, recording
+    ``(name, status, seconds)`` samples.
+    """
+
+    def __init__(self, port, urls, cookie, deadline, offset):
+        super(Client, self).__init__()
+        self.daemon = True
+        self.port = port
+        self.urls = urls
+        self.headers = {'Host': HOST, 'Cookie': cookie}
+        self.deadline = deadline
+        self.offset = offset
+        self.samples = []
+
+    def run(self):
+        turn = self.offset
+        while time.time() < self.deadline:
+            name, path = self.urls[turn % len(self.urls)]
+            turn += 1
+            started = time.perf_counter()
+            try:
+                connection = http.client.HTTPConnection(
+                    '127.0.0.1', self.port, timeout=60
+                )
+                connection.request('GET', path, headers=self.headers)
+                response = connection.getresponse()
+                response.read()
+                status = response.status
+                connection.close()
+            except (OSError, http.client.HTTPException):
+                status = None
+            self.samples.append(
+                (name, status, time.perf_counter() - started)
+            )
+
+
+def report(samples, elapsed, urls):
+    by_url = OrderedDict((name, []) for name, _ in urls)
+    errors = dict.fromkeys(by_url, 0)
+    for name, status, seconds in samples:
+        by_url[name].append(seconds)
+        if status is None or status >= 400:
+            errors[name] += 1
+    result = OrderedDict()
+    for name, latencies in by_url.items():
+        latencies.sort()
+        result[name] = OrderedDict(
+            [('requests', len(latencies)),
+             ('errors', errors[name]),
+             ('throughput', round(len(latencies) / elapsed, 2))] +
+            [('p{}_ms'.format(p), round(percentile(latencies, p) * 1000, 2)
+              if latencies else None) for p in PERCENTILES]
+        )
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--scale', choices=sorted(SCALES), default='small')
+    for field in Scale._fields:
+        parser.add_argument(
+            '--' + field, type=int, help='Overrides the scale.'
+        )
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument(
+        '--duration', type=float, default=30, help='Seconds of load.'
+    )
+    parser.add_argument(
+        '--warmup', type=float, default=2,
+        help='Seconds of load before measuring.'
+    )
+    parser.add_argument(
+        '--url', action='append', choices=[name for name, _ in URLS],
+        help='Only the URLs with this name (repeatable).'
+    )
+    parser.add_argument('--seed', type=int, default=2016)
+    parser.add_argument('--database', help='SQLite file, temporary if unset.')
+    parser.add_argument('--output', help='JSON results file.')
+    options = parser.parse_args()
+    scale = SCALES[options.scale]._replace(**{
+        field: getattr(options, field) for field in Scale._fields
+        if getattr(options, field) is not None
+    })
+    targets = [
+        (name, url) for name, url in urls(scale, options.seed)
+        if not options.url or name in options.url
+    ]
+    if not targets:
+        parser.error('no URL to request')
+
+    path = setup_django(options.database)
+    from django.conf import settings
+    from django.core.management import call_command
+    from fundcountdown.fund.models import Fund
+
+    call_command('migrate', verbosity=0)
+    if not Fund.objects.exists():
+        started = time.time()
+        generate(scale, options.seed)
+        print('Seeded {} in {:.1f}s'.format(
+            dict(scale._asdict()), time.time() - started
+        ))
+    cookie = session_cookie('partner0')
+
+    from fundcountdown.wsgi import application
+    server = make_server(
+        '127.0.0.1', 0, application, server_class=ThreadingWSGIServer,
+        handler_class=QuietHandler
+    )
+    port = server.server_address[1]
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    def load(seconds):
+        deadline = time.time() + seconds
+        clients = [
+            Client(port, targets, cookie, deadline, offset)
+            for offset in range(options.clients)
+        ]
+        started = time.time()
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        return (
+            [sample for client in clients for sample in client.samples],
+            time.time() - started
+        )
+
+    if options.warmup:
+        load(options.warmup)
+    samples, elapsed = load(options.duration)
+    server.shutdown()
+    server.server_close()
+
+    results = OrderedDict([
+        ('scale', OrderedDict(scale._asdict())),
+        ('clients', options.clients),
+        ('duration', round(elapsed, 2)),
+        ('debug', settings.DEBUG),
+        ('python', platform.python_version()),
+        ('throughput', round(len(samples) / elapsed, 2)),
+        ('urls', report(samples, elapsed, targets)),
+    ])
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if options.database is None:
+        os.remove(path)
+
+    print('{} requests in {:.1f}s with {} clients, {:.1f} req/s'.format(
+        len(samples), elapsed, options.clients, results['throughput']
+    ))
+    print('{:24} {:>13} {:>9} {:>9} {:>9}'.format(
+        'url', 'throughput', *['p{}'.format(p) for p in PERCENTILES]
+    ))
+    for name, figures in results['urls'].items():
+        # No percentiles for a URL without samples.
+        latencies = [figures['p{}_ms'.format(p)] for p in PERCENTILES]
+        print('{:24} {:7.1f} req/s {:>9} {:>9} {:>9} ms  {} errors'.format(
+            name, figures['throughput'],
+            *['-' if value is None else value for value in latencies] +
+            [figures['errors']]
+        ))
+
+
+if __name__ == '__main__':
+    main()
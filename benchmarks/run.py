@@ -0,0 +1,236 @@
+""" Wall time, query count and peak memory of the model properties at
+scale, compared with a saved baseline.
+
+    python -m benchmarks.run --scale medium --output results.json
+    python -m benchmarks.run --scale medium --baseline results.json
+
+Seeds a scratch SQLite database with benchmarks.generator (or reuses a
+seeded ``--database``), runs every scenario with a cold property cache
+and writes the results as JSON. With ``--baseline``, scenarios slower or
+hungrier than the baseline by more than ``--threshold``, or taking more
+queries, are reported as regressions and the exit status is 1.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from collections import OrderedDict
+from benchmarks import setup_django
+from benchmarks.generator import SCALES, Scale, generate
+
+SCENARIOS = OrderedDict()
+
+
+def scenario(func):
+    """ Registers a scenario. It takes the scale and returns the callable
+    to measure, which returns the number of objects it went through.
+    """
+    SCENARIOS[func.__name__] = func
+    return func
+
+
+@scenario
+def fund_full_cost(scale):
+    from fundcountdown.fund.models import Fund
+
+    funds = list(Fund.objects.all())
+
+    def run():
+        for fund in funds:
+            fund.full_cost
+        return len(funds)
+    return run
+
+
+@scenario
+def fund_amount(scale):
+    from fundcountdown.fund.models import Fund
+
+    funds = list(Fund.objects.all())
+
+    def run():
+        for fund in funds:
+            fund.amount
+        return len(funds)
+    return run
+
+
+@scenario
+def account_balance(scale):
+    from fundcountdown.cash_flow.models import Account
+
+    accounts = list(Account.objects.select_related('fund'))
+
+    def run():
+        for account in accounts:
+            account.balance
+        return len(accounts)
+    return run
+
+
+@scenario
+def category_amount(scale):
+    from fundcountdown.cash_flow.models import InputCategory
+
+    categories = list(InputCategory.objects.all())
+
+    def run():
+        for category in categories:
+            category.amount()
+        return len(categories)
+    return run
+
+
+@scenario
+def quotation_save(scale):
+    from django.db import transaction
+    from fundcountdown.cash_flow.models import Quotation
+
+    # One quotation of each of the first 100 expenses of the first funds
+    # becomes its winner; the writes are rolled back so every run starts
+    # from the same data.
+    quotations = OrderedDict()
+    for quotation in Quotation.objects.filter(
+            is_winner=False, fund__lte=min(scale.funds, 20)
+    ).order_by('fund', 'expense', 'pk'):
+        quotations.setdefault(quotation.expense_id, quotation)
+    quotations = list(quotations.values())[:100]
+
+    def run():
+        with transaction.atomic():
+            for quotation in quotations:
+                quotation.is_winner = True
+                quotation.save()
+            transaction.set_rollback(True)
+        for quotation in quotations:
+            quotation.is_winner = False
+        return len(quotations)
+    return run
+
+
+def measure(run, runs):
+    """ Returns the best wall time of ``runs`` cold runs, with the queries
+    and the peak memory of one of them.
+    """
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+    from fundcountdown.core.cache import get_cache
+
+    best = None
+    for _ in range(runs):
+        get_cache().clear()
+        gc.collect()
+        started = time.perf_counter()
+        count = run()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+
+    get_cache().clear()
+    with CaptureQueriesContext(connection) as queries:
+        run()
+    get_cache().clear()
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return OrderedDict([
+        ('seconds', round(best, 6)),
+        ('queries', len(queries)),
+        ('peak_kib', round(peak / 1024.0, 1)),
+        ('objects', count),
+    ])
+
+
+def regressions(results, baseline, threshold):
+    """ Yields ``(scenario, metric, baseline, current)`` for every figure
+    that got worse than the baseline allows.
+    """
+    for name, current in results['scenarios'].items():
+        before = baseline.get('scenarios', {}).get(name)
+        if before is None:
+            continue
+        if current['queries'] > before['queries']:
+            yield name, 'queries', before['queries'], current['queries']
+        for metric in ('seconds', 'peak_kib'):
+            if current[metric] > before[metric] * (1 + threshold):
+                yield name, metric, before[metric], current[metric]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--scale', choices=sorted(SCALES), default='small')
+    for field in Scale._fields:
+        parser.add_argument(
+            '--' + field, type=int, help='Overrides the scale.'
+        )
+    parser.add_argument('--scenario', action='append', choices=SCENARIOS)
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=2016)
+    parser.add_argument('--database', help='SQLite file, temporary if unset.')
+    parser.add_argument('--output', help='JSON results file.')
+    parser.add_argument('--baseline', help='JSON results to compare with.')
+    parser.add_argument(
+        '--threshold', type=float, default=0.2,
+        help='Tolerated slowdown and memory growth, 0.2 for 20%%.'
+    )
+    options = parser.parse_args()
+    scale = SCALES[options.scale]._replace(**{
+        field: getattr(options, field) for field in Scale._fields
+        if getattr(options, field) is not None
+    })
+
+    path = setup_django(options.database)
+    import django
+    from django.core.management import call_command
+    from fundcountdown.fund.models import Fund
+
+    call_command('migrate', verbosity=0)
+    if not Fund.objects.exists():
+        started = time.time()
+        generate(scale, options.seed)
+        print('Seeded {} in {:.1f}s'.format(
+            dict(scale._asdict()), time.time() - started
+        ))
+
+    results = OrderedDict([
+        ('scale', OrderedDict(scale._asdict())),
+        ('seed', options.seed),
+        ('python', platform.python_version()),
+        ('django', django.get_version()),
+        ('scenarios', OrderedDict()),
+    ])
+    for name in options.scenario or SCENARIOS:
+        result = measure(SCENARIOS[name](scale), options.runs)
+        results['scenarios'][name] = result
+        print('{:20} {:10.2f} ms {:7} queries {:10.1f} KiB  ({} objects)'
+              .format(name, result['seconds'] * 1000, result['queries'],
+                      result['peak_kib'], result['objects']))
+
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if options.database is None:
+        os.remove(path)
+
+    if options.baseline:
+        with open(options.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('scale') != results['scale']:
+            print('Warning: the baseline was taken at scale {}.'.format(
+                baseline.get('scale')
+            ))
+        found = list(regressions(results, baseline, options.threshold))
+        for name, metric, before, current in found:
+            print('REGRESSION {} {}: {} -> {}'.format(
+                name, metric, before, current
+            ))
+        if found:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
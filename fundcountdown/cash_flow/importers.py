@@ -0,0 +1,373 @@
+""" Streaming importers of bank statements into CashInput.
+
+Parsers are generators yielding Row tuples, so files of any size are read
+one line at a time. import_inputs writes the rows in batches, each one a
+single transaction with one bulk insert for the inputs and one for their
+categories. Rows are fingerprinted (see CashInput.fingerprint), so
+importing an overlapping statement again skips what is already stored.
+Inputs entered by hand have no fingerprint and are never deduplicated.
+"""
+import csv
+import re
+import time
+from collections import namedtuple
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from django.db import transaction
+from django.db.models import Case, TextField, Value, When
+from django.utils import timezone
+from moneyed import CURRENCIES, DEFAULT_CURRENCY_CODE, Money
+from fundcountdown.cash_flow.models import Account, CashInput, InputCategory
+from fundcountdown.cash_flow.models import LEDGER_CHUNK_SIZE
+from fundcountdown.cash_flow.models import input_fingerprint
+from fundcountdown.core import metrics
+
+DEFAULT_BATCH_SIZE = 1000
+DUPLICATE_MODES = ('skip', 'update')
+
+Row = namedtuple(
+    'Row', 'line entry_date description value account categories'
+)
+
+ImportResult = namedtuple('ImportResult', 'imported duplicates')
+
+OFX_ELEMENT_RE = re.compile(r'<(/?)([A-Za-z0-9.]+)>([^<]*)')
+# Date, optional fraction of a second and optional [offset:zone name].
+OFX_DATE_RE = re.compile(
+    r'^(\d{8}(?:\d{6})?)(?:\.\d+)?'
+    r'(?:\[([+-]?\d+(?:\.\d+)?)(?::[^\]]*)?\])?$'
+)
+
+
+class ImportRowError(ValueError):
+    def __init__(self, line, message):
+        super(ImportRowError, self).__init__(
+            'Line {}: {}'.format(line, message)
+        )
+        self.line = line
+
+
+def parse_date(value, line):
+    """ Parses a statement date as an aware datetime.
+
+    OFX dates may end with their offset from GMT in hours, e.g.
+    ``20160105120000[-3:BRT]``. Dates without an offset are UTC.
+    """
+    value = value.strip()
+    tzinfo = timezone.utc
+    match = OFX_DATE_RE.match(value)
+    if match:
+        value, offset = match.groups()
+        if offset:
+            tzinfo = timezone.get_fixed_timezone(
+                int(Decimal(offset) * 60)
+            )
+    for fmt, size in (('%Y%m%d%H%M%S', 14), ('%Y%m%d', 8),
+                      ('%Y-%m-%dT%H:%M:%S', 19), ('%Y-%m-%d %H:%M:%S', 19),
+                      ('%Y-%m-%d', 10), ('%d/%m/%Y', 10)):
+        try:
+            date = datetime.strptime(value[:size], fmt)
+        except ValueError:
+            continue
+        return timezone.make_aware(date, tzinfo)
+    raise ImportRowError(line, "[{}] isn't a valid date.".format(value))
+
+
+def parse_money(amount, currency, line):
+    currency = currency.strip().upper()
+    # py-moneyed registers XYZ as the placeholder of its default currency.
+    if currency not in CURRENCIES or currency == DEFAULT_CURRENCY_CODE:
+        raise ImportRowError(
+            line, "[{}] isn't a valid currency.".format(currency)
+        )
+    try:
+        return Money(Decimal(amount.strip()), currency)
+    except InvalidOperation:
+        raise ImportRowError(
+            line, "[{}] isn't a valid Money number.".format(amount)
+        )
+
+
+def parse_csv(stream, currency='BRL', delimiter=','):
+    """ Yields the rows of a CSV statement.
+
+    Required columns are ``date``, ``description`` and ``value``. The
+    optional ``currency``, ``account`` and ``category`` columns override
+    the defaults; categories are separated by ``;``.
+    """
+    reader = csv.DictReader(stream, delimiter=delimiter)
+    for line, record in enumerate(reader, 2):
+        # Short rows leave the last columns None.
+        for column in ('date', 'description', 'value'):
+            if record.get(column) is None:
+                raise ImportRowError(
+                    line, "missing column '{}'.".format(column)
+                )
+        yield Row(
+            line=line,
+            entry_date=parse_date(record['date'], line),
+            description=record['description'].strip(),
+            value=parse_money(
+                record['value'], record.get('currency') or currency, line
+            ),
+            account=(record.get('account') or '').strip() or None,
+            categories=[
+                name.strip()
+                for name in (record.get('category') or '').split(';')
+                if name.strip()
+            ],
+        )
+
+
+def ofx_elements(stream):
+    """ Yields ``(closing, tag, value)`` for each element of an OFX stream,
+    SGML (OFX 1.x) or XML (OFX 2.x).
+    """
+    pending = ''
+    for chunk in stream:
+        pending += chunk
+        # The last element may continue in the next chunk.
+        end = pending.rfind('<')
+        complete, pending = pending[:end], pending[end:]
+        for closing, tag, value in OFX_ELEMENT_RE.findall(complete):
+            yield bool(closing), tag.upper(), value.strip()
+    for closing, tag, value in OFX_ELEMENT_RE.findall(pending):
+        yield bool(closing), tag.upper(), value.strip()
+
+
+def parse_ofx(stream, currency='BRL'):
+    """ Yields the transactions (``STMTTRN``) of an OFX statement. """
+    account = None
+    record = None
+    count = 0
+    for closing, tag, value in ofx_elements(stream):
+        if tag == 'STMTTRN':
+            if not closing:
+                record = {}
+                continue
+            count += 1
+            description = ' '.join(filter(None, [
+                record.get('NAME'), record.get('MEMO')
+            ]))
+            yield Row(
+                line=count,
+                entry_date=parse_date(record.get('DTPOSTED', ''), count),
+                description=description,
+                value=parse_money(record.get('TRNAMT', ''), currency, count),
+                account=account,
+                categories=[],
+            )
+            record = None
+        elif closing:
+            continue
+        elif record is not None:
+            record[tag] = value
+        elif tag == 'CURDEF':
+            currency = value
+        elif tag == 'ACCTID':
+            account = value
+
+
+def batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class Resolver(object):
+    """ Maps account and category names to ids, one query per new name. """
+
+    def __init__(self, account=None, categories=()):
+        self.account = account
+        self.accounts = {}
+        self.categories = {}
+        self.default_categories = [self.category(c) for c in categories]
+
+    def account_id(self, row):
+        if row.account is None:
+            if self.account is None:
+                raise ImportRowError(row.line, 'no account given.')
+            return self.account.pk
+        if row.account not in self.accounts:
+            lookup = {'name': row.account}
+            if row.account.isdigit():
+                lookup = {'pk': int(row.account)}
+            account = Account.objects.filter(**lookup).first()
+            if account is None:
+                raise ImportRowError(
+                    row.line, 'unknown account {}.'.format(row.account)
+                )
+            self.accounts[row.account] = account.pk
+        return self.accounts[row.account]
+
+    def category(self, name):
+        if name not in self.categories:
+            category = InputCategory.objects.filter(name=name).first()
+            if category is None:
+                category = InputCategory.objects.create(
+                    name=name, description=''
+                )
+            self.categories[name] = category.pk
+        return self.categories[name]
+
+    def category_ids(self, row):
+        ids = self.default_categories + [
+            self.category(name) for name in row.categories
+        ]
+        return sorted(set(ids))
+
+
+class Deduplicator(object):
+    """ Fingerprints rows and finds the ones already imported.
+
+    Identical rows of one import get increasing occurrence numbers, so
+    importing the same statement again yields the same fingerprints.
+    """
+
+    def __init__(self):
+        self.occurrences = {}
+
+    def fingerprint(self, row, account_id):
+        key = input_fingerprint(
+            account_id, row.entry_date, row.value, row.description
+        )
+        occurrence = self.occurrences.get(key, 0)
+        self.occurrences[key] = occurrence + 1
+        return input_fingerprint(
+            account_id, row.entry_date, row.value, row.description,
+            occurrence
+        )
+
+    def existing(self, inputs):
+        """ Returns ``{fingerprint: (pk, description)}`` of the stored inputs
+        in the accounts and date window of ``inputs``.
+        """
+        dates = [i.entry_date for i in inputs]
+        stored = CashInput.objects.filter(
+            account__in={i.account_id for i in inputs},
+            entry_date__range=(min(dates), max(dates)),
+            fingerprint__isnull=False,
+        ).values_list('fingerprint', 'pk', 'description')
+        return {
+            fingerprint: (pk, description)
+            for fingerprint, pk, description in stored
+        }
+
+
+def chunks(items, size=LEDGER_CHUNK_SIZE):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def link_categories(links):
+    """ Bulk inserts the missing ``(input_id, category_ids)`` links. """
+    Through = CashInput.category.through
+    links = [(pk, ids) for pk, ids in links if ids]
+    existing = set()
+    for chunk in chunks(pk for pk, _ in links):
+        existing.update(Through.objects.filter(
+            cashinput_id__in=chunk
+        ).values_list('cashinput_id', 'inputcategory_id'))
+    Through.objects.bulk_create([
+        Through(cashinput_id=pk, inputcategory_id=category_id)
+        for pk, category_ids in links
+        for category_id in category_ids
+        if (pk, category_id) not in existing
+    ])
+
+
+def update_descriptions(descriptions):
+    """ Sets the descriptions of ``{input_id: description}``, one UPDATE
+    per chunk.
+    """
+    # Three parameters per input: its pk in the When and the IN list, and
+    # its description.
+    for chunk in chunks(sorted(descriptions), LEDGER_CHUNK_SIZE // 3):
+        CashInput.objects.filter(pk__in=chunk).update(description=Case(
+            *[When(pk=pk, then=Value(descriptions[pk])) for pk in chunk],
+            output_field=TextField()
+        ))
+
+
+def write_batch(rows, resolver, deduplicator, on_duplicate='skip'):
+    """ Inserts one batch of rows with their categories.
+
+    Rows already imported are skipped, or with ``on_duplicate='update'``
+    get their description and categories updated. Returns the number of
+    ``(imported, duplicates)`` rows.
+    """
+    inputs = []
+    for row in rows:
+        account_id = resolver.account_id(row)
+        inputs.append(CashInput(
+            description=row.description,
+            value=row.value,
+            entry_date=row.entry_date,
+            account_id=account_id,
+            fingerprint=deduplicator.fingerprint(row, account_id),
+        ))
+    links = {
+        i.fingerprint: resolver.category_ids(row)
+        for i, row in zip(inputs, rows)
+    }
+    with transaction.atomic():
+        existing = deduplicator.existing(inputs)
+        new = [i for i in inputs if i.fingerprint not in existing]
+        CashInput.objects.bulk_create(new)
+        # bulk_create doesn't set primary keys, fetch them by fingerprint.
+        created = {}
+        for chunk in chunks(i.fingerprint for i in new):
+            created.update(CashInput.objects.filter(
+                fingerprint__in=chunk
+            ).values_list('fingerprint', 'pk'))
+        linked = [(created[f], links[f]) for f in created]
+
+        duplicates = [i for i in inputs if i.fingerprint in existing]
+        if on_duplicate == 'update':
+            described = {}
+            for duplicate in duplicates:
+                pk, description = existing[duplicate.fingerprint]
+                if description != duplicate.description:
+                    described[pk] = duplicate.description
+                linked.append((pk, links[duplicate.fingerprint]))
+            update_descriptions(described)
+        link_categories(linked)
+    return len(new), len(duplicates)
+
+
+@metrics.timed('import_inputs')
+def import_inputs(rows, account=None, categories=(),
+                  batch_size=DEFAULT_BATCH_SIZE, on_duplicate='skip',
+                  progress=None):
+    """ Imports parsed rows into CashInput.
+
+    ``account`` is used for rows without one and ``categories`` (names)
+    are added to every row. Rows imported before are skipped, or updated
+    with ``on_duplicate='update'``. ``progress(result, seconds)`` is called
+    after each batch. Returns an ImportResult.
+    """
+    if on_duplicate not in DUPLICATE_MODES:
+        raise ValueError(
+            "[{}] isn't a valid duplicate mode.".format(on_duplicate)
+        )
+    resolver = Resolver(account, categories)
+    deduplicator = Deduplicator()
+    started = time.time()
+    result = ImportResult(0, 0)
+    for batch in batches(rows, batch_size):
+        imported, duplicates = write_batch(
+            batch, resolver, deduplicator, on_duplicate
+        )
+        result = ImportResult(
+            result.imported + imported, result.duplicates + duplicates
+        )
+        metrics.inc('fundcountdown_imported_inputs_total', imported)
+        if progress is not None:
+            progress(result, time.time() - started)
+    return result
@@ -0,0 +1,79 @@
+import io
+import os
+from django.core.management.base import BaseCommand, CommandError
+from fundcountdown.cash_flow import importers
+from fundcountdown.cash_flow.models import Account
+
+PARSERS = {
+    'csv': importers.parse_csv,
+    'ofx': importers.parse_ofx,
+}
+
+
+class Command(BaseCommand):
+    help = 'Imports cash inputs from a CSV or OFX bank statement.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument(
+            '--format', choices=sorted(PARSERS),
+            help='Statement format, guessed from the extension by default.'
+        )
+        parser.add_argument(
+            '--account',
+            help='Name or id of the account for rows without one.'
+        )
+        parser.add_argument(
+            '--category', action='append', default=[],
+            help='Category name added to every input (repeatable).'
+        )
+        parser.add_argument('--currency', default='BRL')
+        parser.add_argument('--encoding', default='utf-8')
+        parser.add_argument(
+            '--batch-size', type=int, default=importers.DEFAULT_BATCH_SIZE
+        )
+        parser.add_argument(
+            '--on-duplicate', choices=importers.DUPLICATE_MODES,
+            default='skip',
+            help='Skip inputs imported before or update them.'
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or os.path.splitext(path)[1][1:].lower()
+        if fmt not in PARSERS:
+            raise CommandError('Unknown statement format [{}].'.format(fmt))
+
+        account = None
+        if options['account']:
+            lookup = {'name': options['account']}
+            if options['account'].isdigit():
+                lookup = {'pk': int(options['account'])}
+            account = Account.objects.filter(**lookup).first()
+            if account is None:
+                raise CommandError(
+                    'Unknown account [{}].'.format(options['account'])
+                )
+
+        with io.open(path, encoding=options['encoding'], newline='') as f:
+            rows = PARSERS[fmt](f, currency=options['currency'])
+            try:
+                result = importers.import_inputs(
+                    rows,
+                    account=account,
+                    categories=options['category'],
+                    batch_size=options['batch_size'],
+                    on_duplicate=options['on_duplicate'],
+                    progress=self.progress,
+                )
+            except importers.ImportRowError as error:
+                raise CommandError(str(error))
+        self.stdout.write('{} inputs imported, {} duplicates.'.format(
+            result.imported, result.duplicates
+        ))
+
+    def progress(self, result, seconds):
+        rows = result.imported + result.duplicates
+        self.stdout.write('{} inputs imported ({:.0f} rows/s)'.format(
+            result.imported, rows / seconds if seconds else 0
+        ))
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand, CommandError
+from fundcountdown.cash_flow.models import AccountBalance, MonthlyTotal
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuilds (or verifies) the account balance ledger and monthly '
+        'totals from inputs.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'accounts', nargs='*', type=int,
+            help='Only check these account ids.'
+        )
+        parser.add_argument(
+            '--verify', action='store_true',
+            help='Report mismatches without fixing them.'
+        )
+
+    def handle(self, *args, **options):
+        accounts = options['accounts'] or None
+        mismatches = {}
+        for ledger in (AccountBalance, MonthlyTotal):
+            if options['verify']:
+                mismatches.update(ledger.objects.mismatches(accounts))
+            else:
+                mismatches.update(ledger.objects.rebuild(accounts))
+
+        for key, (stored, expected) in sorted(mismatches.items()):
+            self.stdout.write(
+                'Account {} [{}]{}: ledger {} != inputs {}'.format(
+                    key[0], key[1],
+                    ' {:%Y-%m}'.format(key[2]) if len(key) > 2 else '',
+                    stored, expected
+                )
+            )
+        if options['verify'] and mismatches:
+            raise CommandError(
+                '{} ledger entries are out of date.'.format(len(mismatches))
+            )
+        self.stdout.write('{} ledger entries {}.'.format(
+            len(mismatches), 'out of date' if options['verify'] else 'fixed'
+        ))
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.6 on 2026-10-18 16:25
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def build_balances(apps, schema_editor):
+    CashInput = apps.get_model('cash_flow', 'CashInput')
+    AccountBalance = apps.get_model('cash_flow', 'AccountBalance')
+    totals = CashInput.objects.order_by().values_list(
+        'account', 'value_currency'
+    ).annotate(total=models.Sum('value'))
+    AccountBalance.objects.bulk_create([
+        AccountBalance(account_id=account_id, currency=currency, amount=total)
+        for account_id, currency, total in totals
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cash_flow', '0025_auto_20160508_2320'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccountBalance',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('currency', models.CharField(max_length=3)),
+                ('amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='balances', to='cash_flow.Account')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='accountbalance',
+            unique_together=set([('account', 'currency')]),
+        ),
+        migrations.RunPython(build_balances, migrations.RunPython.noop),
+    ]
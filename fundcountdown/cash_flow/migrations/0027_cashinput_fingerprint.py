@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.6 on 2026-10-18 16:30
+from __future__ import unicode_literals
+
+import hashlib
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def input_fingerprint(account_id, entry_date, value, currency, description,
+                      occurrence=0):
+    """ Copy of cash_flow.models.input_fingerprint as of this migration. """
+    if timezone.is_aware(entry_date):
+        entry_date = entry_date.astimezone(timezone.utc)
+    if not isinstance(value, Decimal):
+        value = Decimal(str(value))
+    content = '|'.join([
+        str(account_id),
+        entry_date.isoformat(),
+        str(value.quantize(Decimal('0.01'))),
+        str(currency),
+        ' '.join(description.lower().split()),
+        str(occurrence),
+    ])
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+def fill_fingerprints(apps, schema_editor):
+    CashInput = apps.get_model('cash_flow', 'CashInput')
+    seen = {}
+    inputs = CashInput.objects.order_by('pk').values_list(
+        'pk', 'account', 'entry_date', 'value', 'value_currency',
+        'description'
+    )
+    for pk, account, entry_date, value, currency, description in inputs:
+        key = input_fingerprint(
+            account, entry_date, value, currency, description
+        )
+        occurrence = seen.get(key, 0)
+        seen[key] = occurrence + 1
+        CashInput.objects.filter(pk=pk).update(fingerprint=input_fingerprint(
+            account, entry_date, value, currency, description, occurrence
+        ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cash_flow', '0026_accountbalance'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cashinput',
+            name='fingerprint',
+            field=models.CharField(editable=False, max_length=40, null=True, unique=True),
+        ),
+        migrations.RunPython(fill_fingerprints, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.6 on 2026-10-18 16:31
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+# SQLite supports partial indexes too, but only uses them for queries with
+# literal values, and Django always binds parameters there.
+PARTIAL_INDEX_VENDORS = ('postgresql',)
+
+
+def create_winner_index(apps, schema_editor):
+    if schema_editor.connection.vendor in PARTIAL_INDEX_VENDORS:
+        schema_editor.execute(
+            'CREATE INDEX cash_flow_quotation_winner '
+            'ON cash_flow_quotation (expense_id) WHERE is_winner'
+        )
+
+
+def drop_winner_index(apps, schema_editor):
+    if schema_editor.connection.vendor in PARTIAL_INDEX_VENDORS:
+        schema_editor.execute('DROP INDEX cash_flow_quotation_winner')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cash_flow', '0027_cashinput_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='cashinput',
+            index_together=set([('account', 'entry_date')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='expense',
+            index_together=set([('fund', 'payment_required', 'due_date')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='quotation',
+            index_together=set([('expense', '_amount_value'), ('expense', 'is_winner')]),
+        ),
+        migrations.RunPython(create_winner_index, drop_winner_index),
+    ]
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.6 on 2026-10-18 16:49
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.utils import timezone
+
+
+def local_month(moment):
+    """ Copy of cash_flow.models.local_month as of this migration. """
+    if settings.USE_TZ and timezone.is_aware(moment):
+        moment = timezone.localtime(moment)
+    return moment.date().replace(day=1)
+
+
+def build_monthly_totals(apps, schema_editor):
+    CashInput = apps.get_model('cash_flow', 'CashInput')
+    MonthlyTotal = apps.get_model('cash_flow', 'MonthlyTotal')
+    totals = {}
+    inputs = CashInput.objects.order_by().values_list(
+        'account', 'value_currency', 'entry_date', 'value'
+    )
+    for account_id, currency, entry_date, value in inputs.iterator():
+        key = (account_id, currency, local_month(entry_date))
+        totals[key] = totals.get(key, 0) + value
+    MonthlyTotal.objects.bulk_create([
+        MonthlyTotal(
+            account_id=account_id, currency=currency, month=month,
+            amount=amount
+        )
+        for (account_id, currency, month), amount in totals.items()
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cash_flow', '0029_expense_resolved'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthlyTotal',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('currency', models.CharField(max_length=3)),
+                ('month', models.DateField()),
+                ('amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='monthly_totals', to='cash_flow.Account')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='monthlytotal',
+            unique_together=set([('account', 'currency', 'month')]),
+        ),
+        migrations.RunPython(
+            build_monthly_totals, migrations.RunPython.noop
+        ),
+    ]
@@ -1,12 +1,172 @@
 from __future__ import unicode_literals
-import operator
-from functools import reduce
-from django.db import models
-from django.utils import timezone
+import hashlib
+from bisect import bisect_left
+from collections import OrderedDict
+from datetime import datetime, time, timedelta
+from django.conf import settings
+from django.db import IntegrityError, connections, models, transaction
+from django.db.models.expressions import RawSQL
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.db.models.signals import pre_save
+from django.dispatch import receiver
+from django.utils import six, timezone
 from moneyed import Money, BRL
 from djmoney.models.fields import MoneyField
 from django.contrib.auth.models import User
-from fundcountdown.fund.models import Fund
+from fundcountdown.cash_flow.schedule import installments, merge_schedules
+from fundcountdown.core.cache import bump_version, fund_scope
+from fundcountdown.core.cache import versioned_cache
+from fundcountdown.core.currency import UnknownRate, total_in
+from fundcountdown.core.metrics import timed
+from fundcountdown.core.money import money_totals, to_decimal
+from fundcountdown.core.profiling import traced
+from fundcountdown.fund.models import Fund, FundSummary
+
+# Fields whose change moves money between ledger entries.
+LEDGER_FIELDS = {
+    'value', 'value_currency', 'account', 'account_id', 'entry_date'
+}
+# Cache scope of values computed over inputs of any fund.
+INPUTS_SCOPE = 'inputs'
+# Keeps ``pk__in`` lookups under SQLite's host parameter limit.
+LEDGER_CHUNK_SIZE = 500
+# Truncation of the entry date for each period of a balance series. SQLite
+# can't truncate to weeks, so weeks are added up from days.
+SERIES_PERIODS = {'day': 'day', 'week': 'day', 'month': 'month'}
+# Running balance per currency over the buckets of a balance series.
+RUNNING_SUM_SQL = (
+    'SELECT buckets.day, buckets.value_currency, buckets.total, '
+    'SUM(buckets.total) OVER ('
+    'PARTITION BY buckets.value_currency ORDER BY buckets.day'
+    ') FROM ({}) buckets ORDER BY buckets.day, buckets.value_currency'
+)
+
+
+def merge_deltas(*deltas):
+    """ Adds ``{(account_id, currency, month): Decimal}`` maps key by key.
+    """
+    merged = {}
+    for delta in deltas:
+        for key, amount in delta.items():
+            merged[key] = merged.get(key, 0) + amount
+    return merged
+
+
+def negate_deltas(deltas):
+    return {key: -amount for key, amount in deltas.items()}
+
+
+def collapse_deltas(deltas, size):
+    """ Sums deltas up over the first ``size`` fields of their keys. """
+    return merge_deltas(*[
+        {key[:size]: amount} for key, amount in deltas.items()
+    ])
+
+
+def local_month(moment):
+    """ First day of the local month of a datetime. """
+    if settings.USE_TZ and timezone.is_aware(moment):
+        moment = timezone.localtime(moment)
+    return moment.date().replace(day=1)
+
+
+def local_midnight(day):
+    """ Start of ``day`` in the local time zone. """
+    midnight = datetime.combine(day, time())
+    if settings.USE_TZ:
+        midnight = timezone.make_aware(midnight)
+    return midnight
+
+
+def month_to_day(day):
+    """ Returns the first day of the month of ``day`` and the span of
+    datetimes from the start of that month to the end of ``day``, local
+    time: the inputs a point in time balance adds to the checkpoints.
+    """
+    month = day.replace(day=1)
+    return (
+        month, local_midnight(month),
+        local_midnight(day + timedelta(days=1))
+    )
+
+
+def checkpoints(rows):
+    """ Builds ``{currency: (months, balances)}`` sorted arrays from
+    ``(currency, month, amount)`` monthly totals, where each balance is the
+    running total at the end of its month.
+    """
+    arrays = {}
+    for currency, month, amount in sorted(rows):
+        months, balances = arrays.setdefault(currency, ([], []))
+        months.append(month)
+        balances.append(
+            (balances[-1] if balances else 0) + to_decimal(amount)
+        )
+    return arrays
+
+
+def balances_before(arrays, month):
+    """ Returns ``{currency: Decimal}`` at the start of ``month``, by
+    bisecting the checkpoint arrays.
+    """
+    totals = {}
+    for currency, (months, balances) in arrays.items():
+        position = bisect_left(months, month)
+        if position:
+            totals[currency] = balances[position - 1]
+    return totals
+
+
+def parse_day(value):
+    """ Date of a truncated datetime, which SQLite returns as a string. """
+    if isinstance(value, six.string_types):
+        return datetime.strptime(value[:10], '%Y-%m-%d').date()
+    if isinstance(value, datetime):
+        return value.date()
+    return value
+
+
+def bucket_start(day, period):
+    """ First day of the ``period`` bucket of an already truncated day. """
+    if period == 'week':
+        return day - timedelta(days=day.weekday())
+    return day
+
+
+def window_functions_supported(connection):
+    if connection.vendor == 'sqlite':
+        return connection.Database.sqlite_version_info >= (3, 25, 0)
+    return connection.vendor in ('postgresql', 'oracle')
+
+
+def running_sums(rows):
+    """ Adds the running balance of each currency to ``(day, currency,
+    deposits)`` rows sorted by day, in a single pass.
+    """
+    balances = {}
+    for day, currency, deposits in rows:
+        balances[currency] = balances.get(currency, 0) + deposits
+        yield day, currency, deposits, balances[currency]
+
+
+def input_fingerprint(account_id, entry_date, value, description,
+                      occurrence=0):
+    """ Content hash identifying a cash input across imports.
+
+    ``occurrence`` tells apart identical inputs of the same statement, e.g.
+    two coffees bought on the same day.
+    """
+    if timezone.is_aware(entry_date):
+        entry_date = entry_date.astimezone(timezone.utc)
+    content = '|'.join([
+        str(account_id),
+        entry_date.isoformat(),
+        str(to_decimal(value.amount)),
+        str(value.currency),
+        ' '.join(description.lower().split()),
+        str(occurrence),
+    ])
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
 
 
 class Account(models.Model):
@@ -20,14 +180,244 @@ class Account(models.Model):
     fund = models.ForeignKey(Fund, related_name='accounts')
 
     @property
+    @traced()
+    @timed('Account.balance')
     def balance(self):
-        inputs = self.inputs.aggregate(models.Sum('value'))
-        return Money(inputs.get('value__sum', 0), BRL)
+        """ Input total, in its currency or in the currency of the fund when
+        mixed (see total_in); None when that needs a missing exchange rate.
+        """
+        try:
+            return total_in(self.totals, self.currency)
+        except UnknownRate:
+            return None
+
+    @property
+    @traced()
+    @versioned_cache(lambda account: fund_scope(account.fund_id))
+    def currency(self):
+        """ Currency of the fund, which mixed balances are given in. """
+        return self.fund.currency
+
+    @property
+    @traced()
+    @versioned_cache(lambda account: fund_scope(account.fund_id))
+    def totals(self):
+        """ Input totals of the account as ``{currency: Money}``. """
+        return {b.currency: b.money for b in self.balances.all()}
+
+    @property
+    @traced()
+    @versioned_cache(lambda account: fund_scope(account.fund_id))
+    def checkpoints(self):
+        """ Balance at the end of each month with inputs, as sorted
+        ``{currency: (months, balances)}`` arrays.
+        """
+        return checkpoints(self.monthly_totals.values_list(
+            'currency', 'month', 'amount'
+        ))
+
+    @traced()
+    def balance_at(self, day):
+        """ Balance at the end of ``day``: the checkpoint of the previous
+        month plus the inputs of the month up to that day.
+        """
+        month, start, end = month_to_day(day)
+        totals = merge_deltas(
+            balances_before(self.checkpoints, month),
+            self.inputs.filter(
+                entry_date__gte=start, entry_date__lt=end
+            ).currency_totals()
+        )
+        try:
+            return total_in(money_totals(totals.items()), self.currency)
+        except UnknownRate:
+            return None
 
     def __str__(self):
         return self.name
 
 
+def ledger_changed(accounts, using=None):
+    """ Marks the summaries and the cache of the funds of ``accounts`` as
+    out of date.
+    """
+    funds = set(Fund.objects.using(using).filter(
+        accounts__in=accounts
+    ).values_list('pk', flat=True))
+    FundSummary.objects.using(using).mark_dirty(funds)
+    bump_version(INPUTS_SCOPE, *map(fund_scope, funds))
+
+
+class LedgerQuerySet(models.QuerySet):
+    """ Running totals of the inputs of accounts, one row per key.
+
+    Keys are the first ``key_size`` fields of ``(account, currency,
+    month)``: the deltas of every write are kept at the month and summed
+    up to the key of each ledger.
+    """
+    key_fields = ('account', 'currency', 'month')
+    key_size = None
+
+    def apply(self, deltas):
+        """ Adds ``{(account_id, currency, month): Decimal}`` deltas to
+        every ledger and marks the funds of the accounts out of date.
+        """
+        with transaction.atomic(using=self.db):
+            accounts = {key[0] for key in deltas}
+            if accounts:
+                ledger_changed(accounts, self.db)
+            for ledger in (AccountBalance, MonthlyTotal):
+                ledger.objects.using(self.db).add(deltas)
+
+    def add(self, deltas):
+        fields = self.key_fields[:self.key_size]
+        for key, delta in sorted(collapse_deltas(
+                deltas, self.key_size).items()):
+            if not delta:
+                continue
+            lookup = dict(zip(fields, key))
+            lookup['account_id'] = lookup.pop('account')
+            entry = self.filter(**lookup)
+            if entry.update(amount=models.F('amount') + delta):
+                continue
+            try:
+                with transaction.atomic(using=self.db):
+                    self.create(amount=delta, **lookup)
+            except IntegrityError:
+                # Created concurrently, so the update will find it now.
+                entry.update(amount=models.F('amount') + delta)
+
+    def mismatches(self, accounts=None):
+        """ Compares the ledger with the inputs it was built from.
+
+        Returns ``{key: (stored, expected)}`` for every entry that is out
+        of date.
+        """
+        inputs = CashInput.objects.using(self.db)
+        ledger = self
+        if accounts is not None:
+            inputs = inputs.filter(account__in=accounts)
+            ledger = ledger.filter(account__in=accounts)
+        expected = collapse_deltas(inputs.ledger_totals(), self.key_size)
+        stored = {
+            tuple(row[:-1]): row[-1]
+            for row in ledger.values_list(*(
+                self.key_fields[:self.key_size] + ('amount',)
+            ))
+        }
+        return {
+            key: (stored.get(key, 0), expected.get(key, 0))
+            for key in set(expected) | set(stored)
+            if stored.get(key, 0) != expected.get(key, 0)
+        }
+
+    def rebuild(self, accounts=None):
+        """ Fixes every out of date entry, returning the mismatches found.
+        """
+        with transaction.atomic(using=self.db):
+            mismatches = self.mismatches(accounts)
+            if mismatches:
+                ledger_changed({key[0] for key in mismatches}, self.db)
+            self.add({
+                key: expected - stored
+                for key, (stored, expected) in mismatches.items()
+            })
+        return mismatches
+
+
+class AccountBalanceQuerySet(LedgerQuerySet):
+    key_size = 2
+
+
+class AccountBalance(models.Model):
+    """ Class AccountBalance
+
+    Running total of the inputs of an account in one currency.
+    It is updated on every CashInput write, so balances are read without
+    summing the inputs.
+    """
+    account = models.ForeignKey(Account, related_name='balances')
+    currency = models.CharField(max_length=3)
+    amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    objects = AccountBalanceQuerySet.as_manager()
+
+    class Meta:
+        unique_together = ('account', 'currency')
+
+    @property
+    def money(self):
+        return Money(self.amount, self.currency)
+
+    def __str__(self):
+        return "{} [{}]".format(self.account, self.currency)
+
+
+class MonthlyTotalQuerySet(LedgerQuerySet):
+    key_size = 3
+
+
+class MonthlyTotal(models.Model):
+    """ Class MonthlyTotal
+
+    Inputs of an account in one currency and local month, updated on
+    every CashInput write like AccountBalance. Their running sums are the
+    balance checkpoints of Account.balance_at.
+    """
+    account = models.ForeignKey(Account, related_name='monthly_totals')
+    currency = models.CharField(max_length=3)
+    month = models.DateField()
+    amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    objects = MonthlyTotalQuerySet.as_manager()
+
+    class Meta:
+        unique_together = ('account', 'currency', 'month')
+
+    def __str__(self):
+        return "{} [{}] {:%Y-%m}".format(
+            self.account, self.currency, self.month
+        )
+
+
+class InputCategoryQuerySet(models.QuerySet):
+
+    def totals(self, fund=None, account=None, since=None, until=None,
+               funds=None):
+        """ Returns ``{category_id: {currency: Money}}`` with the inputs of
+        the categories in this queryset, in one query over the M2M table.
+
+        Inputs can be narrowed to a fund, an account, the days from
+        ``since`` to ``until`` (both included) and a queryset of ``funds``.
+        """
+        links = CashInput.category.through.objects.using(self.db).filter(
+            inputcategory__in=self.values('pk')
+        )
+        if funds is not None:
+            links = links.filter(cashinput__account__fund__in=funds)
+        if fund is not None:
+            links = links.filter(cashinput__account__fund=fund)
+        if account is not None:
+            links = links.filter(cashinput__account=account)
+        if since is not None:
+            links = links.filter(
+                cashinput__entry_date__gte=local_midnight(since)
+            )
+        if until is not None:
+            links = links.filter(cashinput__entry_date__lt=local_midnight(
+                until + timedelta(days=1)
+            ))
+        rows = {}
+        for category_id, currency, total in links.order_by().values_list(
+                'inputcategory', 'cashinput__value_currency'
+        ).annotate(total=models.Sum('cashinput__value')):
+            rows.setdefault(category_id, []).append((currency, total))
+        return {
+            category_id: money_totals(totals)
+            for category_id, totals in rows.items()
+        }
+
+
 class InputCategory(models.Model):
     """ Class InputCategory
 
@@ -36,10 +426,18 @@ class InputCategory(models.Model):
     name = models.CharField(max_length=50)
     description = models.TextField()
 
+    objects = InputCategoryQuerySet.as_manager()
+
+    @traced()
+    @versioned_cache(lambda category: INPUTS_SCOPE)
     def amount(self):
-        inputs = self.inputs.all()
-        amount = reduce(operator.add, [i.value for i in inputs])
-        return amount
+        """ Input total in BRL, None when it needs a missing exchange rate.
+        """
+        totals = InputCategory.objects.filter(pk=self.pk).totals()
+        try:
+            return total_in(totals.get(self.pk, {}), BRL.code)
+        except UnknownRate:
+            return None
 
     def __str__(self):
         return self.name
@@ -75,6 +473,7 @@ class ExpenseAbstract(models.Model):
     due_date = models.DateTimeField(default=timezone.now)
 
     @property
+    @traced()
     def amount(self):
         return self._amount_value
 
@@ -93,26 +492,204 @@ class ExpenseAbstract(models.Model):
         abstract = True
 
 
+# Id of the quotation that prices an expense: the one flagged as winner,
+# else the cheapest one (ties broken by id).
+WINNER_SQL = """COALESCE(
+    (SELECT w.id FROM cash_flow_quotation w
+     WHERE w.expense_id = cash_flow_expense.id AND w.is_winner = %s
+     ORDER BY w.id LIMIT 1),
+    (SELECT c.id FROM cash_flow_quotation c
+     WHERE c.expense_id = cash_flow_expense.id
+     ORDER BY c._amount_value, c.id LIMIT 1)
+)"""
+
+
+# Column of the winning quotation of an expense, or of the expense itself
+# when it has no quotations.
+RESOLVED_SQL = """CASE WHEN EXISTS (
+    SELECT 1 FROM cash_flow_quotation e
+    WHERE e.expense_id = cash_flow_expense.id
+) THEN (
+    SELECT r.{column} FROM cash_flow_quotation r WHERE r.id = {winner}
+) ELSE cash_flow_expense.{column} END"""
+# Resolved column of Expense: column it is copied from.
+RESOLVED_COLUMNS = OrderedDict([
+    ('resolved_value', '_fixed_value'),
+    ('resolved_value_currency', '_fixed_value_currency'),
+    ('resolved_amount', '_amount_value'),
+    ('resolved_amount_currency', '_amount_value_currency'),
+])
+# Fields whose change may reprice an expense, through update() or
+# bulk_create rather than save.
+MOVE_FIELDS = {'expense', 'expense_id', 'fund', 'fund_id'}
+PRICE_FIELDS = MOVE_FIELDS | {
+    'is_winner', '_fixed_value', '_fixed_value_currency', '_amount_value',
+    '_amount_value_currency',
+}
+
+
+def resolved_columns(expense, winner):
+    """ Column values of an expense priced by ``winner`` (or by itself). """
+    source = winner or expense
+    columns = {'winning_quotation_id': winner.pk if winner else None}
+    for name, field in RESOLVED_COLUMNS.items():
+        value = getattr(source, field)
+        if name.endswith('_currency'):
+            value = str(value)
+        elif value is not None:
+            value = value.amount
+        columns[name] = value
+    return columns
+
+
+def set_amount_values(objs):
+    """ Fills ``_amount_value`` in the way ExpenseAbstract.save does. """
+    for obj in objs:
+        if obj.occurrence < 1:
+            obj.occurrence = 1
+        obj._amount_value = obj._fixed_value * obj.occurrence
+
+
+def expenses_changed(expense_ids, fund_ids=(), using=None):
+    """ Resolves ``expense_ids`` again after writes that bypassed save and
+    marks their funds, and ``fund_ids``, out of date.
+    """
+    expenses = Expense.objects.using(using)
+    expense_ids = sorted(expense_ids)
+    funds = set(fund_ids)
+    for start in range(0, len(expense_ids), LEDGER_CHUNK_SIZE):
+        chunk = expenses.filter(
+            pk__in=expense_ids[start:start + LEDGER_CHUNK_SIZE]
+        )
+        chunk.resolve()
+        funds.update(chunk.values_list('fund', flat=True))
+    FundSummary.objects.using(using).mark_dirty(funds)
+    bump_version(*map(fund_scope, funds))
+
+
+class ExpenseQuerySet(models.QuerySet):
+
+    def lock(self):
+        """ Row-locks the expenses until the end of the transaction.
+
+        A no-op UPDATE rather than select_for_update: SQLite ignores
+        FOR UPDATE, and a transaction that reads first can't wait there
+        for another writer.
+        """
+        return self.update(winning_quotation=models.F('winning_quotation'))
+
+    def schedule(self, since=None, until=None):
+        """ Yields the installments of the expenses due from ``since`` to
+        (excluding) ``until`` in date order, see
+        fundcountdown.cash_flow.schedule.
+        """
+        return merge_schedules(
+            self.select_related('winning_quotation').iterator(), since, until
+        )
+
+    def resolve(self):
+        """ Stores the winning quotation of each expense and the value and
+        amount it resolves to, in one correlated UPDATE however many
+        expenses there are.
+
+        Returns ``{expense_id: columns}`` with the stored values.
+        """
+        columns = {
+            name: RawSQL(RESOLVED_SQL.format(
+                column=column, winner=WINNER_SQL
+            ), (True,))
+            for name, column in RESOLVED_COLUMNS.items()
+        }
+        names = ['winning_quotation_id'] + list(RESOLVED_COLUMNS)
+        with transaction.atomic(using=self.db):
+            self.update(
+                winning_quotation=RawSQL(WINNER_SQL, (True,)), **columns
+            )
+            return {
+                row[0]: dict(zip(names, row[1:]))
+                for row in self.values_list('pk', *names)
+            }
+
+    def bulk_create(self, objs, batch_size=None):
+        # New expenses have no quotations yet, so they resolve to
+        # themselves.
+        objs = list(objs)
+        set_amount_values(objs)
+        for obj in objs:
+            for name, value in resolved_columns(obj, None).items():
+                setattr(obj, name, value)
+        with transaction.atomic(using=self.db):
+            objs = super(ExpenseQuerySet, self).bulk_create(
+                objs, batch_size
+            )
+            funds = {obj.fund_id for obj in objs}
+            FundSummary.objects.using(self.db).mark_dirty(funds)
+            bump_version(*map(fund_scope, funds))
+        return objs
+
+    def update(self, **kwargs):
+        if not PRICE_FIELDS & set(kwargs):
+            return super(ExpenseQuerySet, self).update(**kwargs)
+        with transaction.atomic(using=self.db):
+            rows = list(self.values_list('pk', 'fund'))
+            updated = super(ExpenseQuerySet, self).update(**kwargs)
+            expenses_changed(
+                [pk for pk, _ in rows], [fund for _, fund in rows], self.db
+            )
+        return updated
+    update.alters_data = True
+
+
 class Expense(ExpenseAbstract):
     """ Class Expense
 
     Extends the abstract class Abstract Expense and represents expenses
     to meet the goal
     It may be an expense already specified or can be an expense with quotations
+    The winning quotation and the value and amount it resolves to are stored
+    in the expense, refreshed whenever the expense or a quotation is saved.
     """
     fund = models.ForeignKey(Fund, related_name='expenses')
     partner = models.ForeignKey(User, related_name='expenses')
+    winning_quotation = models.ForeignKey(
+        'Quotation',
+        null=True,
+        blank=True,
+        editable=False,
+        on_delete=models.SET_NULL,
+        related_name='+'
+    )
+    resolved_value = MoneyField(
+        max_digits=10,
+        decimal_places=2,
+        default_currency='USD',
+        null=True,
+        editable=False
+    )
+    resolved_amount = MoneyField(
+        max_digits=10,
+        decimal_places=2,
+        default_currency='USD',
+        null=True,
+        editable=False
+    )
+
+    objects = ExpenseQuerySet.as_manager()
+
+    class Meta:
+        index_together = [
+            ('fund', 'payment_required', 'due_date'),
+        ]
 
     @property
     def has_quotation(self):
-        if self.quotations.count() > 0:
-            return True
-        return False
+        return self.winning_quotation_id is not None
 
     @property
+    @traced()
     def value(self):
         if self.has_quotation:
-            return self.winner.value
+            return self.resolved_value
         else:
             return self._fixed_value
 
@@ -131,9 +708,17 @@ class Expense(ExpenseAbstract):
                 raise Exception("An error has occurred.")
 
     @property
+    @traced()
     def winner(self):
         if self.has_quotation:
-            return self.quotations.winner()
+            # Fund.objects.with_costs() prefetches the quotations.
+            quotations = getattr(self, '_prefetched_objects_cache', {}).get(
+                'quotations'
+            )
+            for quotation in quotations or ():
+                if quotation.pk == self.winning_quotation_id:
+                    return quotation
+            return self.winning_quotation
         else:
             return self
 
@@ -142,27 +727,138 @@ class Expense(ExpenseAbstract):
         if self.has_quotation:
             quotation.is_winner = True
             quotation.save()
+            self.resolve()
         else:
             return NotImplementedError
 
     @property
+    @traced()
     def amount(self):
         if self.has_quotation:
-            return self.winner.amount
+            return self.resolved_amount
         else:
             return self._amount_value
 
+    def installments(self, since=None):
+        """ Yields the installments of the expense, see
+        fundcountdown.cash_flow.schedule.
+        """
+        return installments(self, since)
+
+    def resolve(self):
+        """ Refreshes the resolved columns from the stored quotations. """
+        columns = Expense.objects.filter(pk=self.pk).resolve()[self.pk]
+        if columns['winning_quotation_id'] != self.winning_quotation_id:
+            self.__dict__.pop(
+                Expense.winning_quotation.field.get_cache_name(), None
+            )
+        for name, value in columns.items():
+            setattr(self, name, value)
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super(Expense, self).save(*args, **kwargs)
+            self.resolve()
+
     def __srt__(self):
         return self.name
 
 
 class QuotationQuerySet(models.QuerySet):
+    """ Resolves the expenses again on the bulk write paths, which bypass
+    the post_save and post_delete receivers of Quotation.
+    """
+
     def winner(self):
         tagget_as_winner = self.filter(is_winner=True)
         if tagget_as_winner.count():
             return tagget_as_winner.first()
         return self.order_by('_amount_value').first()
 
+    def set_winners(self, winners):
+        """ Flags the quotations of ``{expense_id: quotation_id}`` as winners
+        and unflags every other quotation of those expenses. With a None
+        quotation the cheapest one wins again.
+
+        Returns ``{expense_id: columns}`` as ExpenseQuerySet.resolve.
+        """
+        quotations = self.model._default_manager.using(self.db)
+        expenses = Expense.objects.using(self.db)
+        expense_ids = sorted(winners)
+        resolved = {}
+        with transaction.atomic(using=self.db):
+            for start in range(0, len(expense_ids), LEDGER_CHUNK_SIZE):
+                chunk = expense_ids[start:start + LEDGER_CHUNK_SIZE]
+                chosen = [winners[e] for e in chunk if winners[e] is not None]
+                found = dict(
+                    quotations.filter(pk__in=chosen)
+                    .values_list('pk', 'expense_id')
+                )
+                for expense_id in chunk:
+                    pk = winners[expense_id]
+                    if pk is not None and found.get(pk) != expense_id:
+                        raise ValueError(
+                            "[{}] isn't a quotation of expense {}.".format(
+                                pk, expense_id
+                            )
+                        )
+
+                expenses.filter(pk__in=chunk).lock()
+                is_winner = models.Value(False)
+                if chosen:
+                    is_winner = models.Case(
+                        models.When(pk__in=chosen, then=models.Value(True)),
+                        default=models.Value(False),
+                        output_field=models.BooleanField(),
+                    )
+                quotations.filter(expense_id__in=chunk).update(
+                    is_winner=is_winner
+                )
+                resolved.update(expenses.filter(pk__in=chunk).resolve())
+
+                # Updates don't send post_save, see mark_fund_summary_dirty.
+                funds = set(expenses.filter(pk__in=chunk).values_list(
+                    'fund', flat=True
+                ))
+                FundSummary.objects.using(self.db).mark_dirty(funds)
+                bump_version(*[fund_scope(f) for f in funds])
+        return resolved
+
+    def bulk_create(self, objs, batch_size=None):
+        objs = list(objs)
+        set_amount_values(objs)
+        with transaction.atomic(using=self.db):
+            objs = super(QuotationQuerySet, self).bulk_create(
+                objs, batch_size
+            )
+            expenses_changed(
+                {obj.expense_id for obj in objs},
+                {obj.fund_id for obj in objs}, self.db
+            )
+        return objs
+
+    def update(self, **kwargs):
+        if not PRICE_FIELDS & set(kwargs):
+            return super(QuotationQuerySet, self).update(**kwargs)
+        with transaction.atomic(using=self.db):
+            rows = list(self.values_list('pk', 'expense', 'fund'))
+            updated = super(QuotationQuerySet, self).update(**kwargs)
+            expenses = {expense for _, expense, _ in rows}
+            funds = {fund for _, _, fund in rows}
+            if MOVE_FIELDS & set(kwargs):
+                # Moved quotations price their new expenses as well.
+                quotations = self.model._default_manager.using(self.db)
+                pks = [pk for pk, _, _ in rows]
+                for start in range(0, len(pks), LEDGER_CHUNK_SIZE):
+                    for expense, fund in quotations.filter(
+                            pk__in=pks[start:start + LEDGER_CHUNK_SIZE]
+                    ).values_list('expense', 'fund'):
+                        expenses.add(expense)
+                        funds.add(fund)
+            expenses_changed(expenses, funds, self.db)
+        return updated
+    update.alters_data = True
+
 
 class Quotation(ExpenseAbstract):
     """ Class Quotation
@@ -177,11 +873,18 @@ class Quotation(ExpenseAbstract):
 
     objects = QuotationQuerySet().as_manager()
 
+    class Meta:
+        index_together = [
+            ('expense', 'is_winner'),
+            ('expense', '_amount_value'),
+        ]
+
     @property
     def has_quotation(self):
         return False
 
     @property
+    @traced()
     def value(self):
         return self._fixed_value
 
@@ -196,19 +899,168 @@ class Quotation(ExpenseAbstract):
         except:
             raise Exception("An error has occurred.")
 
-    def save(self, disqualify_winner=False, *args, **kwargs):
-        is_disqualify_winner = kwargs.get('disqualify_winner')
-        if self.id and self.is_winner and not is_disqualify_winner:
-            old_winner = Quotation.objects.winner()
-            old_winner.is_winner = False
-            old_winner.save(disqualify_winner=True)
-
-        super(Quotation, self).save(*args, **kwargs)
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            if self.is_winner:
+                # Serializes winner switches of the expense, then unflags
+                # its previous winner in one UPDATE before flagging this one.
+                # The base update skips resolving the expense, post_save
+                # does it once.
+                Expense.objects.filter(pk=self.expense_id).lock()
+                previous = Quotation.objects.filter(
+                    expense_id=self.expense_id, is_winner=True
+                ).exclude(pk=self.pk)
+                models.QuerySet.update(previous, is_winner=False)
+            super(Quotation, self).save(*args, **kwargs)
 
     def __str__(self):
         return "{} [{}]".format(self.name, self.expense.name)
 
 
+class CashInputQuerySet(models.QuerySet):
+    """ Keeps the AccountBalance ledger current on the bulk write paths,
+    which bypass ``CashInput.save`` and ``CashInput.delete``.
+    """
+
+    def ledger_totals(self):
+        """ Returns ``{(account_id, currency, month): Decimal}`` for this
+        queryset.
+        """
+        totals = self._truncated('month').order_by().values_list(
+            'account', 'value_currency', 'day'
+        ).annotate(total=models.Sum('value'))
+        return merge_deltas(*[
+            {(account_id, currency, parse_day(month)): to_decimal(total)}
+            for account_id, currency, month, total in totals
+        ])
+
+    def currency_totals(self):
+        """ Returns ``{currency: Decimal}`` for this queryset. """
+        return {
+            currency: to_decimal(total)
+            for currency, total in self.order_by().values_list(
+                'value_currency'
+            ).annotate(total=models.Sum('value'))
+        }
+
+    def _truncated(self, kind):
+        """ Selects the entry date truncated to the local ``kind`` ('day',
+        'month'...) as ``day``.
+        """
+        connection = connections[self.db]
+        column = '{}.{}'.format(
+            connection.ops.quote_name(self.model._meta.db_table),
+            connection.ops.quote_name('entry_date'),
+        )
+        tzname = timezone.get_current_timezone_name() \
+            if settings.USE_TZ else None
+        sql, params = connection.ops.datetime_trunc_sql(kind, column, tzname)
+        return self.extra(select={'day': sql}, select_params=params)
+
+    def daily_totals(self):
+        """ Returns ``(fund_id, date, currency, Decimal)`` rows with the
+        inputs summed per fund, local day and currency, in one query.
+        """
+        rows = self._truncated('day').order_by().values_list(
+            'account__fund', 'day', 'value_currency'
+        ).annotate(total=models.Sum('value'))
+        return [
+            (fund_id, parse_day(day), currency, to_decimal(total))
+            for fund_id, day, currency, total in rows
+        ]
+
+    def balance_series(self, period='day', since=None):
+        """ Returns ``(date, currency, deposits, balance)`` rows, one per
+        ``period`` ('day', 'week' or 'month') with inputs and currency.
+
+        The balance is the running total of the currency up to the end of
+        the bucket. Buckets before ``since`` only count towards it. Takes
+        one query: a GROUP BY on the truncated entry date, with the running
+        sum as a window function where the database has them.
+        """
+        if period not in SERIES_PERIODS:
+            raise ValueError("[{}] isn't a valid period.".format(period))
+        grouped = self._truncated(SERIES_PERIODS[period]).values_list(
+            'day', 'value_currency'
+        ).annotate(total=models.Sum('value'))
+        connection = connections[self.db]
+        if window_functions_supported(connection):
+            sql, params = grouped.order_by().query.sql_with_params()
+            with connection.cursor() as cursor:
+                cursor.execute(RUNNING_SUM_SQL.format(sql), params)
+                rows = cursor.fetchall()
+        else:
+            rows = running_sums(
+                (day, currency, to_decimal(total))
+                for day, currency, total in grouped.order_by(
+                    'day', 'value_currency'
+                )
+            )
+
+        if since is not None:
+            since = bucket_start(since, period)
+        buckets = OrderedDict()
+        for day, currency, deposits, balance in rows:
+            day = bucket_start(parse_day(day), period)
+            if since is not None and day < since:
+                continue
+            key = (day, currency)
+            deposits = to_decimal(deposits)
+            if key in buckets:
+                deposits += buckets[key][0]
+            buckets[key] = (deposits, to_decimal(balance))
+        return sorted(
+            (day, currency, deposits, balance)
+            for (day, currency), (deposits, balance) in buckets.items()
+        )
+
+    def _ledger_totals_for(self, pks):
+        inputs = self.model._default_manager.using(self.db)
+        totals = {}
+        for start in range(0, len(pks), LEDGER_CHUNK_SIZE):
+            chunk = pks[start:start + LEDGER_CHUNK_SIZE]
+            totals = merge_deltas(
+                totals, inputs.filter(pk__in=chunk).ledger_totals()
+            )
+        return totals
+
+    def bulk_create(self, objs, batch_size=None):
+        objs = list(objs)
+        deltas = {}
+        for obj in objs:
+            key = obj.ledger_key()
+            deltas[key] = deltas.get(key, 0) + to_decimal(obj.value.amount)
+        with transaction.atomic(using=self.db):
+            objs = super(CashInputQuerySet, self).bulk_create(
+                objs, batch_size
+            )
+            AccountBalance.objects.using(self.db).apply(deltas)
+        return objs
+
+    def update(self, **kwargs):
+        if not LEDGER_FIELDS & set(kwargs):
+            return super(CashInputQuerySet, self).update(**kwargs)
+        with transaction.atomic(using=self.db):
+            pks = list(self.select_for_update().values_list('pk', flat=True))
+            before = self._ledger_totals_for(pks)
+            rows = super(CashInputQuerySet, self).update(**kwargs)
+            after = self._ledger_totals_for(pks)
+            AccountBalance.objects.using(self.db).apply(
+                merge_deltas(after, negate_deltas(before))
+            )
+        return rows
+    update.alters_data = True
+
+    def delete(self):
+        with transaction.atomic(using=self.db):
+            AccountBalance.objects.using(self.db).apply(
+                negate_deltas(self.ledger_totals())
+            )
+            return super(CashInputQuerySet, self).delete()
+    delete.alters_data = True
+    delete.queryset_only = True
+
+
 class CashInput(models.Model):
     description = models.TextField()
     value = MoneyField(
@@ -226,6 +1078,110 @@ class CashInput(models.Model):
         blank=True,
         related_name='inputs'
     )
+    # Identifies the statement line of imported inputs, see
+    # fundcountdown.cash_flow.importers; None for inputs entered by hand,
+    # which may repeat. Kept on edits, so an edited input still matches
+    # its line when the statement is imported again.
+    fingerprint = models.CharField(
+        max_length=40,
+        unique=True,
+        null=True,
+        editable=False
+    )
+
+    objects = CashInputQuerySet.as_manager()
+
+    class Meta:
+        index_together = [
+            ('account', 'entry_date'),
+        ]
+
+    def ledger_key(self):
+        return (
+            self.account_id, str(self.value.currency),
+            local_month(self.entry_date)
+        )
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            deltas = {}
+            if self.pk:
+                deltas = negate_deltas(
+                    CashInput.objects.select_for_update().filter(
+                        pk=self.pk
+                    ).ledger_totals()
+                )
+            super(CashInput, self).save(*args, **kwargs)
+            deltas = merge_deltas(
+                deltas, {self.ledger_key(): to_decimal(self.value.amount)}
+            )
+            AccountBalance.objects.apply(deltas)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            AccountBalance.objects.apply(negate_deltas(
+                CashInput.objects.filter(pk=self.pk).ledger_totals()
+            ))
+            return super(CashInput, self).delete(*args, **kwargs)
 
     def __str__(self):
         return "{}...".format(self.description[0:15])
+
+
+@receiver(pre_save, sender=Account)
+@receiver(pre_save, sender=Expense)
+@receiver(pre_save, sender=Quotation)
+def remember_previous_fund(sender, instance, raw=False, using=None,
+                           **kwargs):
+    # Moving to another fund leaves the previous one out of date as well,
+    # and a quotation moved to another expense its previous expense.
+    instance._previous_fund_id = None
+    instance._previous_expense_id = None
+    if instance.pk is not None and not raw:
+        fields = ['fund', 'expense'] if sender is Quotation else ['fund']
+        previous = sender._default_manager.using(using).filter(
+            pk=instance.pk
+        ).values_list(*fields).first()
+        if previous is not None:
+            instance._previous_fund_id = previous[0]
+            if sender is Quotation:
+                instance._previous_expense_id = previous[1]
+
+
+# CashInput writes reach the summaries and the cache through
+# AccountBalanceQuerySet.apply.
+@receiver(post_save, sender=Account)
+@receiver(post_delete, sender=Account)
+@receiver(post_save, sender=Expense)
+@receiver(post_delete, sender=Expense)
+@receiver(post_save, sender=Quotation)
+@receiver(post_delete, sender=Quotation)
+def mark_fund_summary_dirty(sender, instance, **kwargs):
+    funds = {instance.fund_id, getattr(instance, '_previous_fund_id', None)}
+    funds.discard(None)
+    instance._previous_fund_id = None
+    FundSummary.objects.mark_dirty(funds)
+    bump_version(*map(fund_scope, funds))
+
+
+@receiver(post_save, sender=Quotation)
+@receiver(post_delete, sender=Quotation)
+def resolve_expense(sender, instance, using=None, **kwargs):
+    previous = getattr(instance, '_previous_expense_id', None)
+    instance._previous_expense_id = None
+    if previous is not None and previous != instance.expense_id:
+        expenses_changed({previous, instance.expense_id}, using=using)
+    else:
+        Expense.objects.filter(pk=instance.expense_id).resolve()
+
+
+@receiver(post_save, sender=Fund)
+@receiver(post_delete, sender=Fund)
+def bump_fund_version(sender, instance, **kwargs):
+    bump_version(fund_scope(instance.pk))
+
+
+@receiver(m2m_changed, sender=CashInput.category.through)
+def bump_inputs_version(sender, **kwargs):
+    if kwargs['action'].startswith('post_'):
+        bump_version(INPUTS_SCOPE)
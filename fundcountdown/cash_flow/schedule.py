@@ -0,0 +1,54 @@
+""" Payment schedule of expenses.
+
+An expense is due in ``occurrence`` monthly installments of its value,
+the first one on its due date; with quotations, the winning quotation's
+value, occurrence and due date are used. Installments are generated
+lazily and the expenses of a queryset are merged in date order, so a
+calendar of any length is streamed without being built in memory.
+"""
+import calendar
+import heapq
+from collections import namedtuple
+from itertools import takewhile
+from django.utils import timezone
+
+# Ordered by date first, so installments sort and merge by due date.
+Installment = namedtuple(
+    'Installment', 'due_date expense_id number count value name'
+)
+
+
+def add_months(moment, months):
+    """ Same day ``months`` later, or the last day of a shorter month. """
+    month = moment.month - 1 + months
+    year = moment.year + month // 12
+    month = month % 12 + 1
+    day = min(moment.day, calendar.monthrange(year, month)[1])
+    return moment.replace(year=year, month=month, day=day)
+
+
+def installments(expense, since=None):
+    """ Yields the installments of an expense due from ``since`` on. """
+    source = expense.winner
+    count = max(source.occurrence, 1)
+    first = source.due_date
+    if timezone.is_aware(first):
+        first = timezone.localtime(first)
+    for number in range(count):
+        due_date = add_months(first, number)
+        if since is not None and due_date < since:
+            continue
+        yield Installment(
+            due_date, expense.pk, number + 1, count, source.value,
+            expense.name
+        )
+
+
+def merge_schedules(expenses, since=None, until=None):
+    """ Merges the installments of ``expenses`` in due date order, up to
+    (excluding) ``until``.
+    """
+    merged = heapq.merge(*[installments(e, since) for e in expenses])
+    if until is None:
+        return merged
+    return takewhile(lambda installment: installment.due_date < until, merged)
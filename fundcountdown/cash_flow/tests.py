@@ -1,13 +1,32 @@
+import json
+import os
+import tempfile
+import threading
+from datetime import date
+from decimal import Decimal
+from unittest import mock
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.core.urlresolvers import reverse
 from django.test import TestCase
+from django.utils.six import StringIO
 from django.utils import timezone
 from django.contrib.auth.models import User
 from moneyed import USD, BRL, Money
+from fundcountdown.cash_flow import importers
 from fundcountdown.cash_flow.models import Account
+from fundcountdown.cash_flow.models import AccountBalance
 from fundcountdown.cash_flow.models import CashInput
 from fundcountdown.cash_flow.models import Expense
 from fundcountdown.cash_flow.models import Quotation
 from fundcountdown.cash_flow.models import InputCategory
-from fundcountdown.fund.models import Fund
+from fundcountdown.cash_flow.models import MonthlyTotal
+from fundcountdown.cash_flow.models import input_fingerprint
+from fundcountdown.core.cache import bump_version, fund_scope
+from fundcountdown.core.models import RATES_SCOPE, ExchangeRate
+from fundcountdown.core.testing import FileDatabaseTestCase
+from fundcountdown.fund.models import Fund, FundSummary
 
 
 class CashOutflowTest(TestCase):
@@ -131,6 +150,170 @@ class CashOutflowTest(TestCase):
         # Expenses can be before and after
         # Insert date
 
+    def test_resolved_columns(self):
+        airfare = Expense.objects.get(name='Airfare')
+        lower = airfare.quotations.get(name='Lower Airlines')
+        self.assertEqual(airfare.winning_quotation, lower)
+
+        with self.assertNumQueries(1):
+            expenses = list(Expense.objects.select_related(
+                'winning_quotation'
+            ).order_by('pk'))
+            self.assertEqual(
+                [(e.name, e.has_quotation, e.value, e.amount)
+                 for e in expenses],
+                [('Home Rental', False, Money(150, USD), Money(900, USD)),
+                 ('Airfare', True, Money(1400, USD), Money(2800, USD)),
+                 ('Market', True, Money(100.49, USD), Money(100.49, USD))]
+            )
+            self.assertEqual(expenses[1].winner, lower)
+
+        # The next cheapest quotation takes over when the winner goes away.
+        lower.delete()
+        airfare = Expense.objects.get(name='Airfare')
+        self.assertEqual(airfare.winner.name, 'Larger Airlines')
+        self.assertEqual(airfare.amount, Money(2900.50, USD))
+
+        airfare.quotations.all().delete()
+        airfare.save()
+        self.assertFalse(airfare.has_quotation)
+        self.assertEqual(airfare.amount, airfare._amount_value)
+
+    def test_resolve_in_constant_queries(self):
+        Expense.objects.update(resolved_amount=None)
+        with self.assertNumQueries(4):
+            resolved = Expense.objects.resolve()
+        names = dict(Expense.objects.values_list('pk', 'name'))
+        self.assertEqual(
+            sorted((names[pk], columns['resolved_amount'])
+                   for pk, columns in resolved.items()),
+            [('Airfare', Decimal('2800.00')),
+             ('Home Rental', Decimal('900.00')),
+             ('Market', Decimal('100.49'))]
+        )
+
+    def test_bulk_writes_resolve(self):
+        travel = Fund.objects.get()
+        airfare = Expense.objects.get(name='Airfare')
+        FundSummary.objects.refresh()
+        Quotation.objects.bulk_create([Quotation(
+            name="Budget Airlines", description="", value=Money(600, USD),
+            occurrence=2, expense=airfare, fund=travel,
+            partner=airfare.partner
+        )])
+        airfare = Expense.objects.get(pk=airfare.pk)
+        self.assertEqual(airfare.winner.name, 'Budget Airlines')
+        self.assertEqual(airfare.amount, Money(1200, USD))
+        self.assertTrue(FundSummary.objects.get().is_dirty)
+
+        airfare.quotations.filter(name='Larger Airlines').update(
+            is_winner=True
+        )
+        self.assertEqual(
+            Expense.objects.get(pk=airfare.pk).amount, Money('2900.50', USD)
+        )
+        market = Expense.objects.get(name='Market')
+        airfare.quotations.filter(name='Larger Airlines').update(
+            expense=market
+        )
+        self.assertEqual(
+            Expense.objects.get(pk=airfare.pk).amount, Money(1200, USD)
+        )
+        self.assertEqual(
+            Expense.objects.get(pk=market.pk).amount, Money('2900.50', USD)
+        )
+
+        Expense.objects.filter(name='Home Rental').update(
+            _fixed_value=200, _amount_value=1200
+        )
+        rental = Expense.objects.get(name='Home Rental')
+        self.assertEqual(rental.amount, Money(1200, USD))
+        Expense.objects.bulk_create([Expense(
+            name="Insurance", description="", value=Money(30, USD),
+            occurrence=3, fund=travel, partner=rental.partner
+        )])
+        self.assertEqual(
+            Expense.objects.get(name='Insurance').resolved_amount,
+            Money(90, USD)
+        )
+        self.assertEqual(travel.full_cost, Money('5390.50', USD))
+
+    def test_moved_quotation_resolves_both(self):
+        travel = Fund.objects.get()
+        self.assertEqual(travel.full_cost, Money('3800.49', USD))
+        market = Expense.objects.get(name='Market')
+        quotation = Quotation.objects.get(name='Super Market')
+        quotation.expense = Expense.objects.get(name='Airfare')
+        quotation.save()
+
+        market = Expense.objects.get(pk=market.pk)
+        self.assertIsNone(market.winning_quotation_id)
+        self.assertFalse(market.has_quotation)
+        self.assertEqual(market.amount.amount, 0)
+        airfare = Expense.objects.get(name='Airfare')
+        self.assertEqual(airfare.winner.name, 'Super Market')
+        self.assertEqual(travel.full_cost, Money('1000.49', USD))
+
+    def test_winner_scoped_to_expense(self):
+        market = Quotation.objects.get(name='Super Market')
+        market.is_winner = True
+        market.save()
+        airfare = Expense.objects.get(name='Airfare')
+        larger = airfare.quotations.get(name='Larger Airlines')
+        airfare.winner = larger
+
+        # Flagging a winner of another expense keeps this one.
+        self.assertTrue(Quotation.objects.get(pk=market.pk).is_winner)
+        self.assertEqual(
+            list(Quotation.objects.filter(is_winner=True).order_by('pk')),
+            [larger, market]
+        )
+        lower = airfare.quotations.get(name='Lower Airlines')
+        lower.is_winner = True
+        # The expense is resolved once, by post_save.
+        with self.assertNumQueries(11):
+            lower.save()
+        self.assertEqual(
+            list(airfare.quotations.filter(is_winner=True)), [lower]
+        )
+        self.assertEqual(
+            Expense.objects.get(pk=airfare.pk).winning_quotation, lower
+        )
+
+    def test_set_winners(self):
+        airfare = Expense.objects.get(name='Airfare')
+        market = Expense.objects.get(name='Market')
+        lower, larger = airfare.quotations.order_by('pk')
+        cheaper = market.quotations.create(
+            name="Cheaper Market",
+            description="Beer on sale.",
+            value=Money(50, USD),
+            due_date=market.due_date,
+            fund=market.fund,
+            partner=market.partner
+        )
+        FundSummary.objects.refresh()
+
+        resolved = Quotation.objects.set_winners({
+            airfare.pk: larger.pk, market.pk: None
+        })
+        self.assertEqual(
+            resolved[airfare.pk]['resolved_amount'], Decimal('2900.50')
+        )
+        self.assertEqual(
+            list(Quotation.objects.filter(is_winner=True)), [larger]
+        )
+        self.assertEqual(
+            Expense.objects.get(pk=market.pk).winning_quotation, cheaper
+        )
+        self.assertTrue(FundSummary.objects.get().is_dirty)
+
+        with self.assertRaises(ValueError):
+            Quotation.objects.set_winners({market.pk: lower.pk})
+        self.assertEqual(
+            list(Quotation.objects.filter(is_winner=True)), [larger]
+        )
+
 
 class CashInputTest(TestCase):
 
@@ -182,6 +365,162 @@ class CashInputTest(TestCase):
         self.assertEqual(category.inputs.count(), 2)
         self.assertEqual(category.amount(), Money(330, BRL))
 
+        empty = InputCategory.objects.create(name="Empty", description="")
+        self.assertEqual(empty.amount(), Money(0, BRL))
+
+    def test_category_totals(self):
+        saving = InputCategory.objects.get(name="Saving")
+        fastfood = InputCategory.objects.get(name="Less fastfood")
+        house = Fund.objects.create(name="House", description="")
+        bank = Account.objects.create(name='Bank', description='', fund=house)
+        dollars = CashInput.objects.create(
+            description='Dollars',
+            value=Money(40, USD),
+            entry_date=timezone.datetime(2016, 1, 10, tzinfo=timezone.utc),
+            account=bank,
+        )
+        dollars.category.add(saving)
+
+        with self.assertNumQueries(1):
+            totals = InputCategory.objects.totals()
+        self.assertEqual(totals, {
+            saving.pk: {'BRL': Money(330, BRL), 'USD': Money(40, USD)},
+            fastfood.pk: {'BRL': Money(200, BRL)},
+        })
+        travel = Fund.objects.get(name="Travel Fund")
+        self.assertEqual(
+            InputCategory.objects.totals(fund=travel)[saving.pk],
+            {'BRL': Money(330, BRL)}
+        )
+        self.assertEqual(InputCategory.objects.totals(account=bank), {
+            saving.pk: {'USD': Money(40, USD)},
+        })
+        self.assertEqual(
+            InputCategory.objects.totals(
+                since=date(2016, 1, 10), until=date(2016, 1, 10)
+            ),
+            {saving.pk: {'USD': Money(40, USD)}}
+        )
+        self.assertEqual(
+            InputCategory.objects.filter(pk=fastfood.pk).totals(), {
+                fastfood.pk: {'BRL': Money(200, BRL)},
+            }
+        )
+        self.assertEqual(
+            InputCategory.objects.totals(
+                funds=Fund.objects.filter(pk=house.pk)
+            ),
+            {saving.pk: {'USD': Money(40, USD)}}
+        )
+
+    def test_category_report(self):
+        saving = InputCategory.objects.get(name="Saving")
+        fastfood = InputCategory.objects.get(name="Less fastfood")
+        self.assertEqual(
+            self.client.get(reverse('category-report')).status_code, 401
+        )
+        partner = User.objects.create_user(username='p', password='p')
+        Fund.objects.get(name="Travel Fund").partners.add(partner)
+        self.client.force_login(partner)
+        # The inputs of funds the user isn't a partner in are left out.
+        house = Fund.objects.create(name="House", description="")
+        bank = Account.objects.create(name='Bank', description='', fund=house)
+        CashInput.objects.create(
+            description='Dollars', value=Money(40, USD),
+            entry_date=timezone.now(), account=bank,
+        ).category.add(saving)
+
+        # The session, the user, the totals and the categories.
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('category-report'))
+        self.assertEqual(json.loads(response.content.decode()), {
+            'categories': [
+                {'id': fastfood.pk, 'name': 'Less fastfood',
+                 'totals': {'BRL': 200.0}},
+                {'id': saving.pk, 'name': 'Saving',
+                 'totals': {'BRL': 330.0}},
+            ],
+        })
+        response = self.client.get(
+            reverse('category-report'), {'until': '2000-01-01'}
+        )
+        self.assertEqual(
+            json.loads(response.content.decode()), {'categories': []}
+        )
+        for params in ({'fund': 'x'}, {'since': '2016-13-01'}):
+            response = self.client.get(reverse('category-report'), params)
+            self.assertEqual(response.status_code, 400)
+        response = self.client.get(
+            reverse('category-report'), {'fund': house.pk}
+        )
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(
+            reverse('category-report'), {'account': bank.pk}
+        )
+        self.assertEqual(response.status_code, 404)
+        own = Account.objects.get(fund__name="Travel Fund")
+        response = self.client.get(
+            reverse('category-report'), {'account': own.pk}
+        )
+        self.assertEqual(
+            [c['name'] for c in json.loads(response.content.decode())[
+                'categories'
+            ]],
+            ['Less fastfood', 'Saving']
+        )
+
+
+class QuotationConcurrencyTest(FileDatabaseTestCase):
+
+    def test_concurrent_winners(self):
+        fund = Fund.objects.create(name="Travel Fund", description="")
+        partner = User.objects.create(username='u', password='p')
+        due_date = timezone.now()
+        expense = Expense.objects.create(
+            name="Airfare", due_date=due_date, fund=fund, partner=partner
+        )
+        other = Expense.objects.create(
+            name="Hotel", due_date=due_date, fund=fund, partner=partner
+        )
+        hotel = other.quotations.create(
+            name="Hotel", value=Money(300, USD), due_date=due_date,
+            fund=fund, partner=partner, is_winner=True
+        )
+        pks = [
+            expense.quotations.create(
+                name="Airline {}".format(i), value=Money(1000 + i, USD),
+                due_date=due_date, fund=fund, partner=partner
+            ).pk
+            for i in range(8)
+        ]
+        barrier = threading.Barrier(len(pks))
+        errors = []
+
+        def pick(pk):
+            try:
+                quotation = Quotation.objects.get(pk=pk)
+                quotation.is_winner = True
+                barrier.wait()
+                quotation.save()
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=pick, args=(pk,)) for pk in pks]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        winners = list(expense.quotations.filter(is_winner=True))
+        self.assertEqual(len(winners), 1)
+        self.assertEqual(
+            Expense.objects.get(pk=expense.pk).winning_quotation, winners[0]
+        )
+        self.assertTrue(Quotation.objects.get(pk=hotel.pk).is_winner)
+
 
 class AccountTest(TestCase):
     def setUp(self):
@@ -211,3 +550,624 @@ class AccountTest(TestCase):
     def test_account(self):
         account = Account.objects.first()
         self.assertEqual(account.balance, Money(222.60, BRL))
+
+    def test_empty_account(self):
+        account = Account.objects.create(
+            name='Empty', description='Nothing yet', fund=Fund.objects.first()
+        )
+        self.assertEqual(account.balance, Money(0, USD))
+
+    def test_balance_in_fund_currency(self):
+        account = Account.objects.select_related('fund').first()
+        CashInput.objects.create(
+            description='Dollars',
+            value=Money(10, USD),
+            entry_date=timezone.now(),
+            account=account
+        )
+        # Mixed totals are given in the USD of the fund.
+        self.assertIsNone(account.balance)
+        ExchangeRate.objects.create(source='USD', target='BRL', rate=4)
+        self.addCleanup(bump_version, RATES_SCOPE)
+        self.assertEqual(account.balance, Money('65.65', USD))
+
+        Fund.objects.filter(pk=account.fund_id).update(currency='BRL')
+        bump_version(fund_scope(account.fund_id))
+        account = Account.objects.get(pk=account.pk)
+        self.assertEqual(account.balance, Money('262.60', BRL))
+
+
+class AccountBalanceTest(TestCase):
+    def setUp(self):
+        travel = Fund.objects.create(
+            name="Travel Fund",
+            description="Travel around the World",
+            currency='BRL',
+        )
+        self.bank = Account.objects.create(
+            name='Bank', description='Bank', fund=travel
+        )
+        self.wallet = Account.objects.create(
+            name='Wallet', description='Wallet', fund=travel
+        )
+
+    def add_input(self, value, account=None):
+        return CashInput.objects.create(
+            description='Savings',
+            value=value,
+            entry_date=timezone.now(),
+            account=account or self.bank
+        )
+
+    def test_save_and_delete(self):
+        cash_input = self.add_input(100)
+        self.add_input(Money(20, USD))
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                [b.money for b in self.bank.balances.order_by('currency')],
+                [Money(100, BRL), Money(20, USD)]
+            )
+
+        cash_input.value = Money(80, BRL)
+        cash_input.save()
+        self.assertEqual(
+            AccountBalance.objects.get(currency='BRL').amount, 80
+        )
+
+        cash_input.account = self.wallet
+        cash_input.save()
+        self.assertEqual(self.wallet.balance, Money(80, BRL))
+        self.assertEqual(
+            self.bank.balances.get(currency='BRL').money, Money(0, BRL)
+        )
+
+        cash_input.delete()
+        self.assertEqual(self.wallet.balance, Money(0, BRL))
+        self.assertEqual(AccountBalance.objects.mismatches(), {})
+
+    def test_bulk_paths(self):
+        CashInput.objects.bulk_create([
+            CashInput(
+                description='Bulk',
+                value=Money(10, BRL),
+                entry_date=timezone.now(),
+                account=self.bank
+            )
+            for _ in range(5)
+        ])
+        self.assertEqual(self.bank.balance, Money(50, BRL))
+
+        CashInput.objects.filter(value=10).update(value=20)
+        self.assertEqual(self.bank.balance, Money(100, BRL))
+
+        CashInput.objects.filter(
+            pk__in=CashInput.objects.values('pk')[:2]
+        ).update(account=self.wallet)
+        self.assertEqual(self.bank.balance, Money(60, BRL))
+        self.assertEqual(self.wallet.balance, Money(40, BRL))
+
+        CashInput.objects.filter(account=self.bank).delete()
+        self.assertEqual(self.bank.balance, Money(0, BRL))
+        self.assertEqual(AccountBalance.objects.mismatches(), {})
+
+    def test_rebuild_command(self):
+        self.add_input(100)
+        self.add_input(50, self.wallet)
+        AccountBalance.objects.filter(account=self.bank).update(amount=1)
+
+        with self.assertRaises(CommandError):
+            call_command('rebuild_balances', verify=True, stdout=StringIO())
+        out = StringIO()
+        call_command('rebuild_balances', stdout=out)
+        self.assertIn('1 ledger entries fixed.', out.getvalue())
+        self.assertEqual(self.bank.balance, Money(100, BRL))
+        self.assertEqual(self.wallet.balance, Money(50, BRL))
+        call_command('rebuild_balances', verify=True, stdout=StringIO())
+
+    def test_balance_at(self):
+        def add(day, value, account=None):
+            return CashInput.objects.create(
+                description='Savings',
+                value=value,
+                entry_date=timezone.datetime(
+                    2016, 1, 1, 12, tzinfo=timezone.utc
+                ) + timezone.timedelta(days=day),
+                account=account or self.bank
+            )
+        add(0, 100)
+        add(40, 50)
+        add(45, 30, self.wallet)
+        late = add(70, 20)
+
+        self.assertEqual(
+            self.bank.balance_at(date(2015, 12, 31)), Money(0, BRL)
+        )
+        self.assertEqual(
+            self.bank.balance_at(date(2016, 2, 9)), Money(100, BRL)
+        )
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                self.bank.balance_at(date(2016, 2, 10)), Money(150, BRL)
+            )
+        self.assertEqual(
+            self.bank.balance_at(date(2016, 12, 31)), Money(170, BRL)
+        )
+        fund = self.bank.fund
+        self.assertEqual(fund.amount_at(date(2016, 2, 20)), Money(180, BRL))
+
+        # Back dated, moved and deleted inputs update the checkpoints.
+        add(-30, 5)
+        late.entry_date = timezone.datetime(2016, 1, 3, tzinfo=timezone.utc)
+        late.save()
+        CashInput.objects.filter(account=self.wallet).update(
+            entry_date=timezone.datetime(2016, 5, 1, tzinfo=timezone.utc)
+        )
+        self.assertEqual(
+            self.bank.balance_at(date(2016, 1, 2)), Money(105, BRL)
+        )
+        self.assertEqual(
+            self.bank.balance_at(date(2016, 1, 3)), Money(125, BRL)
+        )
+        self.assertEqual(fund.amount_at(date(2016, 4, 30)), Money(175, BRL))
+        self.assertEqual(fund.amount_at(date(2016, 5, 1)), Money(205, BRL))
+        self.assertEqual(
+            sorted(MonthlyTotal.objects.exclude(amount=0).values_list(
+                'month', 'amount'
+            )),
+            [(date(2015, 12, 1), 5), (date(2016, 1, 1), 120),
+             (date(2016, 2, 1), 50), (date(2016, 5, 1), 30)]
+        )
+        self.assertEqual(MonthlyTotal.objects.mismatches(), {})
+
+        MonthlyTotal.objects.filter(month=date(2016, 2, 1)).delete()
+        out = StringIO()
+        call_command('rebuild_balances', stdout=out)
+        self.assertIn('2016-02: ledger 0 != inputs 50.00', out.getvalue())
+        self.assertEqual(
+            self.bank.balance_at(date(2016, 3, 1)), Money(175, BRL)
+        )
+
+
+CSV_STATEMENT = """date,description,value,currency,category
+2016-05-01,Salary,1000.00,BRL,Saving;Salary
+2016-05-02,Coffee,-4.50,BRL,
+2016-05-03,Dollars,20,USD,Saving
+2016-05-04,Gift,50,,
+2016-05-05,Refund,15.10,BRL,Refund
+"""
+
+OFX_STATEMENT = """OFXHEADER:100
+DATA:OFXSGML
+
+<OFX><BANKMSGSRSV1><STMTTRNRS><STMTRS>
+<CURDEF>BRL
+<BANKACCTFROM><BANKID>0341<ACCTID>Bank</BANKACCTFROM>
+<BANKTRANLIST>
+<STMTTRN><TRNTYPE>CREDIT<DTPOSTED>20160505120000[-3:BRT]
+<TRNAMT>150.25<FITID>1<NAME>Transfer<MEMO>Savings</STMTTRN>
+<STMTTRN>
+<TRNTYPE>DEBIT
+<DTPOSTED>20160506
+<TRNAMT>-20.00
+<FITID>2
+<NAME>Fee
+</STMTTRN>
+</BANKTRANLIST></STMTRS></STMTTRNRS></BANKMSGSRSV1></OFX>
+"""
+
+
+class ImportersTest(TestCase):
+    def setUp(self):
+        travel = Fund.objects.create(
+            name="Travel Fund", description="", currency='BRL'
+        )
+        self.bank = Account.objects.create(
+            name='Bank', description='Bank', fund=travel
+        )
+        self.saving = InputCategory.objects.create(
+            name="Saving", description="Saving monthly"
+        )
+
+    def test_csv(self):
+        rows = importers.parse_csv(StringIO(CSV_STATEMENT))
+        result = importers.import_inputs(
+            rows, account=self.bank, batch_size=2
+        )
+        self.assertEqual(result, importers.ImportResult(5, 0))
+        self.assertEqual(
+            [b.money for b in self.bank.balances.order_by('currency')],
+            [Money('1060.60', BRL), Money(20, USD)]
+        )
+        self.assertEqual(
+            sorted(self.saving.inputs.values_list('description', flat=True)),
+            ['Dollars', 'Salary']
+        )
+        coffee = CashInput.objects.get(description='Coffee')
+        self.assertEqual(coffee.category.count(), 0)
+        self.assertEqual(coffee.entry_date.day, 2)
+        self.assertEqual(
+            CashInput.objects.get(description='Refund').category.get().name,
+            'Refund'
+        )
+
+    def test_ofx(self):
+        rows = list(importers.parse_ofx(StringIO(OFX_STATEMENT)))
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[0].description, 'Transfer Savings')
+        self.assertEqual(rows[0].value, Money('150.25', BRL))
+        self.assertEqual(rows[0].account, 'Bank')
+        self.assertEqual(
+            rows[0].entry_date,
+            timezone.datetime(2016, 5, 5, 15, tzinfo=timezone.utc)
+        )
+        self.assertEqual(rows[1].entry_date.day, 6)
+
+        importers.import_inputs(rows, categories=['Bank statement'])
+        self.assertEqual(self.bank.balance, Money('130.25', BRL))
+        self.assertEqual(
+            InputCategory.objects.get(name='Bank statement').inputs.count(), 2
+        )
+
+    def test_invalid_row(self):
+        rows = importers.parse_csv(StringIO(
+            "date,description,value\n2016-05-01,Salary,lots\n"
+        ))
+        with self.assertRaisesRegexp(importers.ImportRowError, 'Line 2'):
+            importers.import_inputs(rows, account=self.bank)
+
+        rows = importers.parse_csv(StringIO(
+            "date,description,value\n2016-05-01,Salary,10\n2016-05-02,Tip\n"
+        ))
+        with self.assertRaisesRegexp(
+                importers.ImportRowError, "Line 3: missing column 'value'"):
+            importers.import_inputs(rows, account=self.bank)
+        rows = importers.parse_csv(StringIO("date,value\n2016-05-01,10\n"))
+        with self.assertRaisesRegexp(
+                importers.ImportRowError, "missing column 'description'"):
+            list(rows)
+        for currency in ('XYZ', 'REAL', 'US'):
+            rows = importers.parse_csv(StringIO(
+                "date,description,value,currency\n"
+                "2016-05-01,Salary,10,usd\n"
+                "2016-05-02,Tip,5,{}\n".format(currency)
+            ))
+            with self.assertRaisesRegexp(
+                    importers.ImportRowError,
+                    r"Line 3: \[{}\] isn't a valid currency".format(currency)):
+                list(rows)
+
+    def test_ofx_dates(self):
+        utc = timezone.utc
+        for value, expected in (
+                ('20160105', timezone.datetime(2016, 1, 5, tzinfo=utc)),
+                ('20160105120000.000[-3:BRT]',
+                 timezone.datetime(2016, 1, 5, 15, tzinfo=utc)),
+                ('20160105223000[+5.5:IST]',
+                 timezone.datetime(2016, 1, 5, 17, tzinfo=utc)),
+                ('20160105220000[-3]',
+                 timezone.datetime(2016, 1, 6, 1, tzinfo=utc))):
+            self.assertEqual(importers.parse_date(value, 1), expected)
+
+    def test_command(self):
+        fd, path = tempfile.mkstemp(suffix='.csv')
+        self.addCleanup(os.remove, path)
+        with os.fdopen(fd, 'w') as statement:
+            statement.write(CSV_STATEMENT)
+        out = StringIO()
+        call_command(
+            'import_inputs', path, account='Bank', batch_size=3, stdout=out
+        )
+        self.assertIn('5 inputs imported, 0 duplicates.', out.getvalue())
+        self.assertIn('3 inputs imported (', out.getvalue())
+        self.assertEqual(CashInput.objects.count(), 5)
+
+    def test_reimport(self):
+        importers.import_inputs(
+            importers.parse_csv(StringIO(CSV_STATEMENT)), account=self.bank
+        )
+        overlapping = CSV_STATEMENT + (
+            "2016-05-06,Coffee,-4.50,BRL,\n"
+            "2016-05-06,Coffee,-4.50,BRL,\n"
+        )
+        result = importers.import_inputs(
+            importers.parse_csv(StringIO(overlapping)),
+            account=self.bank,
+            batch_size=3
+        )
+        self.assertEqual(result, importers.ImportResult(2, 5))
+        self.assertEqual(CashInput.objects.count(), 7)
+
+        # Same statement again, now categorizing what was already imported.
+        result = importers.import_inputs(
+            importers.parse_csv(StringIO(overlapping)),
+            account=self.bank,
+            categories=['Reviewed'],
+            on_duplicate='update'
+        )
+        self.assertEqual(result, importers.ImportResult(0, 7))
+        self.assertEqual(
+            InputCategory.objects.get(name='Reviewed').inputs.count(), 7
+        )
+        self.assertEqual(
+            self.bank.balances.get(currency='BRL').amount,
+            Decimal('1051.60')
+        )
+
+    def test_fingerprint(self):
+        statement = (
+            "date,description,value\n2016-05-01,  Savings   Monthly,10\n"
+        )
+        importers.import_inputs(
+            importers.parse_csv(StringIO(statement)), account=self.bank
+        )
+        cash_input = CashInput.objects.get()
+        fingerprint = cash_input.fingerprint
+        self.assertEqual(fingerprint, input_fingerprint(
+            self.bank.pk,
+            cash_input.entry_date,
+            Money(10, BRL),
+            'savings monthly'
+        ))
+        cash_input.description = 'Edited'
+        cash_input.save()
+        self.assertEqual(
+            CashInput.objects.get(pk=cash_input.pk).fingerprint, fingerprint
+        )
+        result = importers.import_inputs(
+            importers.parse_csv(StringIO(statement)), account=self.bank
+        )
+        self.assertEqual(result, importers.ImportResult(0, 1))
+
+    def test_update_descriptions(self):
+        statement = (
+            "date,description,value\n"
+            "2016-05-01,Savings,10\n2016-05-02,Salary,20\n"
+            "2016-05-03,Rent,-5\n"
+        )
+        importers.import_inputs(
+            importers.parse_csv(StringIO(statement)), account=self.bank
+        )
+        edited = {
+            pk: 'Edited {}'.format(pk)
+            for pk in CashInput.objects.values_list('pk', flat=True)
+        }
+        with self.assertNumQueries(1):
+            importers.update_descriptions(edited)
+        self.assertEqual(
+            dict(CashInput.objects.values_list('pk', 'description')), edited
+        )
+        result = importers.import_inputs(
+            importers.parse_csv(StringIO(statement)),
+            account=self.bank,
+            on_duplicate='update'
+        )
+        self.assertEqual(result, importers.ImportResult(0, 3))
+        self.assertEqual(
+            sorted(CashInput.objects.values_list('description', flat=True)),
+            ['Rent', 'Salary', 'Savings']
+        )
+
+    def test_manual_inputs_repeat(self):
+        entry_date = timezone.datetime(2016, 5, 1, tzinfo=timezone.utc)
+
+        def deposit():
+            return CashInput(
+                description='Deposit', value=Money(10, BRL),
+                entry_date=entry_date, account=self.bank
+            )
+        deposit().save()
+        deposit().save()
+        CashInput.objects.bulk_create([deposit(), deposit()])
+        self.assertEqual(
+            list(CashInput.objects.values_list('fingerprint', flat=True)),
+            [None] * 4
+        )
+        self.assertEqual(self.bank.balance, Money(40, BRL))
+
+
+class BalanceSeriesTest(TestCase):
+
+    def setUp(self):
+        self.travel = Fund.objects.create(name="Travel", description="")
+        self.partner = User.objects.create_user(username='p', password='p')
+        self.travel.partners.add(self.partner)
+        self.wallet = Account.objects.create(
+            name='Wallet', description='', fund=self.travel
+        )
+        self.bank = Account.objects.create(
+            name='Bank', description='', fund=self.travel
+        )
+        for day, value, account in ((1, Money(10, BRL), self.wallet),
+                                    (1, Money(5, BRL), self.bank),
+                                    (6, Money(20, BRL), self.wallet),
+                                    (7, Money(3, USD), self.bank),
+                                    (8, Money(-4, BRL), self.wallet),
+                                    (40, Money(100, BRL), self.wallet)):
+            CashInput.objects.create(
+                description='Day {}'.format(day),
+                value=value,
+                entry_date=timezone.datetime(
+                    2016, 2, 1, 12, tzinfo=timezone.utc
+                ) + timezone.timedelta(days=day - 1),
+                account=account
+            )
+
+    def assertSeries(self, period, expected, since=None):
+        inputs = CashInput.objects.filter(account__fund=self.travel)
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                inputs.balance_series(period, since=since), expected
+            )
+        with mock.patch(
+                'fundcountdown.cash_flow.models.window_functions_supported',
+                return_value=False):
+            self.assertEqual(
+                inputs.balance_series(period, since=since), expected
+            )
+
+    def test_daily(self):
+        self.assertSeries('day', [
+            (date(2016, 2, 1), 'BRL', Decimal('15.00'), Decimal('15.00')),
+            (date(2016, 2, 6), 'BRL', Decimal('20.00'), Decimal('35.00')),
+            (date(2016, 2, 7), 'USD', Decimal('3.00'), Decimal('3.00')),
+            (date(2016, 2, 8), 'BRL', Decimal('-4.00'), Decimal('31.00')),
+            (date(2016, 3, 11), 'BRL', Decimal('100.00'), Decimal('131.00')),
+        ])
+        self.assertSeries('day', [
+            (date(2016, 2, 8), 'BRL', Decimal('-4.00'), Decimal('31.00')),
+            (date(2016, 3, 11), 'BRL', Decimal('100.00'), Decimal('131.00')),
+        ], since=date(2016, 2, 8))
+
+    def test_weekly_and_monthly(self):
+        self.assertSeries('week', [
+            (date(2016, 2, 1), 'BRL', Decimal('35.00'), Decimal('35.00')),
+            (date(2016, 2, 1), 'USD', Decimal('3.00'), Decimal('3.00')),
+            (date(2016, 2, 8), 'BRL', Decimal('-4.00'), Decimal('31.00')),
+            (date(2016, 3, 7), 'BRL', Decimal('100.00'), Decimal('131.00')),
+        ])
+        self.assertSeries('month', [
+            (date(2016, 2, 1), 'BRL', Decimal('31.00'), Decimal('31.00')),
+            (date(2016, 2, 1), 'USD', Decimal('3.00'), Decimal('3.00')),
+            (date(2016, 3, 1), 'BRL', Decimal('100.00'), Decimal('131.00')),
+        ])
+        with self.assertRaises(ValueError):
+            CashInput.objects.balance_series('year')
+
+    def test_endpoint(self):
+        self.client.force_login(self.partner)
+        url = reverse('account-balance-series', args=[self.wallet.pk])
+        response = self.client.get(url, {'period': 'month'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content.decode()), {
+            'period': 'month',
+            'series': {'BRL': {
+                'date': ['2016-02-01', '2016-03-01'],
+                'deposits': [26.0, 100.0],
+                'balance': [26.0, 126.0],
+            }},
+        })
+
+        url = reverse('fund-balance-series', args=[self.travel.pk])
+        response = self.client.get(url, {'until': '2016-02-07'})
+        series = json.loads(response.content.decode())['series']
+        self.assertEqual(series['BRL']['balance'], [15.0, 35.0])
+        self.assertEqual(series['USD']['date'], ['2016-02-07'])
+
+        for params in ({'period': 'x'}, {'since': 'x'}):
+            self.assertEqual(self.client.get(url, params).status_code, 400)
+        self.assertEqual(
+            self.client.get(
+                reverse('fund-balance-series', args=[0])
+            ).status_code,
+            404
+        )
+
+    def test_endpoint_access(self):
+        urls = [
+            reverse('account-balance-series', args=[self.wallet.pk]),
+            reverse('fund-balance-series', args=[self.travel.pk]),
+        ]
+        for url in urls:
+            self.assertEqual(self.client.get(url).status_code, 401)
+        # Only partners of the fund see its balances.
+        self.client.force_login(
+            User.objects.create_user(username='other', password='p')
+        )
+        for url in urls:
+            self.assertEqual(self.client.get(url).status_code, 404)
+
+
+class ScheduleTest(TestCase):
+
+    def setUp(self):
+        self.travel = Fund.objects.create(name="Travel", description="")
+        self.partner = User.objects.create_user(username='u', password='p')
+        self.travel.partners.add(self.partner)
+        partner = self.partner
+        self.rent = Expense.objects.create(
+            name="Rent",
+            description="",
+            value=Money(100, USD),
+            occurrence=3,
+            due_date=timezone.datetime(2016, 1, 31, tzinfo=timezone.utc),
+            fund=self.travel,
+            partner=partner
+        )
+        self.airfare = Expense.objects.create(
+            name="Airfare",
+            description="",
+            due_date=timezone.datetime(2016, 1, 1, tzinfo=timezone.utc),
+            fund=self.travel,
+            partner=partner
+        )
+        self.airfare.quotations.create(
+            name="Airline",
+            description="",
+            value=Money(400, USD),
+            occurrence=2,
+            due_date=timezone.datetime(2016, 2, 15, tzinfo=timezone.utc),
+            fund=self.travel,
+            partner=partner
+        )
+
+    def test_installments(self):
+        self.assertEqual(
+            [(i.due_date.date(), i.number, i.count, i.value)
+             for i in self.rent.installments()],
+            [(date(2016, 1, 31), 1, 3, Money(100, USD)),
+             (date(2016, 2, 29), 2, 3, Money(100, USD)),
+             (date(2016, 3, 31), 3, 3, Money(100, USD))]
+        )
+        # Expenses with quotations follow the winning quotation.
+        airfare = Expense.objects.get(pk=self.airfare.pk)
+        self.assertEqual(
+            [(i.due_date.date(), i.value) for i in airfare.installments()],
+            [(date(2016, 2, 15), Money(400, USD)),
+             (date(2016, 3, 15), Money(400, USD))]
+        )
+
+    def test_schedule(self):
+        with self.assertNumQueries(1):
+            schedule = [
+                (i.due_date.date(), i.name)
+                for i in Expense.objects.filter(fund=self.travel).schedule(
+                    since=timezone.datetime(2016, 2, 1, tzinfo=timezone.utc),
+                    until=timezone.datetime(2016, 3, 31, tzinfo=timezone.utc),
+                )
+            ]
+        self.assertEqual(schedule, [
+            (date(2016, 2, 15), 'Airfare'),
+            (date(2016, 2, 29), 'Rent'),
+            (date(2016, 3, 15), 'Airfare'),
+        ])
+
+    def test_lazy(self):
+        Expense.objects.filter(pk=self.rent.pk).update(occurrence=10 ** 9)
+        schedule = Expense.objects.all().schedule()
+        self.assertEqual(
+            [next(schedule).due_date.date() for _ in range(4)],
+            [date(2016, 1, 31), date(2016, 2, 15),
+             date(2016, 2, 29), date(2016, 3, 15)]
+        )
+
+    def test_endpoint(self):
+        url = reverse('fund-schedule', args=[self.travel.pk])
+        self.assertEqual(self.client.get(url).status_code, 401)
+        self.client.force_login(
+            User.objects.create_user(username='other', password='p')
+        )
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+        self.client.force_login(self.partner)
+        response = self.client.get(url, {'until': '2016-02-29'})
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertEqual(
+            b''.join(response.streaming_content).decode().splitlines(), [
+                'due_date,expense,name,installment,value,currency',
+                '2016-01-31,{},Rent,1/3,100.00,USD'.format(self.rent.pk),
+                '2016-02-15,{},Airfare,1/2,400.00,USD'.format(
+                    self.airfare.pk
+                ),
+                '2016-02-29,{},Rent,2/3,100.00,USD'.format(self.rent.pk),
+            ]
+        )
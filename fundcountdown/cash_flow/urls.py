@@ -0,0 +1,14 @@
+from django.conf.urls import url
+from fundcountdown.cash_flow import views
+
+
+urlpatterns = [
+    url(r'^accounts/(?P<pk>\d+)/balance-series/$',
+        views.account_balance_series, name='account-balance-series'),
+    url(r'^funds/(?P<pk>\d+)/balance-series/$',
+        views.fund_balance_series, name='fund-balance-series'),
+    url(r'^funds/(?P<pk>\d+)/schedule/$',
+        views.fund_schedule, name='fund-schedule'),
+    url(r'^categories/report/$',
+        views.category_report, name='category-report'),
+]
@@ -1,3 +1,183 @@
-from django.shortcuts import render
+import csv
+from collections import OrderedDict
+from itertools import chain
+from datetime import timedelta
+from django.http import JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils.dateparse import parse_date
+from django.views.decorators.http import require_GET
+from fundcountdown.cash_flow.models import SERIES_PERIODS, local_midnight
+from fundcountdown.cash_flow.models import Account, CashInput, InputCategory
+from fundcountdown.cash_flow.models import Expense
+from fundcountdown.fund.views import authentication_required
 
-# Create your views here.
+
+class BadRequest(ValueError):
+    pass
+
+
+def bad_request(error):
+    return JsonResponse({'error': str(error)}, status=400)
+
+
+def date_params(request, *names):
+    """ Parses the ISO dates of ``names`` in the query string, None when
+    missing.
+    """
+    dates = {}
+    for name in names:
+        value = request.GET.get(name)
+        try:
+            dates[name] = parse_date(value) if value else None
+        except ValueError:
+            dates[name] = None
+        if value and dates[name] is None:
+            raise BadRequest("[{}] isn't a valid date.".format(value))
+    return dates
+
+
+def id_param(request, name):
+    value = request.GET.get(name)
+    if value and not value.isdigit():
+        raise BadRequest("[{}] isn't a valid id.".format(value))
+    return int(value) if value else None
+
+
+def series_columns(rows):
+    """ Lays ``(date, currency, deposits, balance)`` rows out as one set of
+    columns per currency.
+    """
+    series = OrderedDict()
+    for day, currency, deposits, balance in rows:
+        columns = series.setdefault(currency, OrderedDict([
+            ('date', []), ('deposits', []), ('balance', [])
+        ]))
+        columns['date'].append(day.isoformat())
+        columns['deposits'].append(float(deposits))
+        columns['balance'].append(float(balance))
+    return series
+
+
+def balance_series_response(request, inputs):
+    period = request.GET.get('period', 'day')
+    if period not in SERIES_PERIODS:
+        return bad_request("[{}] isn't a valid period.".format(period))
+    try:
+        dates = date_params(request, 'since', 'until')
+    except BadRequest as error:
+        return bad_request(error)
+    if dates['until'] is not None:
+        inputs = inputs.filter(entry_date__lt=local_midnight(
+            dates['until'] + timedelta(days=1)
+        ))
+    rows = inputs.balance_series(period, since=dates['since'])
+    return JsonResponse({
+        'period': period,
+        'series': series_columns(rows),
+    })
+
+
+@require_GET
+def account_balance_series(request, pk):
+    """ Balance series of an account in a fund of the logged in user. """
+    if not request.user.is_authenticated():
+        return authentication_required()
+    account = get_object_or_404(
+        Account, pk=pk, fund__in=request.user.funds.all()
+    )
+    return balance_series_response(
+        request, CashInput.objects.filter(account=account)
+    )
+
+
+@require_GET
+def fund_balance_series(request, pk):
+    """ Balance series of a fund of the logged in user. """
+    if not request.user.is_authenticated():
+        return authentication_required()
+    fund = get_object_or_404(request.user.funds.all(), pk=pk)
+    return balance_series_response(
+        request, CashInput.objects.filter(account__fund=fund)
+    )
+
+
+@require_GET
+def category_report(request):
+    """ Input totals per category and currency over the funds of the logged
+    in user, optionally narrowed with the fund, account, since and until
+    parameters.
+    """
+    if not request.user.is_authenticated():
+        return authentication_required()
+    try:
+        dates = date_params(request, 'since', 'until')
+        fund = id_param(request, 'fund')
+        account = id_param(request, 'account')
+    except BadRequest as error:
+        return bad_request(error)
+    funds = request.user.funds.all()
+    if fund is not None:
+        get_object_or_404(funds, pk=fund)
+    if account is not None:
+        get_object_or_404(Account, pk=account, fund__in=funds)
+    totals = InputCategory.objects.totals(
+        fund=fund, account=account, funds=funds, **dates
+    )
+    categories = InputCategory.objects.filter(pk__in=list(totals)).order_by(
+        'name', 'pk'
+    ).values_list('pk', 'name')
+    return JsonResponse({'categories': [
+        OrderedDict([
+            ('id', pk),
+            ('name', name),
+            ('totals', OrderedDict(
+                (currency, float(money.amount))
+                for currency, money in sorted(totals[pk].items())
+            )),
+        ])
+        for pk, name in categories
+    ]})
+
+
+class Echo(object):
+    """ File-like object handing back what csv.writer writes to it. """
+
+    def write(self, value):
+        return value
+
+
+@require_GET
+def fund_schedule(request, pk):
+    """ Streams the payment calendar of a fund of the logged in user as CSV,
+    optionally from ``since`` to ``until`` (both included).
+    """
+    if not request.user.is_authenticated():
+        return authentication_required()
+    fund = get_object_or_404(request.user.funds.all(), pk=pk)
+    try:
+        dates = date_params(request, 'since', 'until')
+    except BadRequest as error:
+        return bad_request(error)
+    since, until = dates['since'], dates['until']
+    installments = Expense.objects.filter(fund=fund).schedule(
+        since=local_midnight(since) if since else None,
+        until=local_midnight(until + timedelta(days=1)) if until else None,
+    )
+    writer = csv.writer(Echo())
+    rows = (
+        writer.writerow([
+            i.due_date.date().isoformat(), i.expense_id, i.name,
+            '{}/{}'.format(i.number, i.count), i.value.amount,
+            i.value.currency,
+        ])
+        for i in installments
+    )
+    header = writer.writerow(
+        ['due_date', 'expense', 'name', 'installment', 'value', 'currency']
+    )
+    response = StreamingHttpResponse(
+        chain([header], rows), content_type='text/csv'
+    )
+    response['Content-Disposition'] = \
+        'attachment; filename="fund-{}-schedule.csv"'.format(fund.pk)
+    return response
@@ -0,0 +1,139 @@
+""" Versioned cache for computed model properties.
+
+Values are stored under a key that embeds the version of their scope
+(e.g. ``fund:1``). Writes bump the version instead of deleting keys, so
+stale values are never read again and simply age out of the backend.
+Within a request values are also memoized in memory, see
+RequestMemoMiddleware.
+
+The versions only reach other processes through a shared backend. With a
+process-local one (LocMemCache, DummyCache) values are kept for
+PROPERTY_CACHE_LOCAL_TIMEOUT seconds instead of PROPERTY_CACHE_TIMEOUT,
+which bounds how long another process may serve them after a write.
+"""
+import threading
+import time
+from functools import wraps
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+
+_local = threading.local()
+_stats_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0, 'memo_hits': 0}
+
+
+def get_cache():
+    return caches[getattr(settings, 'PROPERTY_CACHE_ALIAS', 'default')]
+
+
+def is_process_local(cache=None):
+    return isinstance(cache or get_cache(), (LocMemCache, DummyCache))
+
+
+def timeout():
+    """ Seconds computed values are kept for, see the module docstring. """
+    if is_process_local():
+        return getattr(settings, 'PROPERTY_CACHE_LOCAL_TIMEOUT', 5)
+    return getattr(settings, 'PROPERTY_CACHE_TIMEOUT', 60 * 60 * 24)
+
+
+def fund_scope(fund_id):
+    return 'fund:{}'.format(fund_id)
+
+
+def _version_key(scope):
+    return 'version:{}'.format(scope)
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def stats():
+    """ Returns the hit/miss counters of this process. """
+    with _stats_lock:
+        return dict(_stats)
+
+
+def reset_stats():
+    with _stats_lock:
+        for name in _stats:
+            _stats[name] = 0
+
+
+def get_version(scope):
+    cache = get_cache()
+    key = _version_key(scope)
+    version = cache.get(key)
+    if version is None:
+        # Start from the clock, not from 1, so an evicted version never
+        # points back to values cached before the eviction.
+        cache.add(key, int(time.time() * 1000), None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(*scopes):
+    """ Invalidates everything cached under ``scopes``.
+
+    Inside a transaction the versions are bumped again on commit, so values
+    computed by other requests before the commit are dropped as well.
+    """
+    _bump(scopes)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: _bump(scopes))
+
+
+def _bump(scopes):
+    cache = get_cache()
+    memo = getattr(_local, 'memo', None)
+    for scope in scopes:
+        try:
+            cache.incr(_version_key(scope))
+        except ValueError:
+            get_version(scope)
+        if memo:
+            for key in [k for k in memo if k[0] == scope]:
+                del memo[key]
+
+
+def versioned_cache(scope):
+    """ Caches a method result under the version of ``scope(self)``. """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(self, *args, **kwargs):
+            name = '{}.{}:{}'.format(
+                type(self).__name__, func.__name__, self.pk
+            )
+            scope_key = scope(self)
+            memo = getattr(_local, 'memo', None)
+            if memo is not None and (scope_key, name) in memo:
+                _count('memo_hits')
+                return memo[(scope_key, name)]
+
+            cache = get_cache()
+            key = '{}:v{}:{}'.format(scope_key, get_version(scope_key), name)
+            value = cache.get(key)
+            if value is None:
+                _count('misses')
+                value = func(self, *args, **kwargs)
+                cache.set(key, value, timeout())
+            else:
+                _count('hits')
+            if memo is not None:
+                memo[(scope_key, name)] = value
+            return value
+        return wrapper
+    return decorator
+
+
+def start_request_memo():
+    _local.memo = {}
+
+
+def end_request_memo():
+    _local.memo = None
@@ -0,0 +1,106 @@
+""" Currency conversion over the ExchangeRate table.
+
+The rates are read once per process into memory and read again only
+after a write bumps their cache version, so a conversion never queries
+the database. The version reaches other processes through the shared
+property cache; with a process-local backend the table is also read
+again once it is older than ``cache.timeout()`` seconds.
+
+Amounts are converted by column: grouped by currency, with one rate
+lookup per currency rather than per amount.
+"""
+import threading
+import time
+from decimal import Decimal
+from moneyed import Money
+from fundcountdown.core.cache import get_version, is_process_local, timeout
+from fundcountdown.core.models import RATES_SCOPE, ExchangeRate
+from fundcountdown.core.money import to_decimal
+from fundcountdown.core.profiling import traced
+
+_lock = threading.Lock()
+_table = {'version': None, 'loaded': 0, 'rates': {}}
+
+
+class UnknownRate(LookupError):
+    def __init__(self, source, target):
+        super(UnknownRate, self).__init__(
+            'No exchange rate from {} to {}.'.format(source, target)
+        )
+        self.source = source
+        self.target = target
+
+
+def rates():
+    """ Returns ``{(source, target): Decimal}``, inverse rates included. """
+    version = get_version(RATES_SCOPE)
+    with _lock:
+        expired = (
+            is_process_local() and time.time() - _table['loaded'] > timeout()
+        )
+        if _table['version'] != version or expired:
+            table = {}
+            for source, target, rate in ExchangeRate.objects.values_list(
+                    'source', 'target', 'rate'):
+                table.setdefault((target, source), 1 / rate)
+                table[(source, target)] = rate
+            _table.update(version=version, loaded=time.time(), rates=table)
+        return _table['rates']
+
+
+def rate(source, target):
+    """ Rate from ``source`` to ``target``, directly or across a third
+    currency rated against both.
+    """
+    if source == target:
+        return Decimal(1)
+    table = rates()
+    if (source, target) in table:
+        return table[(source, target)]
+    for (start, middle), first in sorted(table.items()):
+        if start == source and (middle, target) in table:
+            return first * table[(middle, target)]
+    raise UnknownRate(source, target)
+
+
+def convert_amounts(amounts, currencies, target):
+    """ Converts the parallel columns ``amounts`` and ``currencies`` to
+    ``target``, returning a list of Decimals.
+    """
+    currencies = list(currencies)
+    factors = {c: rate(c, target) for c in set(currencies)}
+    return [
+        to_decimal(to_decimal(amount) * factors[currency])
+        for amount, currency in zip(amounts, currencies)
+    ]
+
+
+def convert(money, target):
+    if money.currency.code == target:
+        return money
+    return Money(
+        convert_amounts([money.amount], [money.currency.code], target)[0],
+        target
+    )
+
+
+@traced('Money.convert')
+def convert_totals(totals, target):
+    """ Adds a ``{currency: Money}`` map up in ``target``. """
+    amounts = convert_amounts(
+        [m.amount for m in totals.values()], totals, target
+    )
+    return Money(sum(amounts, Decimal(0)), target)
+
+
+@traced('Money.total')
+def total_in(totals, currency):
+    """ Adds a ``{currency: Money}`` map up.
+
+    Totals in a single currency are kept in it, mixed ones are converted
+    to ``currency``. Empty totals are zero in ``currency``.
+    """
+    if len(totals) == 1:
+        return next(iter(totals.values()))
+    return convert_totals(totals, currency)
+
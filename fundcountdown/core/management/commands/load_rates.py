@@ -0,0 +1,51 @@
+import csv
+import io
+from decimal import Decimal, InvalidOperation
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from fundcountdown.core.models import ExchangeRate
+
+
+class Command(BaseCommand):
+    help = (
+        'Loads exchange rates from a CSV file with source, target and rate '
+        'columns.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--encoding', default='utf-8')
+
+    def handle(self, *args, **options):
+        rates = {}
+        with io.open(options['path'], encoding=options['encoding'],
+                     newline='') as f:
+            for line, record in enumerate(csv.DictReader(f), 2):
+                try:
+                    source = record['source'].strip().upper()
+                    target = record['target'].strip().upper()
+                    rate = Decimal(record['rate'].strip())
+                except KeyError as error:
+                    raise CommandError(
+                        'Line {}: missing column {}.'.format(line, error)
+                    )
+                except InvalidOperation:
+                    raise CommandError(
+                        "Line {}: [{}] isn't a valid rate.".format(
+                            line, record['rate']
+                        )
+                    )
+                if len(source) != 3 or len(target) != 3 or rate <= 0:
+                    raise CommandError(
+                        'Line {}: invalid rate {}/{} {}.'.format(
+                            line, source, target, rate
+                        )
+                    )
+                rates[(source, target)] = rate
+
+        with transaction.atomic():
+            for (source, target), rate in sorted(rates.items()):
+                ExchangeRate.objects.update_or_create(
+                    source=source, target=target, defaults={'rate': rate}
+                )
+        self.stdout.write('{} exchange rates loaded.'.format(len(rates)))
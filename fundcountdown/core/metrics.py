@@ -0,0 +1,349 @@
+""" In-process metrics in the Prometheus text format.
+
+Counters and histograms live in a registry guarded by a lock, so worker
+threads can update them concurrently. With METRICS_DIR set, every process
+writes a snapshot of its own values there (``metrics-<pid>.json``) at
+most every METRICS_FLUSH_INTERVAL seconds, and the ``/metrics`` view adds
+up the snapshots of all the processes, e.g. the workers of one gunicorn
+master sharing a local directory. Nothing is recorded unless
+METRICS_ENABLED is set.
+
+The snapshot of a process that exits has to be folded into the permanent
+``metrics-dead.json`` with mark_process_dead, or it is added up forever
+and a new process given the same pid overwrites it, making the counters
+go backwards. With gunicorn, call it from the ``child_exit`` hook of the
+config file::
+
+    import os
+    from fundcountdown.core import metrics
+
+    def child_exit(server, worker):
+        metrics.mark_process_dead(worker.pid, os.environ['METRICS_DIR'])
+
+A process that finds a snapshot under its own pid on its first flush
+folds it in as well, in case the hook didn't run.
+
+The property cache counters of fundcountdown.core.cache are exported as
+``fundcountdown_property_cache_total``; the hit ratio is
+``rate(...{result="hits"}) / sum(rate(...))`` in PromQL.
+"""
+import fcntl
+import glob
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+from functools import wraps
+from django.conf import settings
+from fundcountdown.core import cache
+
+DEFAULT_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+# name: (type, help, buckets)
+METRICS = OrderedDict([
+    ('fundcountdown_request_duration_seconds', (
+        'histogram', 'Request latency by URL name.', DEFAULT_BUCKETS
+    )),
+    ('fundcountdown_request_queries', (
+        'histogram', 'Database queries per request by URL name.',
+        QUERY_BUCKETS
+    )),
+    ('fundcountdown_db_queries_total', (
+        'counter', 'Database queries run by requests.', None
+    )),
+    ('fundcountdown_computation_seconds', (
+        'histogram', 'Time spent in the domain computations.',
+        DEFAULT_BUCKETS
+    )),
+    ('fundcountdown_imported_inputs_total', (
+        'counter', 'Cash inputs written by the importers.', None
+    )),
+    ('fundcountdown_property_cache_total', (
+        'counter', 'Lookups of cached model properties by result.', None
+    )),
+])
+
+logger = logging.getLogger('fundcountdown.metrics')
+
+_lock = threading.Lock()
+_flush_lock = threading.Lock()
+# (name, labels) -> float for counters, [bucket counts..., sum] otherwise.
+_values = {}
+_last_flush = [0.0]
+# Snapshot paths written by this process, see flush.
+_owned = set()
+
+DEAD_FILE = 'metrics-dead.json'
+LOCK_FILE = 'metrics.lock'
+
+
+def enabled():
+    return getattr(settings, 'METRICS_ENABLED', False)
+
+
+def _key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def inc(metric, amount=1, **labels):
+    """ Adds ``amount`` to a counter. """
+    if not enabled():
+        return
+    key = (metric, _key(labels))
+    with _lock:
+        _values[key] = _values.get(key, 0) + amount
+    maybe_flush()
+
+
+def observe(metric, value, **labels):
+    """ Records ``value`` in a histogram. """
+    if not enabled():
+        return
+    buckets = METRICS[metric][2]
+    key = (metric, _key(labels))
+    with _lock:
+        counts = _values.get(key)
+        if counts is None:
+            counts = _values[key] = [0] * (len(buckets) + 2)
+        counts[bisect_left(buckets, value)] += 1
+        counts[-1] += value
+    maybe_flush()
+
+
+def timed(name):
+    """ Observes the run time of the decorated function as
+    ``fundcountdown_computation_seconds{name=...}``.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled():
+                return func(*args, **kwargs)
+            started = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                observe(
+                    'fundcountdown_computation_seconds',
+                    time.time() - started, name=name
+                )
+        return wrapper
+    return decorator
+
+
+def observe_request(url_name, method, seconds, queries):
+    labels = {'url_name': url_name or '', 'method': method}
+    observe('fundcountdown_request_duration_seconds', seconds, **labels)
+    observe('fundcountdown_request_queries', queries, **labels)
+    inc('fundcountdown_db_queries_total', queries, **labels)
+
+
+def snapshot():
+    """ Returns the values of this process as JSON serializable rows. """
+    with _lock:
+        rows = [
+            [name, list(labels), value]
+            for (name, labels), value in _values.items()
+        ]
+    rows.extend(
+        ['fundcountdown_property_cache_total', [('result', result)], count]
+        for result, count in sorted(cache.stats().items())
+    )
+    return rows
+
+
+def _directory():
+    return getattr(settings, 'METRICS_DIR', None)
+
+
+def _snapshot_path(directory, pid):
+    return os.path.join(directory, 'metrics-{}.json'.format(pid))
+
+
+def _read(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def _write(path, rows):
+    fd, temporary = tempfile.mkstemp(
+        dir=os.path.dirname(path), suffix='.tmp'
+    )
+    with os.fdopen(fd, 'w') as f:
+        json.dump(rows, f)
+    os.replace(temporary, path)
+
+
+class _DirectoryLock(object):
+    """ Lock file of a METRICS_DIR: exclusive while snapshots are folded
+    into the dead one, shared while they are read.
+    """
+
+    def __init__(self, directory, shared=False):
+        self.path = os.path.join(directory, LOCK_FILE)
+        self.operation = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+
+    def __enter__(self):
+        self.file = open(self.path, 'a')
+        fcntl.flock(self.file, self.operation)
+
+    def __exit__(self, *exc_info):
+        fcntl.flock(self.file, fcntl.LOCK_UN)
+        self.file.close()
+
+
+def flush():
+    """ Writes the snapshot of this process to METRICS_DIR, creating it.
+
+    Errors are logged rather than raised: metrics never fail a request.
+    """
+    directory = _directory()
+    if not directory:
+        return
+    with _flush_lock:
+        _last_flush[0] = time.time()
+        path = _snapshot_path(directory, os.getpid())
+        try:
+            os.makedirs(directory, exist_ok=True)
+            if path not in _owned:
+                # Left by an earlier process with the same pid.
+                mark_process_dead(os.getpid(), directory)
+                _owned.add(path)
+            _write(path, snapshot())
+        except OSError:
+            logger.exception('Could not write the metrics to %s', directory)
+
+
+def mark_process_dead(pid, directory=None):
+    """ Folds the snapshot of the exited process ``pid`` into the dead one
+    of ``directory`` (METRICS_DIR by default) and removes it.
+    """
+    directory = directory or _directory()
+    if not directory:
+        return
+    path = _snapshot_path(directory, pid)
+    if not os.path.exists(path):
+        return
+    dead = os.path.join(directory, DEAD_FILE)
+    with _DirectoryLock(directory):
+        snapshots = []
+        for source in (dead, path):
+            try:
+                snapshots.append(_read(source))
+            except (OSError, ValueError):
+                continue
+        _write(dead, [
+            [name, list(labels), value]
+            for (name, labels), value in _add_up(snapshots).items()
+        ])
+        os.remove(path)
+
+
+def maybe_flush():
+    interval = getattr(settings, 'METRICS_FLUSH_INTERVAL', 1.0)
+    if _directory() and time.time() - _last_flush[0] >= interval:
+        flush()
+
+
+def collect():
+    """ Returns ``{(name, labels): value}`` added up over every process
+    that wrote to METRICS_DIR, or of this process alone without it or
+    when it can't be read.
+    """
+    directory = _directory()
+    if not directory:
+        return _add_up([snapshot()])
+    flush()
+    snapshots = []
+    try:
+        with _DirectoryLock(directory, shared=True):
+            for path in glob.glob(
+                    os.path.join(directory, 'metrics-*.json')):
+                try:
+                    snapshots.append(_read(path))
+                except (OSError, ValueError):
+                    # Gone or replaced while reading: skip it this scrape.
+                    continue
+    except OSError:
+        logger.exception('Could not read the metrics of %s', directory)
+        return _add_up([snapshot()])
+    return _add_up(snapshots)
+
+
+def _add_up(snapshots):
+    totals = {}
+    for rows in snapshots:
+        for name, labels, value in rows:
+            key = (name, tuple(tuple(pair) for pair in labels))
+            if isinstance(value, list):
+                current = totals.get(key) or [0] * len(value)
+                totals[key] = [a + b for a, b in zip(current, value)]
+            else:
+                totals[key] = totals.get(key, 0) + value
+    return totals
+
+
+def _labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace(
+            '"', '\\"'
+        ).replace('\n', '\\n'))
+        for name, value in pairs
+    ) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render(totals=None):
+    """ Formats the collected metrics in the Prometheus text format. """
+    if totals is None:
+        totals = collect()
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        series = sorted(
+            (labels, value) for (metric, labels), value in totals.items()
+            if metric == name
+        )
+        lines.append('# HELP {} {}'.format(name, help_text))
+        lines.append('# TYPE {} {}'.format(name, kind))
+        for labels, value in series:
+            if kind == 'counter':
+                lines.append('{}{} {}'.format(
+                    name, _labels(labels), _number(value)
+                ))
+                continue
+            cumulative = 0
+            for bound, count in zip(
+                    list(buckets) + [float('inf')], value[:-1]):
+                cumulative += count
+                lines.append('{}_bucket{} {}'.format(
+                    name, _labels(labels, [('le', _number(bound))]),
+                    cumulative
+                ))
+            lines.append('{}_sum{} {}'.format(
+                name, _labels(labels), _number(value[-1])
+            ))
+            lines.append('{}_count{} {}'.format(
+                name, _labels(labels), cumulative
+            ))
+    return '\n'.join(lines) + '\n'
+
+
+def reset():
+    """ Clears the values of this process. """
+    with _lock:
+        _values.clear()
@@ -0,0 +1,158 @@
+import json
+import logging
+import os
+import time
+from itertools import islice
+from django.conf import settings
+from django.db import connections
+from fundcountdown.core import metrics, profiling
+from fundcountdown.core.cache import end_request_memo, start_request_memo
+
+logger = logging.getLogger('fundcountdown.requests')
+
+# Longest SQL kept in the log line of a request.
+SQL_LOG_LENGTH = 500
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class RequestMemoMiddleware(object):
+    """ Memoizes cached model properties for the duration of a request. """
+
+    def process_request(self, request):
+        start_request_memo()
+
+    def process_response(self, request, response):
+        end_request_memo()
+        return response
+
+
+class RequestMetricsMiddleware(object):
+    """ Measures the queries and time of every request.
+
+    The queries are recorded with the debug cursor of every connection,
+    forced on for the request, so it works with ``DEBUG = False``. The
+    figures are sent as a ``Server-Timing`` header (REQUEST_METRICS_HEADER)
+    and logged as one JSON line to ``fundcountdown.requests``. A request
+    over its query budget (QUERY_BUDGETS by URL name, else QUERY_BUDGET)
+    logs a warning, or raises QueryBudgetExceeded when QUERY_BUDGET_ACTION
+    is ``'raise'``.
+
+    Goes first in MIDDLEWARE_CLASSES so the queries of the other
+    middleware are counted. Queries run while a streaming response is
+    consumed happen after it and are left out.
+    """
+
+    def process_request(self, request):
+        # Alias: (force_debug_cursor to restore, start of the query log).
+        request._metrics_cursors = {}
+        for connection in connections.all():
+            request._metrics_cursors[connection.alias] = (
+                connection.force_debug_cursor, len(connection.queries_log)
+            )
+            connection.force_debug_cursor = True
+        request._metrics_started = time.time()
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._metrics_view_started = time.time()
+
+    def process_response(self, request, response):
+        started = getattr(request, '_metrics_started', None)
+        if started is None:
+            # Answered by a middleware above this one.
+            return response
+        finished = time.time()
+        queries = []
+        for connection in connections.all():
+            forced, start = request._metrics_cursors.get(
+                connection.alias, (False, 0)
+            )
+            queries.extend(islice(connection.queries_log, start, None))
+            connection.force_debug_cursor = forced
+        timings = [float(query['time']) for query in queries]
+        slowest = max(
+            range(len(queries)), key=timings.__getitem__
+        ) if queries else None
+        view_started = getattr(request, '_metrics_view_started', started)
+        figures = {
+            'queries': len(queries),
+            'db_ms': round(sum(timings) * 1000, 2),
+            'view_ms': round((finished - view_started) * 1000, 2),
+            'total_ms': round((finished - started) * 1000, 2),
+        }
+
+        if getattr(settings, 'REQUEST_METRICS_HEADER', True):
+            response['Server-Timing'] = ', '.join([
+                'db;dur={};desc="{} queries"'.format(
+                    figures['db_ms'], figures['queries']
+                ),
+                'view;dur={}'.format(figures['view_ms']),
+                'total;dur={}'.format(figures['total_ms']),
+            ])
+
+        match = getattr(request, 'resolver_match', None)
+        url_name = match.url_name if match else None
+        if logger.isEnabledFor(logging.INFO):
+            record = dict(
+                figures,
+                method=request.method,
+                path=request.path,
+                url_name=url_name,
+                status=response.status_code,
+            )
+            if slowest is not None:
+                record['slowest_ms'] = round(timings[slowest] * 1000, 2)
+                record['slowest_sql'] = \
+                    queries[slowest]['sql'][:SQL_LOG_LENGTH]
+            logger.info(json.dumps(record, sort_keys=True))
+        metrics.observe_request(
+            url_name, request.method, finished - started, len(queries)
+        )
+
+        budget = getattr(settings, 'QUERY_BUDGETS', {}).get(
+            url_name, getattr(settings, 'QUERY_BUDGET', None)
+        )
+        if budget is not None and figures['queries'] > budget:
+            message = '{} {} took {} queries, over its budget of {}.'.format(
+                request.method, request.path, figures['queries'], budget
+            )
+            if getattr(settings, 'QUERY_BUDGET_ACTION', 'log') == 'raise':
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return response
+
+
+class PropertyProfilingMiddleware(object):
+    """ Traces the model properties evaluated by a request, see
+    fundcountdown.core.profiling.
+
+    Every request is traced with PROFILE_PROPERTIES; otherwise staff users
+    (or anyone with DEBUG) ask for it with the PROFILE_HEADER header. The
+    collapsed stacks are written to PROFILE_DIR and the name of the file
+    (not its path on the server) is sent back in the ``X-Profile`` header.
+    Goes after AuthenticationMiddleware.
+    """
+
+    def wants_trace(self, request):
+        if getattr(settings, 'PROFILE_PROPERTIES', False):
+            return True
+        header = getattr(settings, 'PROFILE_HEADER', None)
+        if not header:
+            return False
+        key = 'HTTP_' + header.upper().replace('-', '_')
+        if request.META.get(key, '') in ('', '0'):
+            return False
+        user = getattr(request, 'user', None)
+        return settings.DEBUG or bool(user and user.is_staff)
+
+    def process_request(self, request):
+        if self.wants_trace(request):
+            profiling.start('{} {}'.format(request.method, request.path))
+
+    def process_response(self, request, response):
+        trace = profiling.stop()
+        if trace is not None:
+            response['X-Profile'] = os.path.basename(trace.write())
+        return response
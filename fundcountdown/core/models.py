@@ -1,5 +1,34 @@
 from __future__ import unicode_literals
 
 from django.db import models
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from fundcountdown.core.cache import bump_version
 
-# Create your models here.
+# Cache scope of the exchange rate table, see fundcountdown.core.currency.
+RATES_SCOPE = 'rates'
+
+
+class ExchangeRate(models.Model):
+    """ Class ExchangeRate
+
+    How many units of the target currency one unit of the source currency
+    buys. Conversions read them from the in-process table of
+    fundcountdown.core.currency, reloaded after every write.
+    """
+    source = models.CharField(max_length=3)
+    target = models.CharField(max_length=3)
+    rate = models.DecimalField(max_digits=18, decimal_places=8)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('source', 'target')
+
+    def __str__(self):
+        return '{}/{} {}'.format(self.source, self.target, self.rate)
+
+
+@receiver(post_save, sender=ExchangeRate)
+@receiver(post_delete, sender=ExchangeRate)
+def bump_rates_version(sender, instance, **kwargs):
+    bump_version(RATES_SCOPE)
@@ -0,0 +1,30 @@
+from decimal import Decimal
+from moneyed import Money
+
+CENTS = Decimal('0.01')
+
+
+def to_decimal(value):
+    """ Normalizes a raw database number to a two places Decimal.
+
+    Aggregates over decimal columns come back as floats on SQLite, so
+    every SUM read from a cursor passes through here.
+    """
+    if value is None:
+        value = 0
+    if not isinstance(value, Decimal):
+        value = Decimal(str(value))
+    return value.quantize(CENTS)
+
+
+def money_totals(rows):
+    """ Builds a ``{currency: Money}`` map from ``(currency, amount)`` rows.
+    """
+    totals = {}
+    for currency, amount in rows:
+        amount = Money(to_decimal(amount), currency)
+        if currency in totals:
+            amount = totals[currency] + amount
+        totals[currency] = amount
+    return totals
+
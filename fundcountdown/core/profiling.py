@@ -0,0 +1,164 @@
+""" Call tree profiling of the computed model properties.
+
+Functions decorated with ``traced`` record their time and queries while a
+trace is active in the thread (``tracing`` or PropertyProfilingMiddleware),
+nested under the traced function that called them. Without a trace the
+wrapper costs one thread local lookup.
+
+Traces are written as collapsed stacks (``root;Fund.full_cost;... 1200``),
+the input of flamegraph.pl and speedscope: one file with the self time of
+every call path in microseconds and one with its self query count.
+Nothing removes them: clear PROFILE_DIR (the temporary directory by
+default) from cron or tmpreaper, e.g.
+``find "$PROFILE_DIR" -name 'properties-*.folded' -mtime +7 -delete``.
+"""
+import os
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from functools import wraps
+from django.conf import settings
+from django.db import connections
+
+_local = threading.local()
+
+
+class Trace(object):
+    """ Aggregated call tree: ``nodes`` maps call paths to
+    ``[calls, seconds, self seconds, queries, self queries]``.
+
+    Queries are counted with the debug cursor of every connection, forced
+    on while the trace is active.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.nodes = {}
+        self._stack = []
+        self._connections = []
+
+    def _queries(self):
+        return sum(len(c.queries_log) for c, _ in self._connections)
+
+    def enter(self, label):
+        path = (self._stack[-1][0] if self._stack else ()) + (label,)
+        self._stack.append(
+            [path, time.perf_counter(), self._queries(), 0, 0]
+        )
+
+    def exit(self):
+        path, started, queries, child_seconds, child_queries = \
+            self._stack.pop()
+        seconds = time.perf_counter() - started
+        queries = self._queries() - queries
+        node = self.nodes.setdefault(path, [0, 0.0, 0.0, 0, 0])
+        node[0] += 1
+        node[1] += seconds
+        node[2] += seconds - child_seconds
+        node[3] += queries
+        node[4] += queries - child_queries
+        if self._stack:
+            self._stack[-1][3] += seconds
+            self._stack[-1][4] += queries
+
+    def start(self):
+        self._connections = [
+            (c, c.force_debug_cursor) for c in connections.all()
+        ]
+        for connection, _ in self._connections:
+            connection.force_debug_cursor = True
+        self.enter(self.root)
+
+    def stop(self):
+        while self._stack:
+            self.exit()
+        for connection, forced in self._connections:
+            connection.force_debug_cursor = forced
+
+    def collapsed(self, metric='time'):
+        """ Returns the collapsed stack lines of the self ``'time'`` (in
+        microseconds) or ``'queries'`` of every call path.
+        """
+        lines = []
+        for path, node in sorted(self.nodes.items()):
+            value = int(round(node[2] * 1000000)) if metric == 'time' \
+                else node[4]
+            if value > 0:
+                lines.append('{} {}'.format(
+                    ';'.join(label.replace(';', ':') for label in path),
+                    value
+                ))
+        return lines
+
+    def write(self, directory=None, name=None):
+        """ Writes ``<name>.time.folded`` and ``<name>.queries.folded``,
+        returning the path of the first one. The default name is unique, so
+        traces written in the same second don't replace each other.
+        """
+        directory = directory or getattr(settings, 'PROFILE_DIR', None) \
+            or tempfile.gettempdir()
+        name = name or 'properties-{}-{}-{}'.format(
+            time.strftime('%Y%m%d%H%M%S'), os.getpid(), uuid.uuid4().hex[:8]
+        )
+        paths = []
+        for metric in ('time', 'queries'):
+            path = os.path.join(directory, '{}.{}.folded'.format(
+                name, metric
+            ))
+            with open(path, 'w') as f:
+                f.write('\n'.join(self.collapsed(metric)) + '\n')
+            paths.append(path)
+        return paths[0]
+
+
+def current():
+    return getattr(_local, 'trace', None)
+
+
+def start(root):
+    """ Starts tracing the current thread, returning the Trace. """
+    trace = Trace(root)
+    trace.start()
+    _local.trace = trace
+    return trace
+
+
+def stop():
+    """ Stops tracing the current thread, returning the Trace if any. """
+    trace = current()
+    _local.trace = None
+    if trace is not None:
+        trace.stop()
+    return trace
+
+
+@contextmanager
+def tracing(root='trace'):
+    trace = start(root)
+    try:
+        yield trace
+    finally:
+        stop()
+
+
+def traced(label=None):
+    """ Records the calls of the decorated function in the active trace,
+    as ``label`` or the qualified name of the function.
+    """
+    def decorator(func):
+        name = label or func.__qualname__
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            trace = getattr(_local, 'trace', None)
+            if trace is None:
+                return func(*args, **kwargs)
+            trace.enter(name)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                trace.exit()
+        return wrapper
+    return decorator
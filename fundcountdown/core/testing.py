@@ -0,0 +1,44 @@
+""" Test helpers shared by the apps. """
+import os
+import tempfile
+from django.core.management import call_command
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test import TransactionTestCase
+
+
+class FileDatabaseTestCase(TransactionTestCase):
+    """ TransactionTestCase over a scratch SQLite file.
+
+    The in-memory test database is shared between threads in SQLite's
+    shared cache mode, where a lock held by one connection fails the
+    others at once instead of making them wait. Tests that run threads
+    against each other's locks get a file of their own, migrated for the
+    class and deleted afterwards; other tests keep the in-memory database.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        connection = connections[DEFAULT_DB_ALIAS]
+        fd, cls.database_file = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(fd)
+        # SQLite ignores close() on an in-memory database, so its
+        # connection is set aside and put back in tearDownClass. The
+        # threads open theirs from the same settings_dict.
+        cls._test_database = (
+            connection.settings_dict['NAME'], connection.connection
+        )
+        connection.connection = None
+        connection.settings_dict['NAME'] = cls.database_file
+        call_command('migrate', verbosity=0, interactive=False)
+        super(FileDatabaseTestCase, cls).setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        try:
+            super(FileDatabaseTestCase, cls).tearDownClass()
+        finally:
+            connection = connections[DEFAULT_DB_ALIAS]
+            connection.close()
+            name, connection.connection = cls._test_database
+            connection.settings_dict['NAME'] = name
+            os.remove(cls.database_file)
@@ -1,4 +1,29 @@
-from django.test import TestCase
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from decimal import Decimal
+from unittest import mock
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.six import StringIO
+from moneyed import Money, BRL, USD
+from fundcountdown.cash_flow.models import Account
+from fundcountdown.cash_flow.models import CashInput
+from fundcountdown.cash_flow.models import Expense
+from fundcountdown.core import cache, currency, metrics, profiling
+from fundcountdown.core.middleware import SQL_LOG_LENGTH, QueryBudgetExceeded
+from fundcountdown.core.models import RATES_SCOPE, ExchangeRate
+from fundcountdown.fund.models import Fund
 
 
 class CoreTest(TestCase):
@@ -10,3 +35,447 @@ class CoreTest(TestCase):
     def test_admin_access(self):
         response = self.client.get('/admin')
         self.assertEqual(response.status_code, 301)
+
+
+class VersionedCacheTest(TestCase):
+
+    def setUp(self):
+        caches['default'].clear()
+        cache.reset_stats()
+        self.travel = Fund.objects.create(
+            name="Travel", description="", currency='BRL'
+        )
+        self.wallet = Account.objects.create(
+            name='Wallet', description='', fund=self.travel
+        )
+        CashInput.objects.create(
+            description='Savings',
+            value=Money(100, BRL),
+            entry_date=timezone.now(),
+            account=self.wallet
+        )
+
+    def test_cached_until_write(self):
+        self.assertEqual(self.travel.amount, Money(100, BRL))
+        with self.assertNumQueries(0):
+            self.assertEqual(self.travel.amount, Money(100, BRL))
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+        CashInput.objects.create(
+            description='More savings',
+            value=Money(50, BRL),
+            entry_date=timezone.now(),
+            account=self.wallet
+        )
+        self.assertEqual(self.travel.amount, Money(150, BRL))
+        self.assertEqual(self.wallet.balance, Money(150, BRL))
+
+        Expense.objects.create(
+            name="Ticket",
+            description="",
+            value=Money(500, BRL),
+            fund=self.travel,
+            partner=User.objects.create(username='p', password='p')
+        )
+        self.assertEqual(self.travel.full_cost, Money(500, BRL))
+
+    def test_request_memo(self):
+        cache.start_request_memo()
+        try:
+            self.assertEqual(self.wallet.balance, Money(100, BRL))
+            with self.assertNumQueries(0):
+                self.wallet.balance
+            # The totals and the currency of the fund.
+            self.assertEqual(cache.stats()['memo_hits'], 2)
+            CashInput.objects.filter(account=self.wallet).delete()
+            self.assertEqual(self.wallet.balance, Money(0, BRL))
+        finally:
+            cache.end_request_memo()
+
+    def test_file_backend(self):
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location)
+        with override_settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': location,
+        }}):
+            self.assertEqual(self.travel.amount, Money(100, BRL))
+            with self.assertNumQueries(0):
+                self.assertEqual(self.travel.amount, Money(100, BRL))
+            cache.bump_version(cache.fund_scope(self.travel.pk))
+            self.travel.amount
+            self.assertEqual(cache.stats()['misses'], 2)
+
+    def test_process_local_backend(self):
+        self.assertFalse(cache.is_process_local())
+        self.assertEqual(cache.timeout(), 60 * 60 * 24)
+        with override_settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }}, PROPERTY_CACHE_LOCAL_TIMEOUT=2):
+            self.assertTrue(cache.is_process_local())
+            self.assertEqual(cache.timeout(), 2)
+            self.travel.amount
+            with mock.patch('time.time', return_value=time.time() + 3):
+                with self.assertNumQueries(1):
+                    self.travel.amount
+
+
+class CurrencyTest(TestCase):
+
+    def setUp(self):
+        # Rolled back rates don't bump the version of the rate table.
+        self.addCleanup(cache.bump_version, RATES_SCOPE)
+        ExchangeRate.objects.create(source='USD', target='BRL', rate=4)
+        ExchangeRate.objects.create(source='EUR', target='USD', rate='1.25')
+
+    def test_rate(self):
+        self.assertEqual(currency.rate('USD', 'USD'), 1)
+        self.assertEqual(currency.rate('USD', 'BRL'), 4)
+        self.assertEqual(currency.rate('BRL', 'USD'), Decimal('0.25'))
+        self.assertEqual(currency.rate('EUR', 'BRL'), 5)
+        with self.assertRaises(currency.UnknownRate):
+            currency.rate('USD', 'JPY')
+
+    def test_rate_table_cached(self):
+        currency.rates()
+        with self.assertNumQueries(0):
+            self.assertEqual(currency.rate('BRL', 'EUR'), Decimal('0.2'))
+        ExchangeRate.objects.filter(source='USD').get().delete()
+        with self.assertRaises(currency.UnknownRate):
+            currency.rate('BRL', 'EUR')
+
+    def test_rate_table_reloaded(self):
+        # load_rates in another process only reaches this one through the
+        # version in the shared cache, or through the table's age.
+        self.assertEqual(currency.rate('USD', 'BRL'), 4)
+        ExchangeRate.objects.filter(source='USD').update(rate=5)
+        self.assertEqual(currency.rate('USD', 'BRL'), 4)
+        cache.bump_version(RATES_SCOPE)
+        self.assertEqual(currency.rate('USD', 'BRL'), 5)
+
+        with override_settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }}, PROPERTY_CACHE_LOCAL_TIMEOUT=2):
+            self.assertEqual(currency.rate('USD', 'BRL'), 5)
+            ExchangeRate.objects.filter(source='USD').update(rate=6)
+            self.assertEqual(currency.rate('USD', 'BRL'), 5)
+            with mock.patch('time.time', return_value=time.time() + 3):
+                self.assertEqual(currency.rate('USD', 'BRL'), 6)
+
+    def test_convert(self):
+        self.assertEqual(
+            currency.convert_amounts(
+                [10, Decimal('2.50'), 8], ['USD', 'EUR', 'BRL'], 'BRL'
+            ),
+            [Decimal('40.00'), Decimal('12.50'), Decimal('8.00')]
+        )
+        self.assertEqual(
+            currency.convert(Money(10, USD), 'BRL'), Money(40, BRL)
+        )
+        totals = {'USD': Money(10, USD), 'BRL': Money(20, BRL)}
+        self.assertEqual(
+            currency.convert_totals(totals, 'BRL'), Money(60, BRL)
+        )
+        self.assertEqual(currency.convert_totals({}, 'BRL'), Money(0, BRL))
+        self.assertEqual(
+            currency.total_in(totals, 'USD'), Money(15, USD)
+        )
+        self.assertEqual(
+            currency.total_in({'BRL': Money(20, BRL)}, 'USD'),
+            Money(20, BRL)
+        )
+        self.assertEqual(currency.total_in({}, 'USD'), Money(0, USD))
+
+    def test_load_rates(self):
+        fd, path = tempfile.mkstemp(suffix='.csv')
+        self.addCleanup(os.remove, path)
+        with os.fdopen(fd, 'w') as f:
+            f.write('source,target,rate\nusd,brl,3.5\nGBP,USD,1.3\n')
+        out = StringIO()
+        call_command('load_rates', path, stdout=out)
+        self.assertIn('2 exchange rates loaded.', out.getvalue())
+        self.assertEqual(currency.rate('USD', 'BRL'), Decimal('3.5'))
+        self.assertEqual(ExchangeRate.objects.count(), 3)
+
+        with open(path, 'w') as f:
+            f.write('source,target,rate\nUSD,BRL,abc\n')
+        with self.assertRaises(CommandError):
+            call_command('load_rates', path, stdout=out)
+
+
+@override_settings(DEBUG=False)
+class RequestMetricsTest(TestCase):
+
+    def setUp(self):
+        self.url = reverse('category-report')
+        # The session, the user and the totals.
+        self.client.force_login(
+            User.objects.create_user(username='p', password='p')
+        )
+
+    def test_metrics(self):
+        with self.assertLogs('fundcountdown.requests', 'INFO') as logs, \
+                CaptureQueriesContext(connection) as captured:
+            response = self.client.get(self.url)
+        self.assertRegex(
+            response['Server-Timing'],
+            r'^db;dur=[\d.]+;desc="3 queries", view;dur=[\d.]+, '
+            r'total;dur=[\d.]+$'
+        )
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['queries'], 3)
+        self.assertEqual(record['url_name'], 'category-report')
+        self.assertEqual(record['status'], 200)
+        self.assertIn(
+            record['slowest_sql'],
+            [query['sql'][:SQL_LOG_LENGTH] for query in captured]
+        )
+        self.assertFalse(connection.force_debug_cursor)
+
+    def test_budget(self):
+        with override_settings(QUERY_BUDGETS={'category-report': 0}):
+            with self.assertLogs('fundcountdown.requests', 'WARNING'):
+                self.client.get(self.url)
+            with override_settings(QUERY_BUDGET_ACTION='raise'):
+                with self.assertRaises(QueryBudgetExceeded):
+                    self.client.get(self.url)
+        self.assertFalse(connection.force_debug_cursor)
+
+    def test_counted_within_assert_num_queries(self):
+        with self.assertNumQueries(3):
+            self.client.get(self.url)
+
+
+@override_settings(METRICS_ENABLED=True, METRICS_DIR=None)
+class MetricsTest(TestCase):
+
+    def setUp(self):
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+
+    def scrape(self):
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode().splitlines()
+
+    def test_disabled(self):
+        with override_settings(METRICS_ENABLED=False):
+            response = self.client.get(reverse('metrics'))
+            self.assertEqual(response.status_code, 404)
+            metrics.inc('fundcountdown_imported_inputs_total')
+        self.assertEqual(metrics.collect().get(
+            ('fundcountdown_imported_inputs_total', ())
+        ), None)
+
+    def test_requests_and_computations(self):
+        self.client.force_login(
+            User.objects.create_user(username='p', password='p')
+        )
+        self.client.get(reverse('category-report'))
+        Fund.objects.create(name="Travel", description="").full_cost
+        lines = self.scrape()
+        self.assertIn(
+            '# TYPE fundcountdown_request_duration_seconds histogram', lines
+        )
+        self.assertIn(
+            'fundcountdown_request_duration_seconds_count'
+            '{method="GET",url_name="category-report"} 1', lines
+        )
+        self.assertIn(
+            'fundcountdown_request_queries_bucket'
+            '{method="GET",url_name="category-report",le="5"} 1', lines
+        )
+        self.assertIn(
+            'fundcountdown_db_queries_total'
+            '{method="GET",url_name="category-report"} 3', lines
+        )
+        self.assertIn(
+            'fundcountdown_computation_seconds_count'
+            '{name="Fund.full_cost"} 1', lines
+        )
+        self.assertTrue(any(
+            line.startswith('fundcountdown_property_cache_total'
+                            '{result="misses"}')
+            for line in lines
+        ))
+
+    def test_threads(self):
+        def work():
+            for _ in range(1000):
+                metrics.inc('fundcountdown_imported_inputs_total')
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(metrics.collect()[
+            ('fundcountdown_imported_inputs_total', ())
+        ], 8000)
+
+    def test_processes(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        # Snapshot left by another worker.
+        with open(os.path.join(directory, 'metrics-1.json'), 'w') as f:
+            json.dump([
+                ['fundcountdown_imported_inputs_total', [], 5],
+                ['fundcountdown_computation_seconds',
+                 [['name', 'import_inputs']], [1] + [0] * 11 + [0.004]],
+            ], f)
+        with override_settings(METRICS_DIR=directory):
+            metrics.inc('fundcountdown_imported_inputs_total', 2)
+            metrics.observe(
+                'fundcountdown_computation_seconds', 0.02,
+                name='import_inputs'
+            )
+            lines = self.scrape()
+        self.assertIn('fundcountdown_imported_inputs_total 7', lines)
+        self.assertIn(
+            'fundcountdown_computation_seconds_bucket'
+            '{name="import_inputs",le="0.025"} 2', lines
+        )
+        self.assertIn(
+            'fundcountdown_computation_seconds_count'
+            '{name="import_inputs"} 2', lines
+        )
+        self.assertTrue(os.path.exists(os.path.join(
+            directory, 'metrics-{}.json'.format(os.getpid())
+        )))
+
+    def test_dead_processes(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+
+        def exited(pid, count):
+            with open(os.path.join(
+                    directory, 'metrics-{}.json'.format(pid)), 'w') as f:
+                json.dump(
+                    [['fundcountdown_imported_inputs_total', [], count]], f
+                )
+
+        def total():
+            return metrics.collect()[
+                ('fundcountdown_imported_inputs_total', ())
+            ]
+
+        with override_settings(METRICS_DIR=directory):
+            metrics.inc('fundcountdown_imported_inputs_total', 2)
+            exited(1, 5)
+            exited(2, 3)
+            self.assertEqual(total(), 10)
+            metrics.mark_process_dead(1)
+            metrics.mark_process_dead(2, directory)
+            metrics.mark_process_dead(3)
+            self.assertEqual(total(), 10)
+            self.assertEqual(sorted(
+                name for name in os.listdir(directory)
+                if name.endswith('.json')
+            ), ['metrics-{}.json'.format(os.getpid()), 'metrics-dead.json'])
+
+            # A new process given pid 1 doesn't take over the old counts.
+            exited(1, 1)
+            self.assertEqual(total(), 11)
+
+        # Nor does this one, flushing to a directory with a snapshot left
+        # under its pid.
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        exited(os.getpid(), 4)
+        with override_settings(METRICS_DIR=directory):
+            self.assertEqual(total(), 6)
+
+
+    def test_unwritable_directory(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        missing = os.path.join(directory, 'metrics')
+        with override_settings(METRICS_DIR=missing):
+            metrics.inc('fundcountdown_imported_inputs_total', 2)
+            self.assertIn('fundcountdown_imported_inputs_total 2',
+                          self.scrape())
+        self.assertTrue(os.path.exists(os.path.join(
+            missing, 'metrics-{}.json'.format(os.getpid())
+        )))
+
+        # A file in the way: logged, and the requests still go through.
+        blocked = os.path.join(directory, 'blocked')
+        open(blocked, 'w').close()
+        with override_settings(METRICS_DIR=blocked), \
+                self.assertLogs('fundcountdown.metrics', 'ERROR'):
+            self.client.get(reverse('category-report'))
+            metrics.inc('fundcountdown_imported_inputs_total')
+            self.assertIn('fundcountdown_imported_inputs_total 3',
+                          self.scrape())
+
+
+class ProfilingTest(TestCase):
+
+    def setUp(self):
+        caches['default'].clear()
+        partner = User.objects.create(username='p1', password='p')
+        self.travel = Fund.objects.create(name="Travel", description="")
+        self.travel.partners.add(partner)
+        Expense.objects.create(
+            name="Hotel", description="", value=Money(300, USD),
+            fund=self.travel, partner=partner
+        )
+
+    def test_tracing(self):
+        with profiling.tracing('test') as trace:
+            self.travel.full_cost
+            self.travel.full_cost
+        self.assertIsNone(profiling.current())
+        self.assertFalse(connection.force_debug_cursor)
+
+        calls, _, _, queries, _ = trace.nodes[('test', 'Fund.full_cost')]
+        self.assertEqual((calls, queries), (2, 1))
+        self.assertIn(
+            ('test', 'Fund.full_cost', 'Money.total'),
+            trace.nodes
+        )
+        self.assertIn(
+            'test;Fund.full_cost;Fund.costs 1', trace.collapsed('queries')
+        )
+        for line in trace.collapsed():
+            stack, value = line.rsplit(' ', 1)
+            self.assertTrue(stack.startswith('test'))
+            self.assertGreater(int(value), 0)
+
+    def test_not_tracing(self):
+        self.assertIsNone(profiling.current())
+        self.assertEqual(self.travel.full_cost, Money(300, USD))
+
+    def test_unique_names(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        with profiling.tracing('test') as trace:
+            self.travel.full_cost
+        with mock.patch('time.strftime', return_value='20160101000000'):
+            paths = {trace.write(directory) for _ in range(2)}
+        self.assertEqual(len(paths), 2)
+        self.assertEqual(len(os.listdir(directory)), 4)
+
+    def test_header(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        user = User.objects.create_user(username='staff', password='p')
+        self.travel.partners.add(user)
+        self.client.force_login(user)
+        url = reverse('dashboard')
+
+        with override_settings(PROFILE_DIR=directory):
+            response = self.client.get(url, HTTP_X_PROFILE_PROPERTIES='1')
+            self.assertFalse(response.has_header('X-Profile'))
+
+            User.objects.filter(pk=user.pk).update(is_staff=True)
+            response = self.client.get(url, HTTP_X_PROFILE_PROPERTIES='1')
+        name = response['X-Profile']
+        self.assertEqual(os.path.basename(name), name)
+        path = os.path.join(directory, name)
+        with open(path) as f:
+            stacks = [line.rsplit(' ', 1)[0] for line in f]
+        self.assertIn('GET /api/dashboard/;Expense.winner', stacks)
+        self.assertTrue(os.path.exists(
+            path.replace('.time.folded', '.queries.folded')
+        ))
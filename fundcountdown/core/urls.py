@@ -1,7 +1,9 @@
 from django.conf.urls import url
 from django.views.generic import TemplateView
+from fundcountdown.core import views
 
 
 urlpatterns = [
     url(r'^$', TemplateView.as_view(template_name='app.html'), name='app'),
+    url(r'^metrics$', views.metrics_view, name='metrics'),
 ]
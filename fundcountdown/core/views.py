@@ -1,6 +1,19 @@
+from django.conf import settings
 from django.shortcuts import render
-from django.http import HttpResponse
+from django.http import Http404, HttpResponse
+from django.views.decorators.http import require_GET
+from fundcountdown.core import metrics
 
 
 def home(request):
     return HttpResponse('It works')
+
+
+@require_GET
+def metrics_view(request):
+    """ Prometheus scrape endpoint, only served with METRICS_ENABLED. """
+    if not getattr(settings, 'METRICS_ENABLED', False):
+        raise Http404
+    return HttpResponse(
+        metrics.render(), content_type='text/plain; version=0.0.4'
+    )
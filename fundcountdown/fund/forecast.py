@@ -0,0 +1,224 @@
+""" Cash flow forecast: projected inflows and outflows of each fund, month
+by month, over the next ``months`` months.
+
+Two bulk queries feed funds x months NumPy matrices:
+
+- inflows: the monthly input totals of the ledger (MonthlyTotal); each
+  fund is projected to keep saving its mean monthly input of the last
+  ``history`` complete months (counted from its first input when newer);
+- outflows: the expense installments (see fundcountdown.cash_flow.schedule)
+  laid out by the month they are due, priced by the winning quotation.
+
+The ledger never records payments, so the opening position is the
+balance at the start of the current month less the installments due
+before it. The cumulative position adds the monthly net to it; the first
+month it goes negative is the first shortfall of the fund. Amounts are
+converted to the currency of the fund; a missing exchange rate yields NaN
+for the whole fund.
+"""
+import csv
+import json
+import math
+from collections import namedtuple
+from datetime import date
+import numpy as np
+from django.db import models
+from django.utils import timezone
+from fundcountdown.fund.projection import conversion_factors
+
+DEFAULT_MONTHS = 24
+DEFAULT_HISTORY = 6
+
+CSV_HEADER = [
+    'fund', 'currency', 'month', 'inflow', 'outflow', 'net', 'cumulative'
+]
+
+Forecast = namedtuple('Forecast', [
+    'fund_ids', 'currencies', 'months', 'opening', 'inflows', 'outflows',
+    'net', 'cumulative', 'first_shortfall',
+])
+
+
+def month_number(day):
+    """ Months since year 0, so month spans are plain differences. """
+    return day.year * 12 + day.month - 1
+
+
+def month_date(number):
+    return date(number // 12, number % 12 + 1, 1)
+
+
+def spread(shape, rows, starts, counts, values):
+    """ Adds ``values[i]`` to ``counts[i]`` consecutive months of row
+    ``rows[i]`` from month ``starts[i]``, clipped to the matrix.
+
+    Uses a difference array: +value where a run starts, -value where it
+    ends, then a cumulative sum along the months.
+    """
+    funds, months = shape
+    diff = np.zeros((funds, months + 1))
+    ends = np.clip(starts + counts, 0, months)
+    starts = np.clip(starts, 0, months)
+    np.add.at(diff, (rows, starts), values)
+    np.add.at(diff, (rows, ends), -values)
+    return np.cumsum(diff, axis=1)[:, :months]
+
+
+def forecast(funds, months=DEFAULT_MONTHS, history=DEFAULT_HISTORY,
+             as_of=None):
+    """ Forecasts the funds of a queryset, returning a Forecast of
+    funds x months matrices (rows ordered as ``fund_ids``).
+
+    Takes a fixed number of queries however many funds there are.
+    """
+    from fundcountdown.cash_flow.models import Expense, MonthlyTotal
+
+    if as_of is None:
+        as_of = timezone.localtime(timezone.now()).date()
+    start = month_number(as_of)
+    info = list(funds.order_by('pk').values_list('pk', 'currency'))
+    fund_ids = [pk for pk, _ in info]
+    currencies = [currency for _, currency in info]
+    index = {pk: i for i, pk in enumerate(fund_ids)}
+    shape = (len(info), months)
+
+    totals = list(MonthlyTotal.objects.using(funds.db).filter(
+        account__fund__in=funds.values('pk')
+    ).values_list('account__fund', 'currency', 'month').annotate(
+        total=models.Sum('amount')
+    ).order_by())
+    expenses = list(Expense.objects.using(funds.db).filter(
+        fund__in=funds.values('pk')
+    ).values_list(
+        'fund', 'resolved_value', 'resolved_value_currency', 'due_date',
+        'occurrence', 'winning_quotation__due_date',
+        'winning_quotation__occurrence',
+    ))
+    factors = conversion_factors(
+        [(c, currencies[index[f]]) for f, c, _, _ in totals] +
+        [(c, currencies[index[f]]) for f, _, c, _, _, _, _ in expenses]
+    )
+
+    # Ledger: balance before the current month and the history window.
+    opening = np.zeros(len(info))
+    saved = np.zeros((len(info), history))
+    first = np.full(len(info), history)
+    if totals:
+        rows = np.array([index[f] for f, _, _, _ in totals])
+        offsets = np.array([
+            month_number(month) - start for _, _, month, _ in totals
+        ])
+        amounts = np.array([
+            float(total) * factors[(c, currencies[index[f]])]
+            for f, c, _, total in totals
+        ])
+        past = offsets < 0
+        np.add.at(opening, rows[past], amounts[past])
+        recent = past & (offsets >= -history)
+        np.add.at(saved, (rows[recent], offsets[recent] + history),
+                  amounts[recent])
+        np.minimum.at(first, rows[recent], offsets[recent] + history)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rates = np.where(
+            first < history, saved.sum(axis=1) / (history - first), 0
+        )
+    inflows = np.repeat(rates[:, None], months, axis=1)
+
+    # Schedule: installments before the current month reduce the opening.
+    outflows = np.zeros(shape)
+    if expenses:
+        rows, starts, counts, values = [], [], [], []
+        for (fund_id, value, currency, due_date, occurrence,
+                winner_due_date, winner_occurrence) in expenses:
+            if winner_due_date is not None:
+                due_date, occurrence = winner_due_date, winner_occurrence
+            if timezone.is_aware(due_date):
+                due_date = timezone.localtime(due_date)
+            rows.append(index[fund_id])
+            starts.append(month_number(due_date) - start)
+            counts.append(max(occurrence, 1))
+            values.append(
+                float(value or 0) *
+                factors[(currency, currencies[index[fund_id]])]
+            )
+        rows, starts = np.array(rows), np.array(starts)
+        counts, values = np.array(counts), np.array(values)
+        outflows = spread(shape, rows, starts, counts, values)
+        overdue = np.clip(-starts, 0, counts)
+        np.add.at(opening, rows, -overdue * values)
+
+    # A missing exchange rate spoils the whole fund, not just some months.
+    missing = (np.isnan(opening) | np.isnan(inflows).any(axis=1) |
+               np.isnan(outflows).any(axis=1))
+    for matrix in (opening, inflows, outflows):
+        matrix[missing] = np.nan
+
+    net = inflows - outflows
+    cumulative = opening[:, None] + np.cumsum(net, axis=1)
+    shortfall = cumulative < 0
+    first_shortfall = np.where(
+        shortfall.any(axis=1), np.argmax(shortfall, axis=1), -1
+    )
+    return Forecast(
+        fund_ids=fund_ids,
+        currencies=currencies,
+        months=[month_date(start + i) for i in range(months)],
+        opening=opening,
+        inflows=inflows,
+        outflows=outflows,
+        net=net,
+        cumulative=cumulative,
+        first_shortfall={
+            pk: month_date(start + int(first_shortfall[i]))
+            if first_shortfall[i] >= 0 else None
+            for i, pk in enumerate(fund_ids)
+        },
+    )
+
+
+def rounded(value):
+    """ Cents of a matrix cell, None for NaN (a missing exchange rate). """
+    return None if math.isnan(value) else round(float(value), 2)
+
+
+def write_csv(result, stream):
+    """ Writes one row per fund and month. """
+    writer = csv.writer(stream)
+    writer.writerow(CSV_HEADER)
+    for i, fund_id in enumerate(result.fund_ids):
+        for j, month in enumerate(result.months):
+            values = [
+                rounded(matrix[i, j])
+                for matrix in (result.inflows, result.outflows, result.net,
+                               result.cumulative)
+            ]
+            writer.writerow([
+                fund_id, result.currencies[i], month.isoformat()
+            ] + ['' if v is None else '{:.2f}'.format(v) for v in values])
+
+
+def as_json(result):
+    """ Returns a JSON serializable dict with one entry per fund. """
+    return {
+        'months': [month.isoformat() for month in result.months],
+        'funds': [
+            {
+                'id': fund_id,
+                'currency': result.currencies[i],
+                'opening': rounded(result.opening[i]),
+                'inflows': [rounded(v) for v in result.inflows[i]],
+                'outflows': [rounded(v) for v in result.outflows[i]],
+                'net': [rounded(v) for v in result.net[i]],
+                'cumulative': [rounded(v) for v in result.cumulative[i]],
+                'first_shortfall': (
+                    result.first_shortfall[fund_id].isoformat()
+                    if result.first_shortfall[fund_id] else None
+                ),
+            }
+            for i, fund_id in enumerate(result.fund_ids)
+        ],
+    }
+
+
+def write_json(result, stream):
+    json.dump(as_json(result), stream, indent=2)
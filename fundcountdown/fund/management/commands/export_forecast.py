@@ -0,0 +1,39 @@
+import io
+from django.core.management.base import BaseCommand
+from fundcountdown.fund import forecast
+from fundcountdown.fund.models import Fund
+
+WRITERS = {
+    'csv': forecast.write_csv,
+    'json': forecast.write_json,
+}
+
+
+class Command(BaseCommand):
+    help = 'Exports the monthly cash flow forecast of every fund.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--format', choices=sorted(WRITERS), default='csv'
+        )
+        parser.add_argument(
+            '--months', type=int, default=forecast.DEFAULT_MONTHS
+        )
+        parser.add_argument(
+            '--history', type=int, default=forecast.DEFAULT_HISTORY,
+            help='Complete months of inputs the inflows are averaged over.'
+        )
+        parser.add_argument(
+            '--output', help='File to write, the standard output by default.'
+        )
+
+    def handle(self, *args, **options):
+        result = Fund.objects.forecast(options['months'], options['history'])
+        write = WRITERS[options['format']]
+        if options['output'] is None:
+            output = io.StringIO()
+            write(result, output)
+            self.stdout.write(output.getvalue(), ending='')
+            return
+        with io.open(options['output'], 'w', newline='') as f:
+            write(result, f)
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from fundcountdown.fund.models import FundSummary
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the dirty or missing fund summaries.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Recompute every summary, not only the dirty ones.'
+        )
+
+    def handle(self, *args, **options):
+        if options['all']:
+            FundSummary.objects.update(is_dirty=True)
+        refreshed = FundSummary.objects.refresh()
+        self.stdout.write('{} fund summaries refreshed.'.format(refreshed))
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.6 on 2026-10-18 16:43
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fund', '0003_fundsummary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fund',
+            name='currency',
+            field=models.CharField(default='USD', max_length=3),
+        ),
+    ]
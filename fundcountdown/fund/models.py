@@ -1,7 +1,192 @@
-import operator
-from functools import reduce
-from django.db import models
+from collections import namedtuple
+from django.db import models, transaction
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.contrib.auth.models import User
+from django.utils import timezone
+from djmoney.models.fields import MoneyField
+from moneyed import Money
+from fundcountdown.core.cache import fund_scope, versioned_cache
+from fundcountdown.core.currency import UnknownRate, convert, convert_totals
+from fundcountdown.core.currency import total_in
+from fundcountdown.core.metrics import timed
+from fundcountdown.core.models import ExchangeRate
+from fundcountdown.core.money import money_totals, to_decimal
+from fundcountdown.core.profiling import traced
+
+# Committed cost of one partner in a fund, see FundQuerySet.partner_shares.
+PartnerShare = namedtuple(
+    'PartnerShare', 'partner_id username totals amount share'
+)
+
+
+class FundQuerySet(models.QuerySet):
+
+    def lock(self):
+        """ Row-locks the funds until the end of the transaction, see
+        ExpenseQuerySet.lock.
+        """
+        return self.update(currency=models.F('currency'))
+
+    def full_costs(self):
+        """ Returns ``{fund_id: {currency: Money}}`` with the resolved cost of
+        the expenses of the funds in this queryset, in a single query.
+        """
+        from fundcountdown.cash_flow.models import Expense
+
+        costs = Expense.objects.using(self.db).filter(
+            fund__in=self.values('pk')
+        ).values_list('fund', 'resolved_amount_currency').annotate(
+            total=models.Sum('resolved_amount')
+        ).order_by()
+        rows = {}
+        for fund_id, currency, total in costs:
+            rows.setdefault(fund_id, []).append((currency, total))
+        return {
+            fund_id: money_totals(totals) for fund_id, totals in rows.items()
+        }
+
+    def with_costs(self):
+        """ Prefetches the expenses of the funds with their quotations, so
+        full_cost and the expense properties (winner included) are computed
+        in memory: three queries for any number of funds.
+        """
+        from fundcountdown.cash_flow.models import Expense
+
+        return self.prefetch_related(
+            models.Prefetch(
+                'expenses', queryset=Expense.objects.order_by('due_date', 'pk')
+            ),
+            'expenses__quotations',
+        )
+
+    def projections(self, as_of=None, window=None):
+        """ Projects when each fund reaches its full cost, see
+        fundcountdown.fund.projection. Returns ``{fund_id: Projection}``.
+        """
+        from fundcountdown.fund import projection
+
+        return projection.project(
+            self, as_of, window or projection.DEFAULT_WINDOW
+        )
+
+    def forecast(self, months=None, history=None, as_of=None):
+        """ Forecasts the monthly inflows and outflows of the funds, see
+        fundcountdown.fund.forecast. Returns a Forecast.
+        """
+        from fundcountdown.fund import forecast
+
+        return forecast.forecast(
+            self,
+            months or forecast.DEFAULT_MONTHS,
+            history or forecast.DEFAULT_HISTORY,
+            as_of,
+        )
+
+    def next_installments(self, since=None):
+        """ Returns ``{fund_id: Installment}`` with the first installment
+        due from ``since`` (now by default) of each fund, in a single query.
+        """
+        from fundcountdown.cash_flow.models import Expense
+        from fundcountdown.cash_flow.schedule import installments
+
+        if since is None:
+            since = timezone.now()
+        expenses = Expense.objects.using(self.db).filter(
+            fund__in=self.values('pk')
+        ).select_related('winning_quotation')
+        upcoming = {}
+        for expense in expenses.iterator():
+            installment = next(installments(expense, since), None)
+            if installment is None:
+                continue
+            current = upcoming.get(expense.fund_id)
+            if current is None or installment < current:
+                upcoming[expense.fund_id] = installment
+        return upcoming
+
+    def partner_shares(self):
+        """ Returns ``{fund_id: [PartnerShare]}`` with what each partner
+        committed to the funds of this queryset, in a single query.
+
+        A partner is responsible for the resolved amount of the expenses
+        whose winning quotation (or, without quotations, the expense
+        itself) they entered. ``totals`` maps currencies to Money,
+        ``amount`` is their sum in the currency of the fund and ``share``
+        its percentage of the fund total; both are None when an exchange
+        rate is missing. Partners are sorted by amount, largest first.
+        """
+        from fundcountdown.cash_flow.models import Expense
+
+        rows = Expense.objects.using(self.db).filter(
+            fund__in=self.values('pk')
+        ).annotate(
+            responsible=Coalesce('winning_quotation__partner', 'partner'),
+            responsible_name=Coalesce(
+                'winning_quotation__partner__username', 'partner__username'
+            ),
+        ).values_list(
+            'fund', 'fund__currency', 'responsible', 'responsible_name',
+            'resolved_amount_currency',
+        ).annotate(total=models.Sum('resolved_amount')).order_by()
+
+        partners = {}
+        currencies = {}
+        for fund_id, fund_currency, partner_id, name, currency, total in rows:
+            currencies[fund_id] = fund_currency
+            partners.setdefault(fund_id, {}).setdefault(
+                (partner_id, name), []
+            ).append((currency, total))
+
+        shares = {}
+        for fund_id, committed in partners.items():
+            totals = {
+                key: money_totals(items) for key, items in committed.items()
+            }
+            try:
+                amounts = {
+                    key: convert_totals(money, currencies[fund_id])
+                    for key, money in totals.items()
+                }
+            except UnknownRate:
+                amounts = dict.fromkeys(totals)
+            fund_total = sum(
+                money.amount for money in amounts.values()
+                if money is not None
+            )
+            shares[fund_id] = sorted([
+                PartnerShare(
+                    partner_id=partner_id,
+                    username=name,
+                    totals=totals[(partner_id, name)],
+                    amount=amount,
+                    share=to_decimal(amount.amount * 100 / fund_total)
+                    if amount is not None and fund_total else None,
+                )
+                for (partner_id, name), amount in amounts.items()
+            ], key=lambda s: (-(s.amount.amount if s.amount else 0),
+                              s.username))
+        return shares
+
+    def balances(self):
+        """ Returns ``{fund_id: {currency: Money}}`` with the cash input
+        totals of the funds in this queryset, aggregated in a single query
+        over the account balance ledger.
+        """
+        from fundcountdown.cash_flow.models import AccountBalance
+
+        balances = AccountBalance.objects.using(self.db).filter(
+            account__fund__in=self.values('pk')
+        ).values_list('account__fund', 'currency').annotate(
+            total=models.Sum('amount')
+        ).order_by()
+        rows = {}
+        for fund_id, currency, total in balances:
+            rows.setdefault(fund_id, []).append((currency, total))
+        return {
+            fund_id: money_totals(totals) for fund_id, totals in rows.items()
+        }
 
 
 class Fund(models.Model):
@@ -9,18 +194,230 @@ class Fund(models.Model):
     description = models.TextField()
     expected_date = models.DateField(blank=True, null=True)
     partners = models.ManyToManyField(User, related_name='funds')
+    # Totals in mixed currencies are converted to this one.
+    currency = models.CharField(max_length=3, default='USD')
+
+    objects = FundQuerySet.as_manager()
 
     @property
+    @traced()
+    @timed('Fund.full_cost')
     def full_cost(self):
-        expenses = self.expenses.all()
-        amount = reduce(operator.add, [e.amount for e in expenses])
-        return amount
+        """ Resolved cost, see total_in; None when it needs a missing
+        exchange rate.
+        """
+        expenses = getattr(self, '_prefetched_objects_cache', {}).get(
+            'expenses'
+        )
+        if expenses is not None:
+            costs = money_totals(
+                (e.amount.currency.code, e.amount.amount) for e in expenses
+            )
+        else:
+            costs = self.costs
+        try:
+            return total_in(costs, self.currency)
+        except UnknownRate:
+            return None
+
+    @property
+    @traced()
+    @versioned_cache(lambda fund: fund_scope(fund.pk))
+    def costs(self):
+        """ Resolved expense totals of the fund as ``{currency: Money}``. """
+        return Fund.objects.filter(pk=self.pk).full_costs().get(self.pk, {})
 
     @property
+    @traced()
+    @versioned_cache(lambda fund: fund_scope(fund.pk))
+    def balance(self):
+        """ Cash input totals of the fund as ``{currency: Money}``. """
+        return Fund.objects.filter(pk=self.pk).balances().get(self.pk, {})
+
+    @property
+    @traced()
+    @timed('Fund.amount')
     def amount(self):
-        inputs = self.accounts.all()
-        amount = reduce(operator.add, [i.balance for i in inputs])
-        return amount
+        """ Amount saved, see full_cost. """
+        try:
+            return total_in(self.balance, self.currency)
+        except UnknownRate:
+            return None
+
+    @property
+    @traced()
+    @versioned_cache(lambda fund: fund_scope(fund.pk))
+    def checkpoints(self):
+        """ Balance of the fund at the end of each month with inputs, as
+        sorted ``{currency: (months, balances)}`` arrays.
+        """
+        from fundcountdown.cash_flow.models import MonthlyTotal, checkpoints
+
+        return checkpoints(MonthlyTotal.objects.filter(
+            account__fund=self
+        ).values_list('currency', 'month').annotate(
+            total=models.Sum('amount')
+        ).order_by())
+
+    @traced()
+    def amount_at(self, day):
+        """ Amount saved by the end of ``day``, see Account.balance_at. """
+        from fundcountdown.cash_flow.models import CashInput
+        from fundcountdown.cash_flow.models import balances_before
+        from fundcountdown.cash_flow.models import merge_deltas, month_to_day
+
+        month, start, end = month_to_day(day)
+        totals = merge_deltas(
+            balances_before(self.checkpoints, month),
+            CashInput.objects.filter(
+                account__fund=self, entry_date__gte=start, entry_date__lt=end
+            ).currency_totals()
+        )
+        try:
+            return total_in(money_totals(totals.items()), self.currency)
+        except UnknownRate:
+            return None
 
     def __str__(self):
         return self.name
+
+
+class FundSummaryQuerySet(models.QuerySet):
+
+    def mark_dirty(self, funds):
+        """ Flags the summaries of ``funds`` (ids or a queryset) for refresh.
+        """
+        return self.filter(fund__in=funds).update(is_dirty=True)
+
+    def refresh(self, funds=None):
+        """ Recomputes the summaries that are dirty or missing.
+
+        Only the stale funds are read, with a fixed number of queries
+        however many there are. Returns the number of refreshed funds.
+
+        Up to date summaries are found without writing. Otherwise the
+        stale funds are locked before anything is read, so concurrent
+        refreshes wait for each other and the later ones find nothing
+        left to do.
+        """
+        stale = Fund.objects.using(self.db).filter(
+            models.Q(summary__isnull=True) |
+            models.Q(summary__is_dirty=True)
+        )
+        if funds is not None:
+            stale = stale.filter(pk__in=funds)
+        if not stale.exists():
+            return 0
+        with transaction.atomic(using=self.db):
+            stale.lock()
+            currencies = dict(stale.values_list('pk', 'currency'))
+            fund_ids = list(currencies)
+            if not fund_ids:
+                return 0
+            stale = Fund.objects.using(self.db).filter(pk__in=fund_ids)
+            costs = stale.full_costs()
+            balances = stale.balances()
+            self.filter(fund__in=fund_ids).delete()
+            self.bulk_create([
+                FundSummary.build(
+                    fund_id, costs.get(fund_id, {}), balances.get(fund_id, {}),
+                    currencies[fund_id]
+                )
+                for fund_id in fund_ids
+            ])
+        return len(fund_ids)
+
+    def current(self, funds=None):
+        """ Refreshes what is stale and returns the up to date summaries. """
+        self.refresh(funds)
+        summaries = self.select_related('fund')
+        if funds is not None:
+            summaries = summaries.filter(fund__in=funds)
+        return summaries
+
+
+class FundSummary(models.Model):
+    """ Class FundSummary
+
+    Snapshot of the figures shown on the dashboard for a fund.
+    Writes to expenses, quotations, accounts and inputs mark it dirty and
+    it is recomputed on the next refresh.
+    Mixed currencies are converted to the currency of the fund; figures
+    that need a missing exchange rate are left empty.
+    """
+    fund = models.OneToOneField(
+        Fund,
+        primary_key=True,
+        related_name='summary'
+    )
+    full_cost = MoneyField(
+        max_digits=14,
+        decimal_places=2,
+        default_currency='USD',
+        null=True
+    )
+    amount = MoneyField(
+        max_digits=14,
+        decimal_places=2,
+        default_currency='BRL',
+        null=True
+    )
+    remaining = MoneyField(
+        max_digits=14,
+        decimal_places=2,
+        default_currency='USD',
+        null=True
+    )
+    progress = models.DecimalField(
+        max_digits=7,
+        decimal_places=2,
+        null=True
+    )
+    is_dirty = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = FundSummaryQuerySet.as_manager()
+
+    @classmethod
+    def build(cls, fund_id, costs, balances, currency):
+        """ Summarizes the ``{currency: Money}`` maps of one fund, whose
+        currency is ``currency``.
+        """
+        summary = cls(fund_id=fund_id)
+        try:
+            summary.full_cost = full_cost = total_in(costs, currency)
+        except UnknownRate:
+            full_cost = None
+        try:
+            summary.amount = amount = total_in(balances, currency)
+        except UnknownRate:
+            amount = None
+        if full_cost is None or amount is None:
+            return summary
+        # An empty side counts as zero in the currency of the other one,
+        # otherwise figures in different currencies meet in the fund's.
+        if not balances:
+            amount = Money(0, full_cost.currency)
+        elif not costs:
+            full_cost = Money(0, amount.currency)
+        elif amount.currency != full_cost.currency:
+            try:
+                full_cost = convert(full_cost, currency)
+                amount = convert(amount, currency)
+            except UnknownRate:
+                return summary
+        summary.remaining = full_cost - amount
+        if full_cost.amount:
+            summary.progress = to_decimal(
+                amount.amount * 100 / full_cost.amount
+            )
+        return summary
+
+    def __str__(self):
+        return "{} summary".format(self.fund)
+
+
+@receiver(post_save, sender=ExchangeRate)
+@receiver(post_delete, sender=ExchangeRate)
+def mark_converted_summaries_dirty(sender, instance, **kwargs):
+    FundSummary.objects.filter(is_dirty=False).update(is_dirty=True)
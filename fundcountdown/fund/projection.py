@@ -0,0 +1,202 @@
+""" Countdown projection: when each fund reaches its full cost.
+
+The inputs are summed per fund and day in SQL and laid out end to end in
+one array, each fund over its own days from its first input to the day
+of the projection, so an old input of one fund doesn't widen the others.
+Every fund is then fitted at once with NumPy:
+
+- linear: least squares slope of the cumulative savings since the first
+  input of the fund;
+- average: mean daily saving over the last ``window`` days.
+
+Each saving rate projects the date the remaining cost is reached, shown
+against Fund.expected_date with the saving required to make it in time.
+Amounts are converted to the currency of the fund; a fund with a missing
+exchange rate gets an empty projection.
+"""
+import math
+from collections import namedtuple
+from datetime import datetime, time, timedelta
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+from moneyed import Money
+from fundcountdown.core.currency import UnknownRate, rate
+from fundcountdown.core.money import to_decimal
+
+DEFAULT_WINDOW = 30
+DAYS_PER_MONTH = 365.25 / 12
+
+Projection = namedtuple('Projection', [
+    'fund_id', 'currency', 'full_cost', 'saved', 'remaining',
+    'linear_rate', 'average_rate', 'linear_date', 'average_date',
+    'expected_date', 'required_daily', 'required_monthly',
+])
+
+
+def conversion_factors(pairs):
+    """ Returns ``{(source, target): float}``, NaN for unknown rates. """
+    factors = {}
+    for source, target in set(pairs):
+        try:
+            factors[(source, target)] = float(rate(source, target))
+        except UnknownRate:
+            factors[(source, target)] = float('nan')
+    return factors
+
+
+def fit_rates(daily, history, window):
+    """ Fits the daily saving rates of funds laid end to end.
+
+    ``daily`` holds the savings of every fund in turn, ``history[i]`` days
+    for fund ``i`` (none for a fund without inputs). Returns the
+    ``(saved, linear, average)`` vectors, one value per fund.
+    """
+    funds = len(history)
+    if not len(daily):
+        return np.zeros(funds), np.zeros(funds), np.zeros(funds)
+    history = np.asarray(history, dtype=int)
+    offsets = np.concatenate([[0], np.cumsum(history)[:-1]]).astype(int)
+    segment = np.repeat(np.arange(funds), history)
+    running = np.cumsum(daily)
+    before = np.concatenate([[0], running])[offsets]
+    cumulative = running - before[segment]
+    has_inputs = history > 0
+
+    def per_fund(values):
+        return np.bincount(segment, values, minlength=funds)
+
+    saved = per_fund(daily)
+    x = np.arange(len(daily), dtype=float) - offsets[segment]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x_mean = per_fund(x) / history
+        y_mean = per_fund(cumulative) / history
+        dx = x - x_mean[segment]
+        covariance = per_fund(dx * (cumulative - y_mean[segment]))
+        variance = per_fund(dx ** 2)
+        # A single day of history has no slope: its saving is the rate.
+        linear = np.where(variance > 0, covariance / variance, saved)
+
+        # Saved before the window: the running total of its eve, if any.
+        span = np.minimum(window, history)
+        eve = offsets + history - span - 1
+        start = np.where(history > span, cumulative[np.maximum(eve, 0)], 0)
+        average = (saved - start) / span
+    linear = np.where(has_inputs, linear, 0)
+    average = np.where(has_inputs, average, 0)
+    return saved, linear, average
+
+
+def days_to_goal(remaining, rates):
+    """ Days until ``remaining`` is saved at ``rates``, NaN for never. """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        days = np.where(
+            remaining <= 0, 0, np.ceil(remaining / np.where(
+                rates > 0, rates, np.nan
+            ))
+        )
+    return np.where(np.isnan(remaining), np.nan, days)
+
+
+def project(funds, as_of=None, window=DEFAULT_WINDOW):
+    """ Projects the funds of a queryset, returning ``{fund_id: Projection}``.
+
+    Takes a fixed number of queries however many funds there are.
+    """
+    from fundcountdown.cash_flow.models import CashInput
+
+    if as_of is None:
+        as_of = timezone.localtime(timezone.now()).date()
+    info = list(funds.order_by('pk').values_list(
+        'pk', 'currency', 'expected_date'
+    ))
+    if not info:
+        return {}
+    index = {pk: i for i, (pk, _, _) in enumerate(info)}
+    currencies = [currency for _, currency, _ in info]
+
+    until = datetime.combine(as_of + timedelta(days=1), time())
+    if settings.USE_TZ:
+        until = timezone.make_aware(until)
+    rows = CashInput.objects.using(funds.db).filter(
+        account__fund__in=funds.values('pk'), entry_date__lt=until
+    ).daily_totals()
+    costs = [
+        (fund_id, money.currency.code, money.amount)
+        for fund_id, totals in funds.full_costs().items()
+        for money in totals.values()
+    ]
+    factors = conversion_factors(
+        [(c, currencies[index[f]]) for f, c, _ in costs] +
+        [(c, currencies[index[f]]) for f, _, c, _ in rows]
+    )
+
+    cost = np.zeros(len(info))
+    if costs:
+        fund_index = np.array([index[f] for f, _, _ in costs])
+        np.add.at(cost, fund_index, np.array([
+            float(amount) * factors[(c, currencies[index[f]])]
+            for f, c, amount in costs
+        ]))
+
+    # Each fund from its own first input on.
+    first_days = {}
+    for fund_id, day, _, _ in rows:
+        first_days[fund_id] = min(day, first_days.get(fund_id, day))
+    history = np.array([
+        (as_of - first_days[pk]).days + 1 if pk in first_days else 0
+        for pk, _, _ in info
+    ], dtype=int)
+    offsets = np.concatenate([[0], np.cumsum(history)[:-1]]).astype(int)
+    daily = np.zeros(history.sum())
+    if rows:
+        positions = np.array([
+            offsets[index[f]] + (d - first_days[f]).days
+            for f, d, _, _ in rows
+        ])
+        np.add.at(daily, positions, np.array([
+            float(total) * factors[(c, currencies[index[f]])]
+            for f, _, c, total in rows
+        ]))
+
+    saved, linear, average = fit_rates(daily, history, window)
+    remaining = cost - saved
+    linear_days = days_to_goal(remaining, linear)
+    average_days = days_to_goal(remaining, average)
+    days_left = np.array([
+        (expected - as_of).days if expected else np.nan
+        for _, _, expected in info
+    ], dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        required = np.where(
+            remaining <= 0, 0,
+            np.where(days_left > 0, remaining / days_left, np.nan)
+        )
+
+    def money(value, currency):
+        if math.isnan(value):
+            return None
+        return Money(to_decimal(float(value)), currency)
+
+    def projected(value):
+        if math.isnan(value):
+            return None
+        return as_of + timedelta(days=int(value))
+
+    return {
+        pk: Projection(
+            fund_id=pk,
+            currency=currency,
+            full_cost=money(cost[i], currency),
+            saved=money(saved[i], currency),
+            remaining=money(remaining[i], currency),
+            linear_rate=money(linear[i], currency),
+            average_rate=money(average[i], currency),
+            linear_date=projected(linear_days[i]),
+            average_date=projected(average_days[i]),
+            expected_date=expected,
+            required_daily=money(required[i], currency),
+            required_monthly=money(required[i] * DAYS_PER_MONTH, currency),
+        )
+        for i, (pk, currency, expected) in enumerate(info)
+    }
@@ -1,11 +1,26 @@
+import json
+import threading
+from datetime import date, timedelta
+from decimal import Decimal
+from unittest import mock
 from django.contrib.auth.models import User
-from django.test import TestCase
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test import Client, TestCase
 from django.utils import timezone
+from django.utils.six import StringIO
 from moneyed import Money, USD, BRL
 from fundcountdown.cash_flow.models import Account
 from fundcountdown.cash_flow.models import CashInput
 from fundcountdown.cash_flow.models import Expense
+from fundcountdown.core.cache import bump_version
+from fundcountdown.core.currency import rates
+from fundcountdown.core.models import RATES_SCOPE, ExchangeRate
+from fundcountdown.core.testing import FileDatabaseTestCase
+from fundcountdown.fund import projection
 from fundcountdown.fund.models import Fund
+from fundcountdown.fund.models import FundSummary
 
 
 class FundTest(TestCase):
@@ -88,3 +103,723 @@ class FundTest(TestCase):
 
         self.assertEqual(travel.full_cost, Money(3700, USD))
         self.assertEqual(travel.amount, Money(350, BRL))
+
+    def test_full_cost_queries(self):
+        travel = Fund.objects.first()
+        with self.assertNumQueries(1):
+            self.assertEqual(travel.full_cost, Money(3700, USD))
+
+    def test_full_costs(self):
+        partner = User.objects.get(username='p1')
+        travel = Fund.objects.first()
+        house = Fund.objects.create(name="House", description="New house")
+        empty = Fund.objects.create(name="Empty", description="No expenses")
+        painting = Expense.objects.create(
+            name="Painting",
+            description="Paint the walls",
+            value=Money(300, USD),
+            fund=house,
+            partner=partner
+        )
+        painting.quotations.create(
+            name="Cheap painter",
+            description="Cheap",
+            value=Money(250, USD),
+            fund=house,
+            partner=partner
+        )
+        expensive = painting.quotations.create(
+            name="Good painter",
+            description="Good",
+            value=Money(400, USD),
+            fund=house,
+            partner=partner
+        )
+        expensive.is_winner = True
+        expensive.save()
+
+        with self.assertNumQueries(1):
+            costs = Fund.objects.all().full_costs()
+        self.assertEqual(costs[travel.pk], {'USD': Money(3700, USD)})
+        self.assertEqual(costs[house.pk], {'USD': Money(400, USD)})
+        self.assertNotIn(empty.pk, costs)
+        self.assertEqual(empty.full_cost, Money(0, USD))
+
+    def test_with_costs(self):
+        partner = User.objects.get(username='p1')
+        house = Fund.objects.create(name="House", description="New house")
+        painting = Expense.objects.create(
+            name="Painting",
+            description="Paint the walls",
+            value=Money(300, USD),
+            fund=house,
+            partner=partner
+        )
+        painting.quotations.create(
+            name="Cheap painter",
+            description="Cheap",
+            value=Money(250, USD),
+            fund=house,
+            partner=partner
+        )
+
+        with self.assertNumQueries(3):
+            breakdown = [
+                (fund.name, fund.full_cost, [
+                    (e.name, e.has_quotation, e.winner.name, e.amount,
+                     len(e.quotations.all()))
+                    for e in fund.expenses.all()
+                ])
+                for fund in Fund.objects.with_costs().order_by('pk')
+            ]
+        self.assertEqual(breakdown, [
+            ('Travel Fund', Money(3700, USD), [
+                ('Home Rental', False, 'Home Rental', Money(900, USD), 0),
+                ('Airfare', True, 'Lower Airlines', Money(2800, USD), 2),
+            ]),
+            ('House', Money(250, USD), [
+                ('Painting', True, 'Cheap painter', Money(250, USD), 1),
+            ]),
+        ])
+
+    def test_balances(self):
+        travel = Fund.objects.first()
+        house = Fund.objects.create(name="House", description="New house")
+        empty = Fund.objects.create(name="Empty", description="No accounts")
+        Account.objects.create(name='Unused', description='', fund=travel)
+        bank = Account.objects.create(name='Bank', description='', fund=house)
+        CashInput.objects.create(
+            description='Salary', value=Money(1000, BRL),
+            entry_date=timezone.now(), account=bank
+        )
+        CashInput.objects.create(
+            description='Dollars', value=Money(50, USD),
+            entry_date=timezone.now(), account=bank
+        )
+
+        with self.assertNumQueries(1):
+            balances = Fund.objects.all().balances()
+        self.assertEqual(balances[travel.pk], {'BRL': Money(350, BRL)})
+        self.assertEqual(
+            balances[house.pk],
+            {'BRL': Money(1000, BRL), 'USD': Money(50, USD)}
+        )
+        self.assertNotIn(empty.pk, balances)
+        with self.assertNumQueries(1):
+            self.assertEqual(travel.amount, Money(350, BRL))
+        # Mixed currencies need a rate to the USD of the fund.
+        self.assertIsNone(house.amount)
+        self.assertEqual(empty.amount, Money(0, USD))
+        self.assertEqual(empty.balance, {})
+
+
+class FundSummaryTest(TestCase):
+
+    def setUp(self):
+        partner = User.objects.create(username='p1', password='p')
+        self.travel = Fund.objects.create(
+            name="Travel Fund",
+            description="Travel around the World",
+            currency='BRL'
+        )
+        self.house = Fund.objects.create(name="House", description="")
+        self.rent = Expense.objects.create(
+            name="Rent",
+            description="Monthly rent",
+            value=Money(100, BRL),
+            occurrence=10,
+            fund=self.travel,
+            partner=partner
+        )
+        self.wallet = Account.objects.create(
+            name='Wallet', description='', fund=self.travel
+        )
+        CashInput.objects.create(
+            description='Savings',
+            value=Money(250, BRL),
+            entry_date=timezone.now(),
+            account=self.wallet
+        )
+
+    def test_refresh(self):
+        summaries = {s.fund_id: s for s in FundSummary.objects.current()}
+        travel = summaries[self.travel.pk]
+        self.assertEqual(travel.full_cost, Money(1000, BRL))
+        self.assertEqual(travel.amount, Money(250, BRL))
+        self.assertEqual(travel.remaining, Money(750, BRL))
+        self.assertEqual(travel.progress, 25)
+        self.assertFalse(travel.is_dirty)
+
+        house = summaries[self.house.pk]
+        self.assertEqual(house.full_cost, Money(0, USD))
+        self.assertEqual(house.remaining, Money(0, USD))
+        self.assertIsNone(house.progress)
+
+        # Nothing is stale, so nothing is recomputed.
+        self.assertEqual(FundSummary.objects.refresh(), 0)
+
+    def test_dirty_marking(self):
+        FundSummary.objects.refresh()
+        CashInput.objects.bulk_create([CashInput(
+            description='Bonus',
+            value=Money(250, BRL),
+            entry_date=timezone.now(),
+            account=self.wallet
+        )])
+        self.assertTrue(FundSummary.objects.get(fund=self.travel).is_dirty)
+        self.assertFalse(FundSummary.objects.get(fund=self.house).is_dirty)
+        self.assertEqual(FundSummary.objects.refresh(), 1)
+        self.assertEqual(self.travel.summary.progress, 50)
+
+        self.rent.occurrence = 5
+        self.rent.save()
+        summary = FundSummary.objects.current([self.travel.pk]).get()
+        self.assertEqual(summary.full_cost, Money(500, BRL))
+        self.assertEqual(summary.progress, 100)
+
+    def test_moved_between_funds(self):
+        FundSummary.objects.refresh()
+        self.assertEqual(self.travel.full_cost, Money(1000, BRL))
+        self.assertEqual(self.travel.amount, Money(250, BRL))
+        self.house.currency = 'BRL'
+        self.house.save()
+
+        self.rent.fund = self.house
+        self.rent.save()
+        self.wallet.fund = self.house
+        self.wallet.save()
+        self.assertTrue(FundSummary.objects.get(fund=self.travel).is_dirty)
+        self.assertEqual(self.travel.full_cost, Money(0, BRL))
+        self.assertEqual(self.travel.amount, Money(0, BRL))
+        self.assertEqual(self.house.full_cost, Money(1000, BRL))
+
+        self.assertEqual(FundSummary.objects.refresh(), 2)
+        self.assertEqual(
+            FundSummary.objects.get(fund=self.travel).full_cost, Money(0, BRL)
+        )
+
+    def test_mixed_currencies(self):
+        CashInput.objects.create(
+            description='Dollars',
+            value=Money(10, USD),
+            entry_date=timezone.now(),
+            account=self.wallet
+        )
+        summary = FundSummary.objects.current([self.travel.pk]).get()
+        self.assertIsNone(summary.amount)
+        self.assertIsNone(summary.progress)
+
+        # With the rate, every figure is in the currency of the fund.
+        self.addCleanup(bump_version, RATES_SCOPE)
+        ExchangeRate.objects.create(source='USD', target='BRL', rate=5)
+        summary = FundSummary.objects.current([self.travel.pk]).get()
+        self.assertEqual(summary.full_cost, Money(1000, BRL))
+        self.assertEqual(summary.amount, Money(300, BRL))
+        self.assertEqual(summary.remaining, Money(700, BRL))
+        self.assertEqual(summary.progress, 30)
+        self.assertEqual(
+            Fund.objects.get(pk=self.travel.pk).amount, Money(300, BRL)
+        )
+        self.assertEqual(self.wallet.balance, Money(300, BRL))
+
+    def test_single_foreign_currency(self):
+        # Totals in a single currency are kept in it, even when it isn't
+        # the fund's, and need no rate.
+        self.house.currency = 'BRL'
+        self.house.save()
+        Expense.objects.create(
+            name="Roof", description="", value=Money(100, USD),
+            fund=self.house,
+            partner=User.objects.get(username='p1')
+        )
+        self.assertEqual(self.house.full_cost, Money(100, USD))
+        summary = FundSummary.objects.current([self.house.pk]).get()
+        self.assertEqual(summary.full_cost, Money(100, USD))
+        self.assertEqual(summary.remaining, Money(100, USD))
+        self.assertEqual(summary.progress, 0)
+
+        # The gap between a USD cost and a BRL balance needs the rate.
+        bank = Account.objects.create(
+            name='Bank', description='', fund=self.house
+        )
+        CashInput.objects.create(
+            description='Savings', value=Money(200, BRL),
+            entry_date=timezone.now(), account=bank
+        )
+        summary = FundSummary.objects.current([self.house.pk]).get()
+        self.assertEqual(summary.amount, Money(200, BRL))
+        self.assertIsNone(summary.remaining)
+        self.assertIsNone(summary.progress)
+
+        self.addCleanup(bump_version, RATES_SCOPE)
+        ExchangeRate.objects.create(source='USD', target='BRL', rate=4)
+        summary = FundSummary.objects.current([self.house.pk]).get()
+        self.assertEqual(summary.full_cost, Money(100, USD))
+        self.assertEqual(summary.remaining, Money(200, BRL))
+        self.assertEqual(summary.progress, 50)
+
+
+class FundSummaryConcurrencyTest(FileDatabaseTestCase):
+
+    def test_concurrent_refresh(self):
+        partner = User.objects.create(username='p1', password='p')
+        funds = []
+        for i in range(3):
+            fund = Fund.objects.create(name="Fund {}".format(i))
+            Expense.objects.create(
+                name="Rent", value=Money(100 * (i + 1), USD), fund=fund,
+                partner=partner
+            )
+            funds.append(fund.pk)
+        barrier = threading.Barrier(6)
+        errors = []
+
+        def refresh():
+            try:
+                barrier.wait()
+                list(FundSummary.objects.current(funds))
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=refresh) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(
+            sorted(FundSummary.objects.values_list(
+                'fund', 'full_cost', 'is_dirty'
+            )),
+            [(pk, Decimal(100 * (i + 1)), False)
+             for i, pk in enumerate(funds)]
+        )
+
+
+class ProjectionTest(TestCase):
+
+    def setUp(self):
+        self.as_of = date(2016, 6, 30)
+        partner = User.objects.create(username='p1', password='p')
+        self.travel = Fund.objects.create(
+            name="Travel Fund",
+            description="",
+            expected_date=self.as_of + timedelta(days=45),
+        )
+        self.house = Fund.objects.create(name="House", description="")
+        self.car = Fund.objects.create(name="Car", description="")
+        for fund, cost in ((self.travel, 1000), (self.house, 500),
+                           (self.car, 50)):
+            Expense.objects.create(
+                name="Goal", description="", value=Money(cost, USD),
+                fund=fund, partner=partner
+            )
+        wallet = Account.objects.create(
+            name='Wallet', description='', fund=self.travel
+        )
+        garage = Account.objects.create(
+            name='Garage', description='', fund=self.car
+        )
+        noon = timezone.datetime(2016, 6, 21, 12, tzinfo=timezone.utc)
+        CashInput.objects.bulk_create([
+            CashInput(
+                description='Day {}'.format(day), value=Money(10, USD),
+                entry_date=noon + timedelta(days=day), account=wallet
+            )
+            for day in range(10)
+        ] + [
+            CashInput(
+                description='Once', value=Money(80, USD),
+                entry_date=noon, account=garage
+            ),
+            CashInput(
+                description='Later', value=Money(80, USD),
+                entry_date=noon + timedelta(days=30), account=garage
+            ),
+        ])
+
+    def test_projections(self):
+        with self.assertNumQueries(3):
+            projections = Fund.objects.projections(as_of=self.as_of)
+
+        travel = projections[self.travel.pk]
+        self.assertEqual(travel.saved, Money(100, USD))
+        self.assertEqual(travel.remaining, Money(900, USD))
+        self.assertEqual(travel.linear_rate, Money(10, USD))
+        self.assertEqual(travel.average_rate, Money(10, USD))
+        self.assertEqual(travel.linear_date, self.as_of + timedelta(days=90))
+        self.assertEqual(travel.required_daily, Money(20, USD))
+        self.assertEqual(travel.required_monthly, Money('608.75', USD))
+
+        house = projections[self.house.pk]
+        self.assertEqual(house.saved, Money(0, USD))
+        self.assertEqual(house.average_rate, Money(0, USD))
+        self.assertIsNone(house.linear_date)
+        self.assertIsNone(house.required_daily)
+
+        # Inputs after the day of the projection are left out.
+        car = projections[self.car.pk]
+        self.assertEqual(car.remaining, Money(-30, USD))
+        self.assertEqual(car.linear_date, self.as_of)
+        self.assertEqual(car.required_daily, Money(0, USD))
+
+    def test_own_history(self):
+        garage = Account.objects.get(name='Garage')
+        CashInput.objects.create(
+            description='Long ago', value=Money(5, USD),
+            entry_date=timezone.datetime(2006, 6, 30, tzinfo=timezone.utc),
+            account=garage
+        )
+        with mock.patch('fundcountdown.fund.projection.fit_rates',
+                        wraps=projection.fit_rates) as fit_rates:
+            projections = Fund.objects.projections(as_of=self.as_of)
+        daily, history, _ = fit_rates.call_args[0]
+        self.assertEqual(list(history), [10, 0, 3654])
+        self.assertEqual(len(daily), 3664)
+
+        travel = projections[self.travel.pk]
+        self.assertEqual(travel.linear_rate, Money(10, USD))
+        self.assertEqual(travel.average_rate, Money(10, USD))
+        self.assertEqual(projections[self.car.pk].saved, Money(85, USD))
+
+    def test_window(self):
+        travel = Fund.objects.filter(pk=self.travel.pk).projections(
+            as_of=self.as_of + timedelta(days=10), window=20
+        )[self.travel.pk]
+        self.assertEqual(travel.average_rate, Money(5, USD))
+        self.assertEqual(
+            travel.average_date, self.as_of + timedelta(days=190)
+        )
+
+    def test_missing_rate(self):
+        wallet = Account.objects.get(name='Wallet')
+        CashInput.objects.create(
+            description='Reais', value=Money(50, BRL),
+            entry_date=timezone.datetime(2016, 6, 1, tzinfo=timezone.utc),
+            account=wallet
+        )
+        travel = Fund.objects.projections(as_of=self.as_of)[self.travel.pk]
+        self.assertIsNone(travel.saved)
+        self.assertIsNone(travel.linear_date)
+
+
+class ForecastTest(TestCase):
+
+    def setUp(self):
+        self.as_of = date(2016, 6, 15)
+        self.addCleanup(bump_version, RATES_SCOPE)
+        partner = User.objects.create(username='p1', password='p')
+        self.travel = Fund.objects.create(name="Travel", description="")
+        self.house = Fund.objects.create(name="House", description="")
+        self.car = Fund.objects.create(name="Car", description="")
+        Expense.objects.create(
+            name="Hotel", description="", value=Money(250, USD),
+            occurrence=4, fund=self.travel, partner=partner,
+            due_date=timezone.datetime(2016, 5, 10, tzinfo=timezone.utc),
+        )
+        Expense.objects.create(
+            name="Airfare", description="", value=Money(1000, USD),
+            fund=self.travel, partner=partner,
+            due_date=timezone.datetime(2016, 9, 1, 12, tzinfo=timezone.utc),
+        )
+        wallet = Account.objects.create(
+            name='Wallet', description='', fund=self.travel
+        )
+        garage = Account.objects.create(
+            name='Garage', description='', fund=self.car
+        )
+        CashInput.objects.bulk_create([
+            CashInput(
+                description='April', value=Money(200, USD), account=wallet,
+                entry_date=timezone.datetime(
+                    2016, 4, 5, 12, tzinfo=timezone.utc
+                ),
+            ),
+            CashInput(
+                description='May', value=Money(400, USD), account=wallet,
+                entry_date=timezone.datetime(
+                    2016, 5, 5, 12, tzinfo=timezone.utc
+                ),
+            ),
+            CashInput(
+                description='Reais', value=Money(50, BRL), account=garage,
+                entry_date=timezone.datetime(
+                    2016, 5, 5, 12, tzinfo=timezone.utc
+                ),
+            ),
+        ])
+
+    def test_forecast(self):
+        rates()  # The rate table is cached across requests.
+        with self.assertNumQueries(3):
+            forecast = Fund.objects.forecast(months=6, as_of=self.as_of)
+
+        self.assertEqual(
+            forecast.fund_ids, [self.travel.pk, self.house.pk, self.car.pk]
+        )
+        self.assertEqual(forecast.months[0], date(2016, 6, 1))
+        self.assertEqual(forecast.months[-1], date(2016, 11, 1))
+
+        # 600 saved, less the May installment of the hotel.
+        self.assertEqual(forecast.opening[0], 350)
+        self.assertEqual(list(forecast.inflows[0]), [300] * 6)
+        self.assertEqual(
+            list(forecast.outflows[0]), [250, 250, 250, 1000, 0, 0]
+        )
+        self.assertEqual(
+            list(forecast.cumulative[0]), [400, 450, 500, -200, 100, 400]
+        )
+        self.assertEqual(
+            forecast.first_shortfall[self.travel.pk], date(2016, 9, 1)
+        )
+
+        self.assertEqual(list(forecast.cumulative[1]), [0] * 6)
+        self.assertIsNone(forecast.first_shortfall[self.house.pk])
+
+        # No BRL to USD rate.
+        self.assertTrue(all(v != v for v in forecast.cumulative[2]))
+        self.assertIsNone(forecast.first_shortfall[self.car.pk])
+
+    def test_history(self):
+        forecast = Fund.objects.filter(pk=self.travel.pk).forecast(
+            months=1, history=1, as_of=self.as_of
+        )
+        self.assertEqual(list(forecast.inflows[0]), [400])
+
+    def test_export(self):
+        ExchangeRate.objects.create(source='BRL', target='USD', rate='0.25')
+        output = StringIO()
+        call_command('export_forecast', months=2, stdout=output)
+        rows = output.getvalue().splitlines()
+        self.assertEqual(
+            rows[0], 'fund,currency,month,inflow,outflow,net,cumulative'
+        )
+        self.assertEqual(len(rows), 1 + 3 * 2)
+
+        output = StringIO()
+        call_command(
+            'export_forecast', format='json', months=2, stdout=output
+        )
+        funds = json.loads(output.getvalue())['funds']
+        self.assertEqual(
+            [f['id'] for f in funds],
+            [self.travel.pk, self.house.pk, self.car.pk]
+        )
+        self.assertEqual(funds[2]['opening'], 12.5)
+
+
+class DashboardTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='p1', password='p')
+        self.other = User.objects.create_user(username='p2', password='p')
+        self.now = timezone.now()
+        self.client.force_login(self.user)
+
+    def add_fund(self, name, cost, saved, users):
+        fund = Fund.objects.create(name=name, description="")
+        fund.partners.add(*users)
+        for months in (2, 1):
+            Expense.objects.create(
+                name="{} {}".format(name, months), description="",
+                value=Money(cost / 2, USD), fund=fund, partner=users[0],
+                due_date=self.now + timedelta(days=30 * months),
+            )
+        account = Account.objects.create(
+            name=name, description='', fund=fund
+        )
+        CashInput.objects.create(
+            description='Saved', value=Money(saved, USD),
+            entry_date=self.now, account=account
+        )
+        return fund
+
+    def dashboard(self, queries):
+        with self.assertNumQueries(queries):
+            response = self.client.get(reverse('dashboard'))
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content.decode())['funds']
+
+    def test_dashboard(self):
+        travel = self.add_fund('Travel', 1000, 250, [self.user, self.other])
+        self.add_fund('Hidden', 10, 1, [self.other])
+
+        funds = self.dashboard(13)
+        self.assertEqual(len(funds), 1)
+        self.assertEqual(funds[0]['id'], travel.pk)
+        self.assertEqual(
+            funds[0]['full_cost'], {'amount': 1000.0, 'currency': 'USD'}
+        )
+        self.assertEqual(
+            funds[0]['balance'], {'amount': 250.0, 'currency': 'USD'}
+        )
+        self.assertEqual(
+            funds[0]['gap'], {'amount': 750.0, 'currency': 'USD'}
+        )
+        self.assertEqual(funds[0]['progress'], 25.0)
+        self.assertEqual(funds[0]['next_due']['name'], 'Travel 1')
+        self.assertEqual(
+            funds[0]['next_due']['due_date'],
+            timezone.localtime(self.now + timedelta(days=30)).date(
+            ).isoformat()
+        )
+
+        # Summaries are up to date now.
+        self.dashboard(5)
+
+    def test_query_count(self):
+        self.add_fund('Travel', 1000, 250, [self.user])
+        self.dashboard(13)
+        for number in range(10):
+            self.add_fund(
+                'Fund {}'.format(number), 100, 10, [self.user, self.other]
+            )
+        self.assertEqual(len(self.dashboard(13)), 11)
+        self.assertEqual(len(self.dashboard(5)), 11)
+
+    def test_anonymous(self):
+        self.client.logout()
+        response = self.client.get(reverse('dashboard'))
+        self.assertEqual(response.status_code, 401)
+
+
+class DashboardConcurrencyTest(FileDatabaseTestCase):
+
+    def test_concurrent_requests(self):
+        users = [
+            User.objects.create_user(username='p{}'.format(i), password='p')
+            for i in range(4)
+        ]
+        for i in range(3):
+            fund = Fund.objects.create(name="Fund {}".format(i))
+            fund.partners.add(*users)
+            Expense.objects.create(
+                name="Rent", value=Money(100 * (i + 1), USD), fund=fund,
+                partner=users[0]
+            )
+            account = Account.objects.create(name="Wallet", fund=fund)
+        clients = []
+        for user in users:
+            client = Client()
+            client.force_login(user)
+            clients.append(client)
+        barrier = threading.Barrier(len(clients) + 1)
+        errors = []
+        responses = []
+
+        def get(client):
+            try:
+                barrier.wait()
+                for _ in range(3):
+                    responses.append(
+                        client.get(reverse('dashboard')).status_code
+                    )
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        def save():
+            # Marks the summaries of the last fund dirty between the reads.
+            try:
+                barrier.wait()
+                for day in range(3):
+                    CashInput.objects.create(
+                        description='Saved', value=Money(10, USD),
+                        entry_date=timezone.now() - timedelta(days=day),
+                        account=account
+                    )
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=get, args=(client,)) for client in clients
+        ] + [threading.Thread(target=save)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(responses, [200] * 12)
+        funds = json.loads(
+            clients[0].get(reverse('dashboard')).content.decode()
+        )['funds']
+        self.assertEqual(
+            [(f['full_cost']['amount'], f['balance']['amount'])
+             for f in funds],
+            [(100.0, 0.0), (200.0, 0.0), (300.0, 30.0)]
+        )
+
+
+class PartnerShareTest(TestCase):
+
+    def setUp(self):
+        self.addCleanup(bump_version, RATES_SCOPE)
+        self.p1 = User.objects.create_user(username='p1', password='p')
+        self.p2 = User.objects.create_user(username='p2', password='p')
+        self.travel = Fund.objects.create(name="Travel", description="")
+        self.travel.partners.add(self.p1, self.p2)
+        Expense.objects.create(
+            name="Hotel", description="", value=Money(300, USD),
+            fund=self.travel, partner=self.p1
+        )
+        airfare = Expense.objects.create(
+            name="Airfare", description="", value=Money(999, USD),
+            fund=self.travel, partner=self.p2
+        )
+        # The cheapest quotation wins, entered by the other partner.
+        for partner, value in ((self.p1, 400), (self.p2, 500)):
+            airfare.quotations.create(
+                name="Airline", description="", value=Money(value, USD),
+                fund=self.travel, partner=partner
+            )
+        Expense.objects.create(
+            name="Tour", description="", value=Money(100, BRL),
+            fund=self.travel, partner=self.p2
+        )
+        ExchangeRate.objects.create(source='BRL', target='USD', rate='0.25')
+
+    def test_partner_shares(self):
+        rates()  # The rate table is cached across requests.
+        with self.assertNumQueries(1):
+            shares = Fund.objects.partner_shares()[self.travel.pk]
+
+        self.assertEqual(
+            [(s.username, s.amount, s.share) for s in shares],
+            [('p1', Money(700, USD), Decimal('96.55')),
+             ('p2', Money(25, USD), Decimal('3.45'))]
+        )
+        self.assertEqual(shares[1].totals, {'BRL': Money(100, BRL)})
+
+    def test_missing_rate(self):
+        ExchangeRate.objects.all().delete()
+        shares = Fund.objects.partner_shares()[self.travel.pk]
+        self.assertEqual(
+            [(s.username, s.amount, s.share) for s in shares],
+            [('p1', None, None), ('p2', None, None)]
+        )
+
+    def test_endpoint(self):
+        hidden = Fund.objects.create(name="Hidden", description="")
+        hidden.partners.add(self.p2)
+        self.client.force_login(self.p1)
+        response = self.client.get(reverse('partner-shares'))
+        funds = json.loads(response.content.decode())['funds']
+        self.assertEqual([f['id'] for f in funds], [self.travel.pk])
+        self.assertEqual(funds[0]['partners'][0], {
+            'id': self.p1.pk,
+            'username': 'p1',
+            'totals': {'USD': 700.0},
+            'amount': {'amount': 700.0, 'currency': 'USD'},
+            'share': 96.55,
+        })
+
+        self.client.logout()
+        response = self.client.get(reverse('partner-shares'))
+        self.assertEqual(response.status_code, 401)
@@ -0,0 +1,8 @@
+from django.conf.urls import url
+from fundcountdown.fund import views
+
+
+urlpatterns = [
+    url(r'^dashboard/$', views.dashboard, name='dashboard'),
+    url(r'^partners/$', views.partner_shares, name='partner-shares'),
+]
@@ -1,3 +1,104 @@
-from django.shortcuts import render
+from collections import OrderedDict
+from django.http import JsonResponse
+from django.views.decorators.http import require_GET
+from fundcountdown.fund.models import FundSummary
 
-# Create your views here.
+
+def money_json(money):
+    if money is None:
+        return None
+    return OrderedDict([
+        ('amount', float(money.amount)),
+        ('currency', str(money.currency)),
+    ])
+
+
+def installment_json(installment):
+    if installment is None:
+        return None
+    return OrderedDict([
+        ('expense', installment.expense_id),
+        ('name', installment.name),
+        ('due_date', installment.due_date.date().isoformat()),
+        ('installment', installment.number),
+        ('installments', installment.count),
+        ('value', money_json(installment.value)),
+    ])
+
+
+def authentication_required():
+    return JsonResponse({'error': 'Authentication required.'}, status=401)
+
+
+@require_GET
+def dashboard(request):
+    """ Every fund of the logged in user with its cost, balance, gap to the
+    cost, progress and next installment due.
+
+    Takes a fixed number of queries however many funds and expenses there
+    are: the stale summaries are refreshed in bulk, see
+    FundSummaryQuerySet.refresh.
+    """
+    if not request.user.is_authenticated():
+        return authentication_required()
+    funds = request.user.funds.all()
+    summaries = FundSummary.objects.current(funds).order_by(
+        'fund__name', 'fund'
+    )
+    upcoming = funds.next_installments()
+    return JsonResponse({'funds': [
+        OrderedDict([
+            ('id', summary.fund.pk),
+            ('name', summary.fund.name),
+            ('currency', summary.fund.currency),
+            ('expected_date', (
+                summary.fund.expected_date.isoformat()
+                if summary.fund.expected_date else None
+            )),
+            ('full_cost', money_json(summary.full_cost)),
+            ('balance', money_json(summary.amount)),
+            ('gap', money_json(summary.remaining)),
+            ('progress', (
+                float(summary.progress)
+                if summary.progress is not None else None
+            )),
+            ('next_due', installment_json(upcoming.get(summary.fund.pk))),
+        ])
+        for summary in summaries
+    ]})
+
+
+@require_GET
+def partner_shares(request):
+    """ What each partner committed to every fund of the logged in user,
+    for settling up: totals per currency, amount in the fund currency and
+    share of the fund total.
+    """
+    if not request.user.is_authenticated():
+        return authentication_required()
+    funds = request.user.funds.order_by('name', 'pk')
+    shares = funds.partner_shares()
+    return JsonResponse({'funds': [
+        OrderedDict([
+            ('id', pk),
+            ('name', name),
+            ('currency', currency),
+            ('partners', [
+                OrderedDict([
+                    ('id', share.partner_id),
+                    ('username', share.username),
+                    ('totals', OrderedDict(
+                        (code, float(money.amount))
+                        for code, money in sorted(share.totals.items())
+                    )),
+                    ('amount', money_json(share.amount)),
+                    ('share', (
+                        float(share.share)
+                        if share.share is not None else None
+                    )),
+                ])
+                for share in shares.get(pk, [])
+            ]),
+        ])
+        for pk, name, currency in funds.values_list('pk', 'name', 'currency')
+    ]})
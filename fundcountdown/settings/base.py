@@ -1,5 +1,8 @@
+import atexit
 import os
+import shutil
 import sys
+import tempfile
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 PROJECT_DIR = os.path.join(BASE_DIR, 'fundcountdown')
@@ -29,18 +32,22 @@ INSTALLED_APPS = [
 
     # Custom
     'fundcountdown.core',
+    'fundcountdown.fund',
     'fundcountdown.cash_flow',
 ]
 
 MIDDLEWARE_CLASSES = [
+    'fundcountdown.core.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.auth.middleware.SessionAuthenticationMiddleware',
+    'fundcountdown.core.middleware.PropertyProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'fundcountdown.core.middleware.RequestMemoMiddleware',
 ]
 
 ROOT_URLCONF = 'fundcountdown.urls'
@@ -75,6 +82,99 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/1.9/topics/cache/
+# Computed fund and account figures are cached under versioned keys, see
+# fundcountdown.core.cache. Writes invalidate them by bumping a version
+# kept in the same cache, so every process serving the site (gunicorn
+# workers, management commands) must share it: the file based default on
+# one host, memcached or redis across hosts. A process-local backend such
+# as LocMemCache only keeps values for PROPERTY_CACHE_LOCAL_TIMEOUT
+# seconds, since the other processes can't invalidate them.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('CACHE_DIR', os.path.join(
+            tempfile.gettempdir(), 'fundcountdown-cache'
+        )),
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    }
+}
+
+# Tests clear the cache: `manage.py test` gets a directory of its own,
+# removed on exit, instead of the one of the processes serving the site.
+if sys.argv[1:2] == ['test']:
+    CACHES['default']['LOCATION'] = tempfile.mkdtemp(
+        prefix='fundcountdown-test-cache-'
+    )
+    atexit.register(shutil.rmtree, CACHES['default']['LOCATION'], True)
+
+PROPERTY_CACHE_ALIAS = 'default'
+PROPERTY_CACHE_TIMEOUT = 60 * 60 * 24
+PROPERTY_CACHE_LOCAL_TIMEOUT = 5
+
+
+# Request metrics
+# Query count and timings of every request, see
+# fundcountdown.core.middleware.RequestMetricsMiddleware. Budgets are
+# queries per request, by URL name or for every URL; going over them logs
+# a warning or, with 'raise', fails the request.
+
+REQUEST_METRICS_HEADER = True
+
+QUERY_BUDGET = None
+QUERY_BUDGETS = {
+    'dashboard': 15,
+    'partner-shares': 10,
+}
+QUERY_BUDGET_ACTION = 'log'
+
+
+# Metrics
+# Prometheus endpoint at /metrics, see fundcountdown.core.metrics. Off by
+# default. Processes that share METRICS_DIR (e.g. the gunicorn workers of
+# one host) are added up; without it each process reports its own. Exited
+# workers must be marked dead from gunicorn's child_exit hook, see there.
+
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED') == '1'
+METRICS_DIR = os.environ.get('METRICS_DIR')
+METRICS_FLUSH_INTERVAL = 1.0
+
+
+# Property profiling
+# Call trees of the model properties as collapsed stacks, see
+# fundcountdown.core.profiling. Every request is traced with
+# PROFILE_PROPERTIES, otherwise staff users send the PROFILE_HEADER header.
+# The files are never removed, clean PROFILE_DIR up periodically.
+
+PROFILE_PROPERTIES = False
+PROFILE_HEADER = 'X-Profile-Properties'
+PROFILE_DIR = os.environ.get('PROFILE_DIR')
+
+# Every request is logged at INFO and query budget overruns at WARNING.
+# Only the overruns are logged by default, set REQUEST_LOG_LEVEL=INFO to
+# log every request.
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'fundcountdown.requests': {
+            'handlers': ['console'],
+            'level': os.environ.get('REQUEST_LOG_LEVEL', 'WARNING'),
+        },
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/1.9/ref/settings/#auth-password-validators
 
@@ -4,5 +4,7 @@ from django.contrib import admin
 
 urlpatterns = [
     url(r'', include('fundcountdown.core.urls')),
+    url(r'^api/', include('fundcountdown.cash_flow.urls')),
+    url(r'^api/', include('fundcountdown.fund.urls')),
     url(r'^admin/', admin.site.urls),
 ]